@@ -6,14 +6,16 @@ Ran as a standalone script this creates prompts for the information it needs in
 order to check the links.
 """
 
-import os.path
 import sys
 import csv
-import getopt
+import collections
+import contextlib
+import heapq
+import io
+import json
 
-from bs4 import BeautifulSoup
-
-from util import site_caching, bookinfo
+from util import bookinfo, link_graph, link_index, metrics, parallel
+from util import sharding, site_caching, snapshots
 
 EXCLUDED_HEADING_IDS = (
     'Buchanfänge',
@@ -22,19 +24,16 @@ EXCLUDED_HEADING_IDS = (
 
 
 def check_links_on_page(page, page_dict):
-    """This taks a BeautifulSoup object and checks if all links on it exist."""
-    # Create a copy of the page as we are going to remove stuff from it
-    page = BeautifulSoup(str(page), 'html.parser')
-    # Remove Serlo head since it contains parts of the sitemap
-    # We don't wan't to check the links in there. They all exist or provide
-    # unnecessary redlink warnings.
-    serlo_header = page.find(id='serlo-header')
-    if serlo_header is not None:
-        serlo_header.extract()
-    links, redlinks = bookinfo.find_links(page, warn_redlinks=True)
+    """
+    Check if all links on a page exist. page is the PageRecord of the page
+    (see util.link_index) and page_dict maps the page urls to their
+    PageRecord.
+    """
+    for link in page.redlinks:
+        print('Found link pointing to nonexistent page: {}'.format(link))
     bad_links = [{'target': link, 'id': '', 'reason': 'Redlink'}
-                 for link in redlinks]
-    for link in links:
+                 for link in page.redlinks]
+    for link in page.links:
         # Ignore external links
         if not link.startswith('/'):
             continue
@@ -53,10 +52,9 @@ def check_links_on_page(page, page_dict):
             })
             continue
         target_page = page_dict[linked_page]
-        if not target_page.find(id=linked_id):
+        if linked_id not in target_page.ids:
             print('Found a link from "{}" to "{}". On the target page the id "{}" is not present.'.
-                  format(page.title.get_text(), target_page.title.get_text(),
-                         linked_id))
+                  format(page.title, target_page.title, linked_id))
             bad_links.append({
                 'target': linked_page,
                 'id': linked_id,
@@ -65,6 +63,77 @@ def check_links_on_page(page, page_dict):
     return bad_links
 
 
+def parse_page(html):
+    """Return the PageRecord of a page together with the hash of its HTML."""
+    return (link_index.parse_page_record(html),
+            site_caching.content_hash(html))
+
+
+@metrics.timed('build_link_index')
+def build_link_index(pages, cache=None, jobs=1, books=None):
+    """
+    Build the link index of the given pages, which is an iterable of
+    (url, html) pairs. Every page is reduced to its PageRecord as soon as it
+    is read. If cache is given, the index entries of pages whose HTML didn't
+    change are read from the cache instead of parsing the pages and new
+    entries are stored there. If books is given, cached entries of pages
+    which don't belong to any of the books are dropped from the cache.
+    With jobs > 1 the pages are parsed by a pool of jobs processes.
+    Return a dictionary mapping the page urls to their PageRecord.
+    """
+    index = {}
+    indexed_hashes = {}
+    if cache is not None:
+        index = {url: link_index.PageRecord(title, frozenset(ids), links,
+                                            redlinks)
+                 for (url, (title, ids, links, redlinks))
+                 in site_caching.read_link_index(cache,
+                                                 indexed_hashes).items()}
+    if books is not None:
+        book_urls = {url for book in books for url in books[book]}
+        removed_urls = [url for url in index if url not in book_urls]
+        for url in removed_urls:
+            del index[url]
+        if removed_urls:
+            site_caching.remove_link_index(removed_urls, cache)
+    new_urls = []
+
+    def unindexed_pages():
+        for (url, html) in pages:
+            # While the pages are fetched again, the cache still contains
+            # the old HTML, which the cached entries match.
+            if url not in index or \
+               indexed_hashes[url] != site_caching.content_hash(html):
+                new_urls.append(url)
+                yield html
+
+    new_entries = {}
+    page_hashes = {}
+    for (position, (record, page_hash)) in enumerate(
+            parallel.ordered_map(parse_page, unindexed_pages(), jobs)):
+        new_entries[new_urls[position]] = record
+        page_hashes[new_urls[position]] = page_hash
+    if cache is not None and new_entries:
+        site_caching.store_link_index(
+            {url: new_entries[url].astuple() for url in new_entries},
+            page_hashes, cache)
+    index.update(new_entries)
+    return index
+
+
+@metrics.timed('build_link_graph')
+def store_link_graph(books, index, cache=None):
+    """
+    Build the graph of the links between the pages of the books from the
+    link index and store it in the cache if one is given, so cache_tool.py
+    can analyse it later. Return the graph.
+    """
+    graph = link_graph.build_link_graph(books, index)
+    if cache is not None:
+        graph.save(cache)
+    return graph
+
+
 def yes_no_prompt(prompt, default=None):
     """
     Asks Yes/No Question. If default is not None an empty answer will yield
@@ -109,30 +178,176 @@ def check_book(pages_of_book, pages):
     return bad_book_links
 
 
+# Link index of the worker processes of check_books
+WORKER_PAGES = {}
+
+
+def init_check_worker(pages):
+    """Initialise a worker process of check_books."""
+    WORKER_PAGES.clear()
+    WORKER_PAGES.update(pages)
+
+
+def check_book_worker(pages_of_book):
+    """
+    Check a book in a worker process. Return the messages printed during the
+    check together with the bad links.
+    """
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        bad_data = check_book(pages_of_book, WORKER_PAGES)
+    return (output.getvalue(), bad_data)
+
+
+def check_books(books_to_check, books, pages, jobs=1):
+    """
+    Generator yielding (book, bad links) for every book in books_to_check in
+    this order. With jobs > 1 the books are checked by a pool of jobs
+    processes. The messages printed by the checks are output in the same
+    order as in a serial run.
+    """
+    if jobs <= 1:
+        for book in books_to_check:
+            print('Checking book "{}":'.format(book))
+            with metrics.stage('check_book'):
+                bad_data = check_book(books[book], pages)
+            metrics.count('matches.bad_links', len(bad_data))
+            yield (book, bad_data)
+        return
+    results = parallel.ordered_map(
+        check_book_worker, [books[book] for book in books_to_check], jobs,
+        initializer=init_check_worker, initargs=(pages,))
+    for (book, (output, bad_data)) in zip(
+            books_to_check, metrics.timed_iter('check_book', results)):
+        metrics.count('matches.bad_links', len(bad_data))
+        print('Checking book "{}":'.format(book))
+        print(output, end='')
+        yield (book, bad_data)
+
+
+def describe_bad_link(bad_link):
+    """Return a description of a bad link found by check_links_on_page."""
+    if bad_link['id']:
+        return '{}#{}: {}'.format(bad_link['target'], bad_link['id'],
+                                  bad_link['reason'])
+    return '{}: {}'.format(bad_link['target'], bad_link['reason'])
+
+
+def diff_bad_links(old, new, cache='cache.db'):
+    """
+    Check the links of the rendered pages affected by the changes between
+    the snapshots old and new (see util.snapshots), i.e. the added, removed
+    and changed pages and the pages linking to them. Only the pages without
+    a valid entry in the link index of the cache are parsed. Return the new
+    and the resolved bad links as sorted lists of (source, description)
+    pairs.
+    """
+    (added, removed, changed, old_hashes, new_hashes) = snapshots.diff_pages(
+        old, new, cache, action='view')
+    current = snapshots.page_hashes(None, cache, action='view')
+    records = {current[url]: link_index.PageRecord(title, frozenset(ids),
+                                                   links, redlinks)
+               for (url, (title, ids, links, redlinks))
+               in site_caching.read_link_index(cache).items()}
+
+    def index_of(hashes):
+        index = {}
+        for (url, page_hash) in hashes.items():
+            if page_hash not in records:
+                records[page_hash] = link_index.parse_page_record(
+                    snapshots.read_content(page_hash, cache))
+            index[url] = records[page_hash]
+        return index
+
+    old_index = index_of(old_hashes)
+    new_index = index_of(new_hashes)
+    touched = set(added + removed + changed)
+    affected = set(touched)
+    for index in (old_index, new_index):
+        affected.update(url for (url, record) in index.items()
+                        if any(link.split('#', 1)[0] in touched
+                               for link in record.links))
+
+    def bad_links(url, index):
+        if url not in index:
+            return collections.Counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            return collections.Counter(
+                describe_bad_link(bad_link)
+                for bad_link in check_links_on_page(index[url], index))
+
+    new_links = []
+    resolved_links = []
+    for url in sorted(affected):
+        before = bad_links(url, old_index)
+        after = bad_links(url, new_index)
+        new_links.extend((url, description) for description
+                         in sorted((after - before).elements()))
+        resolved_links.extend((url, description) for description
+                              in sorted((before - after).elements()))
+    return (new_links, resolved_links)
+
+
+def write_bad_rows(logfile, results):
+    """
+    Write the bad links to the CSV file logfile. results is an iterable of
+    (book, bad links) pairs like the one returned by check_books.
+    """
+    with open(logfile, 'w', newline='') as csv_logfile:
+        fieldnames = ['book', 'source', 'target', 'id', 'reason']
+        log_writer = csv.DictWriter(csv_logfile, fieldnames=fieldnames)
+        log_writer.writeheader()
+        for (book, bad_data) in results:
+            for datum in bad_data:
+                log_writer.writerow({'book': book, **datum})
+
+
+def write_bad_log(logfile, books_to_check, books, pages, jobs=1):
+    """
+    Check the books in books_to_check (see check_books) and write the bad
+    links to the CSV file logfile.
+    """
+    write_bad_rows(logfile, check_books(books_to_check, books, pages, jobs))
+
+
+def write_bad_partial(partial, shard, books_to_check, books, pages, jobs=1):
+    """
+    Check the books in books_to_check (see check_books) and write the bad
+    links of every book together with its position in books to the partial
+    result file partial (see util.sharding) of the given shard. The
+    fingerprint in its header covers the books and the link index pages.
+    """
+    positions = {book: position for (position, book) in enumerate(books)}
+    writer = sharding.PartialWriter(partial, 'bad_links', shard)
+    for (book, bad_data) in check_books(books_to_check, books, pages, jobs):
+        writer.write(position=positions[book], book=book, bad_links=bad_data)
+    fingerprint = sharding.new_fingerprint(books)
+    for url in sorted(pages):
+        record = pages[url]
+        fingerprint.update(json.dumps(
+            [url, record.title, sorted(record.ids), record.links,
+             record.redlinks]).encode('utf-8'))
+    writer.close(fingerprint)
+
+
+def merge_bad_links(logfile, paths):
+    """
+    Merge the bad links in the partial result files paths written by
+    write_bad_partial for disjoint shards into the CSV file logfile, where
+    the books are in the order of a run without shards.
+    """
+    records = heapq.merge(*(sharding.iter_records(path) for path in paths),
+                          key=lambda record: record['position'])
+    write_bad_rows(logfile, ((record['book'], record['bad_links'])
+                             for record in records))
+
+
 def main():
     """Main function when called from command line."""
-    def postprocess_page(string):
-        return BeautifulSoup(string, "html.parser")
-
-    (opts_list, args) = getopt.getopt(sys.argv[1:], 'c:rlb:')
+    # The links of all pages are needed to check the books of a shard.
+    (books, pages, (opts_list, args)) = bookinfo.book_argument_parser(
+        'lb:', action='view', stream=True, sharded=False)
     opts = dict(opts_list)
 
-    if '-c' in opts and os.path.isfile(opts['-c']) and '-r' not in opts:
-        (books, pages) = site_caching.read_cached_data(
-            cache=opts['-c'],
-            page_postprocessor=postprocess_page)
-    else:
-        books = bookinfo.fetch_article_list()
-        pages = {}
-        for book in books:
-            pages = {
-                **pages,
-                **bookinfo.fetch_pages_from_list(
-                    books[book], page_postprocessor=postprocess_page)
-            }
-        if '-c' in opts:
-            site_caching.cache_page_data(books, pages, cache=opts['-c'])
-
     if '-l' in opts:
         print("The follwing books are available:")
         for book in books:
@@ -148,19 +363,25 @@ def main():
             sys.exit(1)
     else:
         books_to_check = books.keys()
+    shard = sharding.parse_shard(opts)
+    if shard is not None:
+        # The books are distributed to the shards in any case.
+        books_to_check = [book for (position, book) in enumerate(books)
+                          if book in books_to_check and
+                          shard.has_book(position)]
+
+    jobs = parallel.parse_processes(opts)
+    pages = build_link_index(pages, opts.get('-c'), jobs, books)
+    store_link_graph(books, pages, opts.get('-c'))
 
     logfile = 'bad_log.csv'
     if len(args) >= 1:
         logfile = args[0]
-    with open(logfile, 'w', newline='') as csv_logfile:
-        fieldnames = ['book', 'source', 'target', 'id', 'reason']
-        log_writer = csv.DictWriter(csv_logfile, fieldnames=fieldnames)
-        log_writer.writeheader()
-        for book in books_to_check:
-            print('Checking book "{}":'.format(book))
-            bad_data = check_book(books[book], pages)
-            for datum in bad_data:
-                log_writer.writerow({'book': book, **datum})
+    if '--partial' in opts:
+        write_bad_partial(opts['--partial'], shard, books_to_check, books,
+                          pages, jobs)
+    else:
+        write_bad_log(logfile, books_to_check, books, pages, jobs)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,6 @@
+"""
+Benchmarks of the diagnostic scripts for the Mathe für Nicht-Freaks project.
+
+The benchmarks run on synthetic corpora (see benchmarks.corpus), so they can
+be run without downloading anything from de.wikibooks.org.
+"""
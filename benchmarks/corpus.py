@@ -0,0 +1,310 @@
+"""
+Module for generating synthetic corpora resembling the Mathe für Nicht-Freaks
+project.
+
+A corpus consists of a sitemap in the shape bookinfo.parse_article_list
+expects, the WikiText of every article and its rendered HTML. The WikiText
+contains math environments, references, galleries, nested tables, marked
+sections, #lst transclusions and custom templates. The HTML contains anchors,
+links to anchors of other articles, redlinks and edit links. The contents of
+an article only depend on the seed and the number of the article, so they
+can be generated one at a time in any order.
+
+When run as a standalone script this writes a corpus into a cache file,
+which can be used with the option -c of the diagnostic scripts.
+"""
+
+import getopt
+import random
+import sys
+import urllib.parse
+
+from util import site_caching
+
+# Number of articles per book
+BOOK_SIZE = 50
+# Approximate length of the WikiText of an article in characters
+PAGE_SIZE = 8000
+# Book whose articles are skipped by most analyses
+CONTRIBUTING_BOOK = 'Mitmachen_für_(Nicht-)Freaks'
+TITLE_PREFIX = 'Mathe für Nicht-Freaks: '
+
+WORDS = (
+    'Folge', 'Grenzwert', 'Menge', 'Funktion', 'stetig', 'Beweis', 'also',
+    'gilt', 'für', 'alle', 'und', 'die', 'der', 'eine', 'reelle', 'Zahl',
+    'Körper', 'Vektorraum', 'Abbildung', 'linear', 'konvergiert', 'Reihe',
+    'Ableitung', 'Integral', 'Matrix', 'Basis', 'Dimension', 'Kern', 'Bild',
+    'wir', 'zeigen', 'dass', 'damit', 'Aussage', 'Voraussetzung', 'Über')
+MACROS = (
+    '\\frac{{{0}}}{{{1}}}', '\\overline{{{0}}}', '\\mathbb{{R}}',
+    '\\sqrt{{{0}}}', '\\sum_{{k=1}}^{{{1}}} {0}', '\\lim_{{n\\to\\infty}} {0}',
+    '\\left| {0} \\right|', '\\int_{{{0}}}^{{{1}}} x \\, dx',
+    '{0} \\leq {1}', '{0} \\cdot {1}', '\\epsilon', '\\{{ {0} \\}}')
+TEMPLATES = ('Satz', 'Definition', 'Beispiel', 'Beweis', 'Frage', 'Hinweis')
+
+
+def page_title(number):
+    """Return the title of the article with the given number."""
+    book = number // BOOK_SIZE
+    return '{}Buch {}: Kapitel {}'.format(TITLE_PREFIX, book, number)
+
+
+def page_url(number):
+    """Return the url of the article with the given number."""
+    return '/wiki/' + urllib.parse.quote(
+        page_title(number).replace(' ', '_'), safe=':')
+
+
+def section_count(number):
+    """Return the number of marked sections of the article."""
+    return number % 3
+
+
+def anchor_count(number):
+    """Return the number of headings with anchors of the rendered article."""
+    return 3 + number % 5
+
+
+def page_random(seed, number):
+    """Return the random number generator of the article."""
+    return random.Random(seed * 1000003 + number)
+
+
+def generate_books(page_count):
+    """
+    Return the books of a corpus with page_count articles as dictionary
+    containing the list of article urls of every book indexed by the book
+    names. The last few articles form the contributing book.
+    """
+    books = {}
+    contributing = max(page_count // 20, 1) if page_count > 1 else 0
+    for number in range(page_count - contributing):
+        books.setdefault('Buch_{}'.format(number // BOOK_SIZE), []).append(
+            page_url(number))
+    if contributing:
+        books[CONTRIBUTING_BOOK] = [
+            page_url(number)
+            for number in range(page_count - contributing, page_count)]
+    return books
+
+
+def sitemap_html(books):
+    """Return the HTML of the sitemap listing the given books."""
+    parts = ['<html><body><h2>Inhaltsverzeichnis</h2>']
+    for book in books:
+        parts.append('<h2><span class="mw-headline" id="{}">{}</span></h2>'
+                     '<ul>'.format(book, book.replace('_', ' ')))
+        for url in books[book]:
+            parts.append('<li><a href="{}">{}</a></li>'.format(
+                url, urllib.parse.unquote(url[6:]).replace('_', ' ')))
+        parts.append('<li><a href="/w/index.php?title=Fehlt&amp;'
+                     'action=edit&amp;redlink=1">Fehlt</a></li></ul>')
+    parts.append('<h2><span class="mw-headline" id="Über_das_Projekt">'
+                 'Über das Projekt</span></h2>'
+                 '<h2>Navigationsmenü</h2></body></html>')
+    return ''.join(parts)
+
+
+def words(rng, count):
+    """Return count random words."""
+    return ' '.join(rng.choices(WORDS, k=count))
+
+
+def formula(rng, depth=0):
+    """Return a random TeX formula."""
+    arguments = [rng.choice('abnxyz') if depth > 1 or rng.random() < 0.6
+                 else formula(rng, depth + 1) for _ in range(2)]
+    return rng.choice(MACROS).format(*arguments)
+
+
+def paragraph(rng, page_count):
+    """Return a paragraph of WikiText with inline math and references."""
+    parts = [words(rng, rng.randint(20, 60))]
+    for _ in range(rng.randint(0, 3)):
+        parts.append('<math>{}</math> {}'.format(formula(rng),
+                                                 words(rng, 10)))
+    if rng.random() < 0.3:
+        parts.append('<ref>{} {}</ref>'.format(words(rng, 6),
+                                               formula(rng)))
+    if rng.random() < 0.1:
+        parts.append('<ref name="q{}" />'.format(rng.randrange(5)))
+    if rng.random() < 0.2:
+        parts.append('[[{}|{}]]'.format(
+            page_title(rng.randrange(page_count)), words(rng, 2)))
+    return ' '.join(parts) + '\n\n'
+
+
+def table(rng, page_count, depth=0):
+    """Return a table, which may contain further tables."""
+    rows = ['{| class="wikitable"']
+    for _ in range(rng.randint(2, 5)):
+        rows.append('|-')
+        rows.append('| {} || <math>{}</math>'.format(words(rng, 3),
+                                                    formula(rng)))
+    if depth < 2 and rng.random() < 0.3:
+        rows.append('|-\n|')
+        rows.append(table(rng, page_count, depth + 1).rstrip('\n'))
+    rows.append('|}')
+    return '\n'.join(rows) + '\n\n'
+
+
+def template(rng, page_count, depth=0):
+    """Return a call of a custom template, which may contain templates."""
+    name = rng.choice(TEMPLATES)
+    if name == 'Hinweis' and rng.random() < 0.5:
+        return '{{:Mathe für Nicht-Freaks: Vorlage:Hinweis}}\n\n'
+    body = paragraph(rng, page_count).rstrip('\n')
+    if depth < 1 and rng.random() < 0.3:
+        body += '\n' + template(rng, page_count, depth + 1).rstrip('\n')
+    return ('{{{{:Mathe für Nicht-Freaks: Vorlage:{}\n|titel={}\n|inhalt={}'
+            '\n}}}}\n\n').format(name, words(rng, 3), body)
+
+
+def wikitext_page(seed, number, page_count, page_size=PAGE_SIZE):
+    """Return the WikiText of the article with the given number."""
+    rng = page_random(seed, number)
+    sections = list(range(section_count(number)))
+    parts = []
+    length = 0
+    size = rng.randint(page_size // 2, page_size * 3 // 2)
+    heading = 0
+    while length < size or sections:
+        kind = rng.random()
+        if sections and (kind < 0.1 or length >= size):
+            name = 's{}_{}'.format(number, sections.pop(0))
+            part = ('<section begin="{0}" />{1}<section end="{0}" />\n\n'
+                    .format(name, paragraph(rng, page_count).rstrip('\n')))
+        elif kind < 0.35:
+            part = paragraph(rng, page_count)
+        elif kind < 0.45:
+            part = '<math>\n{}\n= {}\n</math>\n\n'.format(formula(rng),
+                                                          formula(rng))
+        elif kind < 0.6:
+            part = template(rng, page_count)
+        elif kind < 0.7:
+            part = table(rng, page_count)
+        elif kind < 0.75:
+            part = '<gallery>\n{}\n</gallery>\n\n'.format('\n'.join(
+                'Datei:Bild {}.svg|{}'.format(rng.randrange(1000),
+                                              words(rng, 3))
+                for _ in range(rng.randint(1, 4))))
+        elif kind < 0.82:
+            target = rng.randrange(page_count)
+            part = '{{{{#lst:{}|s{}_{}}}}}\n\n'.format(
+                page_title(target), target, rng.randrange(3))
+        elif kind < 0.86:
+            part = '<!-- {{{{Vorlage:Alt}}}} <math>{}</math> -->\n'.format(
+                formula(rng))
+        else:
+            part = '== Abschnitt {} ==\n'.format(heading)
+            heading += 1
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)
+
+
+def link(rng, page_count):
+    """Return a random link of a rendered article."""
+    kind = rng.random()
+    target = rng.randrange(page_count)
+    if kind < 0.5:
+        # Links to anchors, some of which don't exist
+        return '<a href="{}#Abschnitt_{}">{}</a>'.format(
+            page_url(target), rng.randrange(8), words(rng, 2))
+    if kind < 0.8:
+        return '<a href="{}">{}</a>'.format(page_url(target), words(rng, 2))
+    if kind < 0.85:
+        return ('<a href="/w/index.php?title=Fehlt_{}&amp;action=edit&amp;'
+                'redlink=1" class="new">{}</a>').format(
+                    rng.randrange(100), words(rng, 1))
+    if kind < 0.95:
+        return ('<a href="/w/index.php?title={}&amp;action=edit&amp;'
+                'section={}">bearbeiten</a>').format(
+                    page_title(target), rng.randrange(5))
+    return '<a href="https://example.org/{}">extern</a>'.format(target)
+
+
+def html_page(seed, number, page_count, page_size=PAGE_SIZE):
+    """Return the rendered HTML of the article with the given number."""
+    rng = page_random(seed, -number - 1)
+    parts = ['<!DOCTYPE html><html><head><title>{} – Wikibooks</title>'
+             '</head><body><div id="serlo-header"><ul>'.format(
+                 page_title(number))]
+    for target in range(min(page_count, 10)):
+        parts.append('<li><a href="{}#Abschnitt_9">x</a></li>'.format(
+            page_url(target)))
+    parts.append('</ul></div><div id="content" class="mw-body">')
+    length = 0
+    heading = 0
+    size = rng.randint(page_size, page_size * 3)
+    while length < size or heading < anchor_count(number):
+        if heading < anchor_count(number) and rng.random() < 0.2:
+            part = ('<h2><span class="mw-headline" id="Abschnitt_{0}">'
+                    'Abschnitt {0}</span></h2>').format(heading)
+            heading += 1
+        else:
+            part = '<p>{} {} <span class="mwe-math-element">{}</span> ' \
+                   '{}</p>'.format(words(rng, 20), link(rng, page_count),
+                                   formula(rng), link(rng, page_count))
+        parts.append(part)
+        length += len(part)
+    parts.append('</div></body></html>')
+    return ''.join(parts)
+
+
+def iter_pages(page_count, seed=0, action='raw', page_size=PAGE_SIZE):
+    """
+    Generator yielding the (url, content) pairs of all articles of the
+    corpus in the representation action ('raw' or 'view').
+    """
+    generate = wikitext_page if action == 'raw' else html_page
+    for number in range(page_count):
+        yield (page_url(number), generate(seed, number, page_count,
+                                          page_size))
+
+
+def write_cache(cache, page_count, seed=0, page_size=PAGE_SIZE,
+                actions=('raw', 'view'), storage_format='text'):
+    """
+    Write the corpus into the cache database cache. The pages are generated
+    and written in chunks, so even large corpora don't have to fit into
+    memory. Existing books and pages in the cache are replaced.
+    """
+    db_connection = site_caching.open_cache_db(cache)
+    site_caching.reset_cache_db(db_connection)
+    site_caching.insert_books(db_connection, generate_books(page_count))
+    for action in actions:
+        chunk = {}
+        for (url, content) in iter_pages(page_count, seed, action,
+                                         page_size):
+            chunk[url] = content
+            if len(chunk) >= 1000:
+                site_caching.insert_pages(db_connection, chunk,
+                                          storage_format=storage_format,
+                                          action=action)
+                chunk = {}
+        site_caching.insert_pages(db_connection, chunk,
+                                  storage_format=storage_format,
+                                  action=action)
+    db_connection.close()
+
+
+def main():
+    """Main program body."""
+    (opts_list, _) = getopt.getopt(sys.argv[1:], 'c:n:s:p:m:z:')
+    opts = dict(opts_list)
+    cache = opts.get('-c', 'corpus.db')
+    page_count = int(opts.get('-n', 1000))
+    seed = int(opts.get('-s', 0))
+    page_size = int(opts.get('-p', PAGE_SIZE))
+
+    print('Writing {} pages to {}.'.format(page_count, cache))
+    write_cache(cache, page_count, seed, page_size,
+                storage_format=opts.get('-z', 'text'))
+    if '-m' in opts:
+        with open(opts['-m'], 'w') as file:
+            file.write(sitemap_html(generate_books(page_count)))
+
+
+if __name__ == '__main__':
+    main()
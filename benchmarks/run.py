@@ -0,0 +1,306 @@
+"""
+Module for benchmarking the diagnostic scripts for the Mathe für Nicht-Freaks
+project on a synthetic corpus (see benchmarks.corpus).
+
+When run as a standalone script this generates a corpus, times the
+benchmarks and measures their peak memory usage. The results are written as
+JSON, so runs of different versions can be compared to catch regressions.
+"""
+
+import contextlib
+import getopt
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import bad_finder
+# The finders register their analyzers when they are imported.
+# pylint: disable=unused-import
+import boxen_finder
+import double_usage_finder
+import gallery_finder
+import ref_finder
+import table_finder
+import tex_macro_finder
+# pylint: enable=unused-import
+from util import analysis, bookinfo, corpus_file, site_caching, wikitext
+
+from . import corpus
+
+# Factor by which a benchmark has to be slower than in the baseline to be
+# reported as regression.
+DEFAULT_THRESHOLD = 1.25
+
+
+def bench_parse_article_list(context):
+    """Parse the sitemap."""
+    return len(bookinfo.parse_article_list(context['sitemap']))
+
+
+def bench_cache_page_data(context):
+    """Write the WikiText of all pages into a new cache."""
+    cache = os.path.join(context['directory'], 'write.db')
+    if os.path.exists(cache):
+        os.remove(cache)
+    site_caching.cache_page_data(context['books'], context['pages'], cache)
+    return len(context['pages'])
+
+
+def bench_read_cached_data(context):
+    """Read the books and the WikiText of all pages from the cache."""
+    (_, pages) = site_caching.read_cached_data(cache=context['cache'])
+    return len(pages)
+
+
+def make_extract_benchmark(analyzer_class):
+    """Return a benchmark of the extraction of analyzer_class."""
+    def bench_extract(context):
+        analyzer = analyzer_class()
+        for content in context['pages'].values():
+            # Every finder tokenizes the pages on its own.
+            wikitext.page_spans.cache_clear()
+            analyzer.extract(content)
+        return len(context['pages'])
+    bench_extract.__doc__ = 'Extract the findings of {} from all pages.' \
+        .format(analyzer_class.name)
+    return bench_extract
+
+
+def bench_run_analyzers(context):
+    """Run all analyzers in a single pass without result cache."""
+    analyzers = [analyzer_class() for analyzer_class in
+                 analysis.ANALYZERS.values()]
+    analysis.run_analyzers(analyzers, context['pages'].items(),
+                           context['books'])
+    return len(context['pages'])
+
+
+def bench_run_analyzers_pool(context):
+    """
+    Run all analyzers in a single pass without result cache, extracting the
+    findings in a pool of 4 processes.
+    """
+    analyzers = [analyzer_class() for analyzer_class in
+                 analysis.ANALYZERS.values()]
+    analysis.run_analyzers(analyzers, context['pages'].items(),
+                           context['books'], processes=4)
+    return len(context['pages'])
+
+
+def bench_export_corpus(context):
+    """Export the WikiText of all pages from the cache to a corpus file."""
+    return corpus_file.export_corpus(
+        os.path.join(context['directory'], 'corpus'), context['cache'])
+
+
+def bench_parse_pages(context):
+    """Parse the rendered pages into the records of the link index."""
+    context['records'] = {
+        url: bad_finder.parse_page(html)[0]
+        for (url, html) in site_caching.iter_pages(context['cache'],
+                                                   action='view')}
+    return len(context['records'])
+
+
+def bench_check_book(context):
+    """Check the links of all books."""
+    for book in context['books']:
+        bad_finder.check_book(context['books'][book], context['records'])
+    return len(context['books'])
+
+
+def bench_build_link_graph(context):
+    """Build the graph of the links between the pages."""
+    context['graph'] = bad_finder.store_link_graph(context['books'],
+                                                   context['records'])
+    return len(context['graph'].urls)
+
+
+def bench_link_graph_analyses(context):
+    """
+    Find the orphaned and unreachable pages of all books and the most linked
+    sections in the link graph.
+    """
+    graph = context['graph']
+    for book in range(len(graph.books)):
+        graph.orphans(book)
+        graph.unreachable(book)
+    graph.most_linked_sections()
+    return len(graph.urls)
+
+
+BENCHMARKS = {
+    'parse_article_list': bench_parse_article_list,
+    'cache_page_data': bench_cache_page_data,
+    'read_cached_data': bench_read_cached_data,
+}
+BENCHMARKS.update({
+    'extract_' + name: make_extract_benchmark(analyzer_class)
+    for (name, analyzer_class) in analysis.ANALYZERS.items()})
+BENCHMARKS.update({
+    'run_analyzers': bench_run_analyzers,
+    'run_analyzers_pool': bench_run_analyzers_pool,
+    'export_corpus': bench_export_corpus,
+    'parse_pages': bench_parse_pages,
+    'check_book': bench_check_book,
+    'build_link_graph': bench_build_link_graph,
+    'link_graph_analyses': bench_link_graph_analyses,
+})
+# Benchmarks whose results other benchmarks need. They are run untimed if
+# they weren't selected.
+REQUIREMENTS = {
+    'check_book': 'parse_pages',
+    'build_link_graph': 'parse_pages',
+    'link_graph_analyses': 'build_link_graph',
+}
+
+
+def measure(benchmark, context, memory=True):
+    """
+    Run the benchmark and return its results as dictionary containing the
+    elapsed 'seconds', the number of processed 'items' and (if memory is
+    True) the 'peak_memory' in bytes, which is measured in a second run.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        items = benchmark(context)
+        result = {'seconds': time.perf_counter() - start, 'items': items}
+        if memory:
+            tracemalloc.start()
+            benchmark(context)
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return result
+
+
+def prepare(name, context, done):
+    """
+    Run the benchmarks the benchmark name requires untimed, unless they are
+    in the set done of benchmarks which were run already.
+    """
+    if name not in REQUIREMENTS or REQUIREMENTS[name] in done:
+        return
+    requirement = REQUIREMENTS[name]
+    prepare(requirement, context, done)
+    with contextlib.redirect_stdout(io.StringIO()):
+        BENCHMARKS[requirement](context)
+    done.add(requirement)
+
+
+def git_revision():
+    """Return the git revision of the scripts or None if it is unknown."""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            check=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(page_count, seed=0, names=None, memory=True):
+    """
+    Generate a corpus with page_count pages and run the benchmarks with the
+    given names (all by default). Return the results as dictionary.
+    """
+    results = {
+        'pages': page_count,
+        'seed': seed,
+        'python': platform.python_version(),
+        'revision': git_revision(),
+        'benchmarks': {},
+    }
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        # The analyzers write their output files into the directory.
+        os.chdir(directory)
+        try:
+            cache = os.path.join(directory, 'corpus.db')
+            print('Generating {} pages.'.format(page_count))
+            corpus.write_cache(cache, page_count, seed)
+            books = corpus.generate_books(page_count)
+            context = {
+                'directory': directory,
+                'cache': cache,
+                'books': books,
+                'sitemap': corpus.sitemap_html(books),
+                'pages': dict(site_caching.iter_pages(cache)),
+            }
+            done = set()
+            for (name, benchmark) in BENCHMARKS.items():
+                if names and name not in names:
+                    continue
+                prepare(name, context, done)
+                result = measure(benchmark, context, memory)
+                results['benchmarks'][name] = result
+                done.add(name)
+                print('{:<28} {:>9.3f} s {:>10}'.format(
+                    name, result['seconds'],
+                    '{:.1f} MB'.format(result['peak_memory'] / 2**20)
+                    if memory else ''))
+        finally:
+            os.chdir(working_directory)
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Print the ratio of the times of the results and the baseline for every
+    benchmark. Return the names of the benchmarks which are slower than in
+    the baseline by more than threshold.
+    """
+    regressions = []
+    if baseline.get('pages') != results['pages']:
+        print('Warning: The baseline was measured on {} pages.'.format(
+            baseline.get('pages')))
+    for name in results['benchmarks']:
+        if name not in baseline.get('benchmarks', {}):
+            continue
+        ratio = results['benchmarks'][name]['seconds'] / \
+            max(baseline['benchmarks'][name]['seconds'], 1e-9)
+        regression = ratio > threshold
+        if regression:
+            regressions.append(name)
+        print('{:<28} {:>7.2f}x{}'.format(name, ratio,
+                                          ' REGRESSION' if regression
+                                          else ''))
+    return regressions
+
+
+def main():
+    """Main program body."""
+    (opts_list, names) = getopt.getopt(sys.argv[1:], 'n:s:o:b:t:Ml')
+    opts = dict(opts_list)
+
+    if '-l' in opts:
+        print('The following benchmarks are available:')
+        for (name, benchmark) in BENCHMARKS.items():
+            print('{:<28} {}'.format(name, benchmark.__doc__))
+        sys.exit(0)
+    for name in names:
+        if name not in BENCHMARKS:
+            print('Unknown benchmark "{}".'.format(name))
+            sys.exit(1)
+
+    results = run_benchmarks(int(opts.get('-n', 1000)),
+                             int(opts.get('-s', 0)), names,
+                             memory='-M' not in opts)
+    if '-o' in opts:
+        with open(opts['-o'], 'w') as file:
+            json.dump(results, file, indent=2)
+    if '-b' in opts:
+        with open(opts['-b']) as file:
+            baseline = json.load(file)
+        if compare(results, baseline,
+                   float(opts.get('-t', DEFAULT_THRESHOLD))):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
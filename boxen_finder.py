@@ -6,12 +6,13 @@ When run as a standalone script this performs all necessary steps for analysing
 the usage of custom templates on the Mathe für Nicht-Freaks project.
 """
 
-import os
-import sys
-import getopt
+import collections
 import re
 
-from util import bookinfo, site_caching
+from util import analysis, bookinfo, wikitext
+
+# Names of the custom templates
+TEMPLATE_REGEX = re.compile('^:Mathe\\s+für\\s+Nicht-Freaks:\\s+Vorlage:')
 
 
 def extract_templates(string):
@@ -19,50 +20,57 @@ def extract_templates(string):
     Find all occurences of custom templates in the given string and return them
     as a string array.
     """
-    math_regex = re.compile(
-        '{{:Mathe\\s+für\\s+Nicht-Freaks:\\s+Vorlage:[^|\\n]+')
-    findings = [s.strip() for s in math_regex.findall(string)]
-    return findings
+    return ['{{' + span.name
+            for span in wikitext.spans_of_kind(string, wikitext.TEMPLATE)
+            if TEMPLATE_REGEX.match(span.name)]
+
+
+@analysis.register_analyzer
+class BoxenAnalyzer(analysis.Analyzer):
+    """
+    Count the usages of custom templates. The alphabetically sorted templates
+    and their counts are printed and written to output (if not None). The
+    counts per page are stored in the statistics of the cache.
+    """
+    name = 'boxen'
+    version = 3
+    prefilter = ('Vorlage:',)
+
+    def __init__(self, output='out/boxen.txt'):
+        super().__init__()
+        self.output = output
+        self.template_counts = collections.Counter()
+
+    def extract(self, content):
+        return extract_templates(content)
+
+    def collect(self, url, findings):
+        self.template_counts.update(findings)
+
+    def count_items(self, findings):
+        return collections.Counter(findings)
+
+    def write_results(self):
+        out_text = []
+        for box in sorted(self.template_counts):
+            out_text.append(box + "\t" + str(self.template_counts[box]))
+
+        print('\n'.join(out_text))
+
+        if self.output is not None:
+            analysis.make_output_dir(self.output)
+            with open(self.output, 'w') as filehandle:
+                filehandle.write('\n'.join(out_text))
 
 
 def main():
     """Main program body."""
-    (opts_list, _) = getopt.getopt(sys.argv[1:], 'c:ro:')
+    (books, pages, (opts_list, _)) = bookinfo.book_argument_parser(
+        'o:', stream=True)
     opts = dict(opts_list)
 
-    if '-c' in opts and os.path.isfile(opts['-c']) and '-r' not in opts:
-        (books, pages) = site_caching.read_cached_data(cache=opts['-c'])
-    else:
-        books = bookinfo.fetch_article_list()
-        pages = {}
-        for book in books:
-            page_content = bookinfo.fetch_pages_from_list(
-                books[book], action='raw',
-                page_postprocessor=lambda byte_string:
-                byte_string.decode('utf-8'))
-            pages = {
-                **pages,
-                **page_content
-            }
-        if '-c' in opts:
-            site_caching.cache_page_data(books, pages, cache=opts['-c'])
-
-    tex_macros = []
-    for page in pages:
-        tex_macros.extend(extract_templates(pages[page]))
-
-    discovered_macros = list(set(tex_macros))
-    discovered_macros.sort()
-
-    out_text = []
-    for box in discovered_macros:
-        out_text.append(box + "\t" + str(tex_macros.count(box)))
-
-    print('\n'.join(out_text))
-
-    if '-o' in opts:
-        with open(opts['-o'], 'w') as filehandle:
-            filehandle.write('\n'.join(out_text))
+    analysis.run_analyzers([BoxenAnalyzer(opts.get('-o'))], pages,
+                           books, **analysis.parse_run_options(opts))
 
 
 if __name__ == '__main__':
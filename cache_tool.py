@@ -0,0 +1,325 @@
+"""
+Module for maintaining the cache databases used by the diagnostic scripts for
+the Mathe für Nicht-Freaks project.
+
+When run as a standalone script this performs the command given on the
+command line on the cache database.
+"""
+
+import os
+import sys
+import getopt
+import sqlite3
+import time
+
+from util import analysis, corpus_file, link_graph, site_caching, snapshots
+from util import statistics
+
+import bad_finder
+# The finders register their analyzers when they are imported.
+# pylint: disable=unused-import
+import boxen_finder
+import double_usage_finder
+import gallery_finder
+import ref_finder
+import table_finder
+import tex_macro_finder
+# pylint: enable=unused-import
+
+# Name of the link check of bad_finder.py for the diff command
+LINKS = 'links'
+
+
+def compress_command(cache, args):
+    """
+    Convert all pages in the cache into the storage format given as first
+    argument (zlib by default).
+    """
+    storage_format = args[0] if args else 'zlib'
+    if storage_format not in site_caching.STORAGE_FORMATS:
+        print('Unknown storage format "{}". Available formats: {}'.format(
+            storage_format, ', '.join(site_caching.STORAGE_FORMATS)))
+        sys.exit(1)
+    old_size = os.path.getsize(cache)
+    converted = site_caching.convert_storage_format(storage_format, cache)
+    print('Converted {} pages to {}. Cache size: {} -> {} bytes.'.format(
+        converted, storage_format, old_size, os.path.getsize(cache)))
+
+
+def index_command(cache, _):
+    """
+    Create or rebuild the text index over the WikiText of the cached pages,
+    which is used by the query command and the prefilters of the analyses.
+    """
+    try:
+        indexed = site_caching.create_text_index(cache)
+    except sqlite3.OperationalError as error:
+        print('Cannot create the text index: {}'.format(error))
+        sys.exit(1)
+    print('Indexed {} pages. Cache size: {} bytes.'.format(
+        indexed, os.path.getsize(cache)))
+
+
+def query_command(cache, args):
+    """
+    Print the urls of all cached pages whose WikiText contains the literal
+    given as first argument. Without text index all pages are scanned.
+    """
+    if not args:
+        print('Usage: cache_tool.py [-c <cache file>] query <literal>')
+        sys.exit(1)
+    literal = args[0]
+    candidates = site_caching.find_candidate_pages([literal], cache)
+    for (url, content) in site_caching.iter_pages(cache, urls=candidates):
+        if literal in content:
+            print(url)
+
+
+def export_command(cache, args):
+    """
+    Write the cached pages into the corpus file given as first argument,
+    which processes can map into memory (see util.corpus_file). The optional
+    second argument is the representation of the pages (raw by default).
+    """
+    if not args:
+        print('Usage: cache_tool.py [-c <cache file>] export <corpus file> ' +
+              '[raw|view]')
+        sys.exit(1)
+    action = args[1] if len(args) > 1 else 'raw'
+    exported = corpus_file.export_corpus(args[0], cache, action)
+    print('Exported {} pages. Corpus size: {} bytes.'.format(
+        exported, os.path.getsize(args[0])))
+
+
+def top_command(cache, args):
+    """
+    Print the most frequent items counted by the analyzer given as first
+    argument together with their counts and the number of pages using them.
+    The optional second argument is the number of items (20 by default), the
+    optional third one restricts the counts to a book.
+    """
+    if not args:
+        print('Usage: cache_tool.py [-c <cache file>] top <analyzer> ' +
+              '[<number>] [<book>]')
+        sys.exit(1)
+    limit = int(args[1]) if len(args) > 1 else 20
+    book = args[2] if len(args) > 2 else None
+    for (item, count, pages) in statistics.top_items(args[0], limit, book,
+                                                     cache):
+        print('{}\t{}\t{}'.format(item, count, pages))
+
+
+def where_command(cache, args):
+    """
+    Print the pages on which the analyzer given as first argument counted the
+    item given as second argument together with their books and the counts.
+    """
+    if len(args) < 2:
+        print('Usage: cache_tool.py [-c <cache file>] where <analyzer> <item>')
+        sys.exit(1)
+    for (page, books, count) in statistics.item_pages(args[0], args[1],
+                                                      cache):
+        print('{}\t{}\t{}'.format(page, books, count))
+
+
+def books_command(cache, args):
+    """
+    Print the number of items counted by the analyzer given as first argument
+    and the number of pages containing them per book. If an item is given as
+    second argument, only this item is counted.
+    """
+    if not args:
+        print('Usage: cache_tool.py [-c <cache file>] books <analyzer> ' +
+              '[<item>]')
+        sys.exit(1)
+    item = args[1] if len(args) > 1 else None
+    for (book, count, pages) in statistics.book_counts(args[0], item, cache):
+        print('{}\t{}\t{}'.format(book, count, pages))
+
+
+def snapshot_command(cache, args):
+    """
+    Store the cached books and pages as snapshot with the name given as
+    first argument. Only contents which aren't part of another snapshot
+    yet are stored again.
+    """
+    if not args:
+        print('Usage: cache_tool.py [-c <cache file>] snapshot <name>')
+        sys.exit(1)
+    old_size = os.path.getsize(cache)
+    (pages, new_contents) = snapshots.take_snapshot(args[0], cache)
+    print(('Stored snapshot "{}" of {} pages with {} new contents. ' +
+           'Cache size: {} -> {} bytes.').format(
+               args[0], pages, new_contents, old_size,
+               os.path.getsize(cache)))
+
+
+def snapshots_command(cache, _):
+    """
+    Print the names of the snapshots together with their creation times and
+    their numbers of pages.
+    """
+    for (name, created, pages) in snapshots.list_snapshots(cache):
+        print('{}\t{}\t{}'.format(
+            name, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)),
+            pages))
+
+
+def drop_command(cache, args):
+    """
+    Delete the snapshot given as first argument together with the contents
+    no other snapshot refers to.
+    """
+    if not args:
+        print('Usage: cache_tool.py [-c <cache file>] drop <name>')
+        sys.exit(1)
+    if not snapshots.has_snapshot(args[0], cache):
+        print('The snapshot "{}" does not exist.'.format(args[0]))
+        sys.exit(1)
+    deleted = snapshots.drop_snapshot(args[0], cache)
+    print('Dropped snapshot "{}" and {} contents.'.format(args[0], deleted))
+
+
+def print_urls(heading, marker, urls):
+    """Print heading with the number of urls followed by the urls."""
+    print('{}: {}'.format(heading, len(urls)))
+    for url in urls:
+        print('{} {}'.format(marker, url))
+
+
+def diff_command(cache, args):
+    """
+    Print the pages which were added, removed or changed between the
+    snapshot given as first argument and the snapshot given as second
+    argument (the current pages by default). With the option -A the changed
+    pages are analysed by the analyzers in the given comma separated list
+    and their new and resolved findings are printed. The analyzer links
+    checks the links of the rendered pages like bad_finder.py.
+    """
+    (opts_list, args) = getopt.getopt(args, 'A:')
+    opts = dict(opts_list)
+    if not args:
+        print('Usage: cache_tool.py [-c <cache file>] diff ' +
+              '[-A <analyzers>] <old snapshot> [<new snapshot>]')
+        sys.exit(1)
+    (old, new) = (args[0], args[1] if len(args) > 1 else None)
+    for name in (old, new):
+        if not snapshots.has_snapshot(name, cache):
+            print('The snapshot "{}" does not exist.'.format(name))
+            sys.exit(1)
+    names = opts['-A'].split(',') if '-A' in opts else []
+    for name in names:
+        if name != LINKS and name not in analysis.ANALYZERS:
+            print('The analyzer "{}" is not available.'.format(name))
+            sys.exit(1)
+
+    (added, removed, changed, _, _) = snapshots.diff_pages(old, new, cache)
+    print_urls('Added pages', '+', added)
+    print_urls('Removed pages', '-', removed)
+    print_urls('Changed pages', '~', changed)
+    for name in names:
+        if name == LINKS:
+            (new_findings, resolved_findings) = bad_finder.diff_bad_links(
+                old, new, cache)
+        else:
+            (new_findings, resolved_findings) = snapshots.diff_findings(
+                analysis.ANALYZERS[name](), old, new, cache)
+        for (heading, marker, findings) in (
+                ('New findings', '+', new_findings),
+                ('Resolved findings', '-', resolved_findings)):
+            print('{} of {}: {}'.format(heading, name, len(findings)))
+            for (url, description) in findings:
+                print('{} {}\t{}'.format(marker, url, description))
+
+
+def load_graph(cache, args):
+    """
+    Load the link graph from the cache and return it together with the
+    positions of the books given by the first argument (all books by
+    default). Exit if there is no graph or the book is unknown.
+    """
+    graph = link_graph.load_link_graph(cache)
+    if graph is None:
+        print('The cache contains no link graph. Run bad_finder.py with ' +
+              'this cache first.')
+        sys.exit(1)
+    if not args:
+        return (graph, range(len(graph.books)))
+    if args[0] not in graph.books:
+        print('The book "{}" is not available.'.format(args[0]))
+        sys.exit(1)
+    return (graph, [graph.books.index(args[0])])
+
+
+def orphans_command(cache, args):
+    """
+    Print the pages of the book given as first argument (all books by
+    default) which no other page links to, together with their books.
+    """
+    (graph, books) = load_graph(cache, args)
+    for book in books:
+        for page in graph.orphans(book):
+            print('{}\t{}'.format(graph.urls[page], graph.books[book]))
+
+
+def unreachable_command(cache, args):
+    """
+    Print the pages of the book given as first argument (all books by
+    default) which can't be reached from the first page of their book,
+    together with their books.
+    """
+    (graph, books) = load_graph(cache, args)
+    for book in books:
+        for page in graph.unreachable(book):
+            print('{}\t{}'.format(graph.urls[page], graph.books[book]))
+
+
+def linked_command(cache, args):
+    """
+    Print the most linked sections together with the number of links to
+    them. The optional first argument is the number of sections (20 by
+    default).
+    """
+    (graph, _) = load_graph(cache, [])
+    limit = int(args[0]) if args else 20
+    for (url, anchor, count) in graph.most_linked_sections(limit):
+        print('{}#{}\t{}'.format(url, anchor, count))
+
+
+COMMANDS = {
+    'compress': compress_command,
+    'index': index_command,
+    'query': query_command,
+    'export': export_command,
+    'top': top_command,
+    'where': where_command,
+    'books': books_command,
+    'snapshot': snapshot_command,
+    'snapshots': snapshots_command,
+    'drop': drop_command,
+    'diff': diff_command,
+    'orphans': orphans_command,
+    'unreachable': unreachable_command,
+    'linked': linked_command,
+}
+
+
+def main():
+    """Main program body."""
+    (opts_list, args) = getopt.getopt(sys.argv[1:], 'c:')
+    opts = dict(opts_list)
+    cache = opts.get('-c', 'cache.db')
+
+    if not args or args[0] not in COMMANDS:
+        print('Usage: cache_tool.py [-c <cache file>] <command> [<args>]')
+        print('Available commands: {}'.format(', '.join(COMMANDS)))
+        sys.exit(1)
+    if not os.path.isfile(cache):
+        print('The cache "{}" does not exist.'.format(cache))
+        sys.exit(1)
+
+    COMMANDS[args[0]](cache, args[1:])
+
+
+if __name__ == '__main__':
+    main()
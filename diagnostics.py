@@ -0,0 +1,59 @@
+"""
+Module for running several diagnostic analyses of the Mathe für Nicht-Freaks
+project at once.
+
+When run as a standalone script this loads the pages of the Mathe für
+Nicht-Freaks project once and feeds every page to all selected analyzers in a
+single pass. Each analyzer writes the same output files as the corresponding
+finder script.
+"""
+
+import sys
+import getopt
+
+from util import analysis, bookinfo, record_writer
+
+# The finders register their analyzers when they are imported.
+# pylint: disable=unused-import
+import boxen_finder
+import double_usage_finder
+import gallery_finder
+import ref_finder
+import table_finder
+import tex_macro_finder
+# pylint: enable=unused-import
+
+OPTIONS = 'A:lb:f:'
+
+
+def main():
+    """Main program body."""
+    (opts_list, _) = getopt.getopt(sys.argv[1:],
+                                   OPTIONS + bookinfo.BOOK_OPTIONS,
+                                   bookinfo.BOOK_LONG_OPTIONS)
+    opts = dict(opts_list)
+
+    if '-l' in opts:
+        print("The following analyzers are available:")
+        for name in analysis.ANALYZERS:
+            print(name)
+        sys.exit(0)
+
+    names = analysis.parse_analyzer_names(opts)
+    output_format = record_writer.parse_output_format(opts)
+    run_options = analysis.parse_run_options(opts)
+
+    (books, pages, _) = bookinfo.book_argument_parser(
+        OPTIONS, stream=True, book=opts.get('-b'))
+    if '-b' in opts and opts['-b'] not in books:
+        print('The book "{}" is not available.'.format(opts['-b']))
+        sys.exit(1)
+
+    analyzers = [analysis.ANALYZERS[name]() for name in names]
+    for analyzer in analyzers:
+        analyzer.output_format = output_format
+    analysis.run_analyzers(analyzers, pages, books, **run_options)
+
+
+if __name__ == '__main__':
+    main()
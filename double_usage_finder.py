@@ -4,30 +4,48 @@ project.
 
 When run as a standalone script this performs all necessary steps for analysing
 all passages which are used multiple times across the Mathe für Nicht-Freaks
-project.
+project: The marked sections are connected to their usages by #lst
+transclusions and paragraphs which were copied instead of transcluded are
+detected as near-duplicates.
 """
 
-import os
-import sys
-import getopt
+import collections
 import re
 
-from util import bookinfo, site_caching
+from util import analysis, bookinfo, minhash, record_writer, wikitext
+
+# Start of the begin marker of a section
+SECTION_BEGIN_REGEX = re.compile('^<section\\s+begin', re.IGNORECASE)
+# Paragraphs are separated by blank lines.
+PARAGRAPH_REGEX = re.compile('[^\\n]+(?:\\n[^\\S\\n]*\\S[^\\n]*)*')
+# Minimal number of words of paragraphs checked for near-duplicates
+MIN_PARAGRAPH_WORDS = 20
+# Number of characters of a paragraph shown in the reports
+SNIPPET_LENGTH = 80
 
 
-def extract_sections(string):
+def extract_sections(string, offsets=False):
     """
-    Find all <section> environments and return their content as string array.
+    Find all <section> environments and return them as string array. Every
+    section is returned as the rest of its begin marker followed by its
+    content, e.g. '="name" />content'. If offsets is True, every section is
+    returned as pair of its offset in string and this string.
     """
-    section_regex = re.compile('<section begin(.+?)<section end', re.DOTALL)
-    return [match.group(1) for match in section_regex.finditer(string)]
+    return [section_entry(span, SECTION_BEGIN_REGEX.sub(
+        '', span.text(string)[:span.inner_end - span.start], 1), offsets)
+            for span in wikitext.spans_of_kind(string, wikitext.SECTION)]
+
+
+def section_entry(span, text, offsets):
+    """Return text or the pair of the offset of span and text."""
+    return [span.start, text] if offsets else text
 
 
 def count_sections(string):
     """
     Count the number of <section> environments in string.
     """
-    return string.count("<section begin")
+    return len(wikitext.spans_of_kind(string, wikitext.SECTION_BEGIN))
 
 
 def detect_sections(string):
@@ -41,23 +59,288 @@ def detect_sections(string):
     return []
 
 
-def extract_section_usages(string):
+def extract_section_usages(string, offsets=False):
     """
     Extract all usages of sections from string and return the names of the used
-    sections (with multiplicities) as list.
+    sections (with multiplicities) as list. If offsets is True, every usage is
+    returned as pair of its offset in string and the name.
+    """
+    return [section_entry(span, span.inner(string), offsets)
+            for span in wikitext.spans_of_kind(string, wikitext.TRANSCLUSION)]
+
+
+def extract_section_definitions(string):
+    """
+    Return the names of all sections whose begin is marked in string as
+    pairs of their offsets and names.
     """
-    usage_regex = re.compile('{{#lst:(.+?)}}')
-    usage_substrings = []
-    for match in usage_regex.finditer(string):
-        usage_substrings.append(match.group(1))
-    return usage_substrings
+    return [[span.start, span.name] for span in
+            wikitext.spans_of_kind(string, wikitext.SECTION_BEGIN)]
+
+
+def parse_usage(usage):
+    """
+    Split the content of a #lst transclusion (e.g. 'Page|name') into the
+    normalised title of the page and the name of the section. The name is
+    None if it is missing.
+    """
+    parts = usage.split('|')
+    name = parts[1].strip() if len(parts) > 1 else None
+    return (normalize_title(parts[0]), name)
+
+
+def normalize_title(title):
+    """
+    Normalise a page title like MediaWiki does: Underscores are replaced by
+    spaces, repeated whitespace is collapsed and the first letter is
+    capitalised.
+    """
+    title = ' '.join(title.replace('_', ' ').split())
+    return title[:1].upper() + title[1:]
+
+
+def extract_paragraphs(string):
+    """
+    Return the paragraphs of string with at least MIN_PARAGRAPH_WORDS words
+    as triples of their offsets, the first SNIPPET_LENGTH characters and
+    their MinHash signatures (see util.minhash).
+    """
+    paragraphs = []
+    for match in PARAGRAPH_REGEX.finditer(string):
+        words = minhash.words(match.group())
+        if len(words) >= MIN_PARAGRAPH_WORDS:
+            paragraphs.append([
+                match.start(), match.group()[:SNIPPET_LENGTH],
+                minhash.signature(minhash.shingles(words))])
+    return paragraphs
 
 
 def count_section_usages(string):
     """
-    Count how often the substring {{#lst: occurs
+    Count how often sections are transcluded by {{#lst:
+    """
+    return len(wikitext.spans_of_kind(string, wikitext.TRANSCLUSION))
+
+
+class SectionGraph:
+    """
+    Graph connecting the marked sections to their usages by #lst
+    transclusions. A section is identified by the normalised title of its
+    page and its name. The definitions and the usages are both indexed by
+    these identifiers.
+    """
+
+    def __init__(self):
+        # Pages and offsets of the definitions and usages indexed by the
+        # (title, name) identifiers of the sections
+        self.definitions = {}
+        self.usages = {}
+
+    def add_definition(self, url, offset, name):
+        """Add the definition of the section name on the page url."""
+        title = normalize_title(bookinfo.url_to_title(url) or url)
+        self.definitions.setdefault((title, name), []).append((url, offset))
+
+    def add_usage(self, url, offset, usage):
+        """
+        Add the usage of a section by the transclusion with the content usage
+        (e.g. 'Page|name') on the page url.
+        """
+        self.usages.setdefault(parse_usage(usage), []).append((url, offset))
+
+    def users(self, title, name):
+        """Return the pages and offsets of the usages of a section."""
+        return self.usages.get((normalize_title(title), name), [])
+
+    def dangling_usages(self, titles, analysed):
+        """
+        Generator yielding the usages of sections which aren't defined as
+        (url, offset, (title, name), kind) tuples. kind is 'dangling_usage'
+        if the title is in the set analysed of the pages whose definitions
+        were added and 'unknown_page' if it isn't in the set titles of known
+        pages. Usages of sections on known pages which weren't analysed are
+        left out, since their definitions are unknown.
+        """
+        for (key, usages) in self.usages.items():
+            if key in self.definitions:
+                continue
+            if key[0] in analysed:
+                kind = 'dangling_usage'
+            elif key[0] not in titles:
+                kind = 'unknown_page'
+            else:
+                continue
+            for (url, offset) in usages:
+                yield (url, offset, key, kind)
+
+    def unused_sections(self):
+        """
+        Generator yielding the sections which aren't used as
+        (url, offset, name) triples.
+        """
+        for (key, definitions) in self.definitions.items():
+            if key not in self.usages:
+                for (url, offset) in definitions:
+                    yield (url, offset, key[1])
+
+
+def write_records(analyzer, base_name, records):
+    """
+    Write the records of analyzer sorted by page and offset to the file
+    base_name in the output format of the analyzer. In the text format the
+    contents are grouped by page.
+    """
+    with record_writer.open_writer(base_name, analyzer.output_format,
+                                   page_separator='\n\n') as writer:
+        for (url, kind, offset, content) in sorted(records):
+            writer.write(url, analyzer.page_books.get(url), kind, offset,
+                         content)
+
+
+@analysis.register_analyzer
+class DoubleUsageAnalyzer(analysis.Analyzer):
     """
-    return string.count("{{#lst:")
+    Collect the marked sections and their usages. They are written as
+    records in output_format to out/sections.<extension> and
+    out/section_usages.<extension> while the pages are processed.
+    Afterwards the usages of sections which don't exist on the analysed
+    pages or on unknown pages are written to out/dangling_sections.<extension>
+    and the sections which are never used to out/unused_sections.<extension>.
+    """
+    name = 'double_usage'
+    version = 5
+    excluded_books = ('Mitmachen_für_(Nicht-)Freaks',)
+    prefilter = ('<section', '#lst')
+
+    def __init__(self, output_format=None):
+        super().__init__()
+        if output_format is not None:
+            self.output_format = output_format
+        self.section_writer = None
+        self.usage_writer = None
+        self.section_counter = 0
+        self.usage_counter = 0
+        self.graph = SectionGraph()
+        # Normalised titles of the analysed pages
+        self.analysed = set()
+
+    def extract(self, content):
+        return {
+            'sections': extract_sections(content, offsets=True),
+            'section_count': count_sections(content),
+            'usages': extract_section_usages(content, offsets=True),
+            'usage_count': count_section_usages(content),
+            'definitions': extract_section_definitions(content)
+        }
+
+    def open_writers(self):
+        """Open the writers of the records unless they are open already."""
+        if self.section_writer is not None:
+            return
+        self.section_writer = record_writer.open_writer(
+            'out/sections', self.output_format,
+            separator='\n\n ______________________________________\n\n')
+        self.usage_writer = record_writer.open_writer(
+            'out/section_usages', self.output_format,
+            header='{} usages found:\n\n'.format)
+
+    def collect(self, url, findings):
+        self.analysed.add(normalize_title(bookinfo.url_to_title(url) or url))
+        if findings['sections'] or findings['usages']:
+            self.open_writers()
+        book = self.page_books.get(url)
+        for (offset, section) in findings['sections']:
+            self.section_writer.write(url, book, 'section', offset, section)
+        self.section_counter += findings['section_count']
+        for (offset, usage) in findings['usages']:
+            self.usage_writer.write(url, book, 'section_usage', offset, usage)
+            self.graph.add_usage(url, offset, usage)
+        self.usage_counter += findings['usage_count']
+        for (offset, name) in findings['definitions']:
+            self.graph.add_definition(url, offset, name)
+
+    def skip(self, url):
+        self.analysed.add(normalize_title(bookinfo.url_to_title(url) or url))
+
+    def count_matches(self, findings):
+        return findings['section_count'] + findings['usage_count']
+
+    def count_items(self, findings):
+        return collections.Counter(usage for (_, usage) in findings['usages'])
+
+    def describe_findings(self, findings):
+        return ['section {}'.format(name)
+                for (_, name) in findings['definitions']] + \
+            ['usage {}'.format(usage) for (_, usage) in findings['usages']]
+
+    def write_results(self):
+        print("Found {} marked sections with {} overall usages".format(
+            self.section_counter, self.usage_counter))
+
+        self.open_writers()
+        self.section_writer.close()
+        self.usage_writer.close()
+        self.section_writer = None
+        self.usage_writer = None
+
+        titles = {normalize_title(bookinfo.url_to_title(url) or url)
+                  for url in self.page_books}
+        dangling = [(url, kind, offset, '{}|{}'.format(*key))
+                    for (url, offset, key, kind)
+                    in self.graph.dangling_usages(titles, self.analysed)]
+        unused = [(url, 'unused_section', offset, name)
+                  for (url, offset, name) in self.graph.unused_sections()]
+        print("Found {} usages of missing sections and {} unused sections"
+              .format(len(dangling), len(unused)))
+        write_records(self, 'out/dangling_sections', dangling)
+        write_records(self, 'out/unused_sections', unused)
+
+
+@analysis.register_analyzer
+class DuplicateParagraphAnalyzer(analysis.Analyzer):
+    """
+    Find paragraphs which were copied instead of transcluded. Paragraphs are
+    compared by MinHash signatures, whose smallest values serve as LSH keys
+    for finding candidates of near-duplicates (see util.minhash). Every
+    paragraph of a group of near-duplicates is written as record to
+    out/duplicate_paragraphs.<extension> with the first paragraph of its
+    group and its own beginning as content.
+    """
+    name = 'duplicate_paragraphs'
+    excluded_books = ('Mitmachen_für_(Nicht-)Freaks',)
+
+    def __init__(self, output_format=None):
+        super().__init__()
+        if output_format is not None:
+            self.output_format = output_format
+        # Pages, offsets and snippets of the paragraphs
+        self.paragraphs = []
+        self.signatures = []
+
+    def extract(self, content):
+        return extract_paragraphs(content)
+
+    def collect(self, url, findings):
+        for (offset, snippet, signature) in findings:
+            self.paragraphs.append((url, offset, snippet))
+            self.signatures.append(signature)
+
+    def describe_findings(self, findings):
+        return [snippet for (_, snippet, _) in findings]
+
+    def write_results(self):
+        groups = minhash.duplicate_groups(self.signatures)
+        records = []
+        for group in groups:
+            (first_url, first_offset, _) = self.paragraphs[group[0]]
+            for index in group:
+                (url, offset, snippet) = self.paragraphs[index]
+                records.append((url, 'duplicate_paragraph', offset,
+                                '{}@{}: {}'.format(first_url, first_offset,
+                                                   snippet)))
+        print("Found {} groups of near-duplicate paragraphs".format(
+            len(groups)))
+        write_records(self, 'out/duplicate_paragraphs', records)
 
 
 def main():
@@ -67,48 +350,15 @@ def main():
         'Über_das_Projekt',
         'Mitmachen_für_(Nicht-)Freaks',
     )
-    (opts_list, _) = getopt.getopt(sys.argv[1:], 'c:r')
+    (books, pages, (opts_list, _)) = bookinfo.book_argument_parser(
+        'f:', stream=True)
     opts = dict(opts_list)
+    output_format = record_writer.parse_output_format(opts)
 
-    if '-c' in opts and os.path.isfile(opts['-c']) and '-r' not in opts:
-        (books, pages) = site_caching.read_cached_data(cache=opts['-c'])
-    else:
-        books = bookinfo.fetch_article_list()
-        pages = {}
-        for book in books:
-            page_content = bookinfo.fetch_pages_from_list(
-                books[book], action='raw',
-                page_postprocessor=lambda byte_string:
-                byte_string.decode('utf-8'))
-            pages = {
-                **pages,
-                **page_content
-            }
-        if '-c' in opts:
-            site_caching.cache_page_data(books, pages, cache=opts['-c'])
-
-    sections = []
-    usages = []
-    section_counter = 0
-    usage_counter = 0
-    for page in pages:
-        sections.extend(extract_sections(pages[page]))
-        section_counter += count_sections(pages[page])
-        usages.extend(extract_section_usages(pages[page]))
-        usage_counter += count_section_usages(pages[page])
-
-    found_sections = list(sections)
-    found_usages = list(usages)
-    print("Found {} marked sections with {} overall usages".format(
-        section_counter, usage_counter))
-
-    os.makedirs("out", exist_ok=True)
-    with open("out/sections.txt", 'w+') as file:
-        file.write('\n\n ______________________________________\n\n'.join(
-            found_sections))
-    with open("out/section_usages.txt", 'w+') as file:
-        file.write(str(usage_counter) + ' usages found:\n\n')
-        file.write('\n'.join(found_usages))
+    analysis.run_analyzers(
+        [DoubleUsageAnalyzer(output_format=output_format),
+         DuplicateParagraphAnalyzer(output_format=output_format)], pages,
+        books, **analysis.parse_run_options(opts))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,86 @@
+"""
+Module for merging the partial results of sharded runs of the diagnostic
+scripts for the Mathe für Nicht-Freaks project.
+
+When run as a standalone script this reads the partial result files written
+with the option --partial by the shards of a run (see util.sharding) and
+writes the output files of the same run without shards.
+"""
+
+import sys
+import getopt
+
+from util import analysis, record_writer, sharding
+
+import bad_finder
+# The finders register their analyzers when they are imported.
+# pylint: disable=unused-import
+import boxen_finder
+import double_usage_finder
+import gallery_finder
+import ref_finder
+import table_finder
+import tex_macro_finder
+# pylint: enable=unused-import
+
+OPTIONS = 'f:L:'
+
+
+def merge_analyses(paths, headers, output_format):
+    """
+    Merge the findings of the analyzers in the partial result files paths
+    with the given headers and write the results of the analyzers.
+    """
+    names = [name for (name, _) in headers[0]['analyzers']]
+    for header in headers:
+        if [name for (name, _) in header['analyzers']] != names:
+            print('The shards ran different analyzers.')
+            sys.exit(1)
+    analyzers = []
+    for (name, version) in headers[0]['analyzers']:
+        if name not in analysis.ANALYZERS or \
+           analysis.ANALYZERS[name].version != version:
+            print('The findings of the analyzer "{}" were written by '
+                  'another version of the scripts.'.format(name))
+            sys.exit(1)
+        analyzer = analysis.ANALYZERS[name]()
+        analyzer.output_format = output_format
+        analyzers.append(analyzer)
+    analysis.merge_findings(analyzers, paths, headers[0]['books'])
+
+
+def main():
+    """Main program body."""
+    (opts_list, args) = getopt.getopt(sys.argv[1:], OPTIONS)
+    opts = dict(opts_list)
+    if not args:
+        print('Usage: merge.py [-f <format>] [-L <logfile>] ' +
+              '<partial file>...')
+        sys.exit(1)
+    output_format = record_writer.parse_output_format(opts)
+
+    partials = {}
+    for path in args:
+        header = sharding.read_header(path)
+        partials.setdefault(header['partial'], []).append((path, header))
+    for (kind, files) in partials.items():
+        headers = [header for (_, header) in files]
+        problem = sharding.missing_shards(headers) or \
+            sharding.different_corpora(headers)
+        if problem is not None:
+            print('Cannot merge the partial results of {}: {}.'.format(
+                kind, problem))
+            sys.exit(1)
+
+    if 'analyses' in partials:
+        merge_analyses([path for (path, _) in partials['analyses']],
+                       [header for (_, header) in partials['analyses']],
+                       output_format)
+    if 'bad_links' in partials:
+        bad_finder.merge_bad_links(
+            opts.get('-L', 'bad_log.csv'),
+            [path for (path, _) in partials['bad_links']])
+
+
+if __name__ == '__main__':
+    main()
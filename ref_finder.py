@@ -6,7 +6,18 @@ When run as a standalone script this performs all necessary steps for analysing
 all references which are used in the Mathe für Nicht-Freaks project.
 """
 
-from util import bookinfo, content_stats
+from util import analysis, bookinfo, content_stats, record_writer, wikitext
+
+
+@analysis.register_analyzer
+class RefAnalyzer(content_stats.ContentAnalyzer):
+    """Collect the contents of all references."""
+    name = 'ref'
+    base_name = 'ref'
+    span_kind = wikitext.REF
+    version = 4
+    excluded_books = ('Mitmachen_für_(Nicht-)Freaks',)
+    prefilter = ('<ref',)
 
 
 def main():
@@ -16,9 +27,13 @@ def main():
         'Über_das_Projekt',
         'Mitmachen_für_(Nicht-)Freaks',
     )
-    (_, pages, _) = bookinfo.book_argument_parser()
+    (books, pages, (opts_list, _)) = bookinfo.book_argument_parser(
+        'f:', stream=True)
+    opts = dict(opts_list)
+    output_format = record_writer.parse_output_format(opts)
 
-    content_stats.basic_analysis('ref', pages, '<ref>(.+?)</ref>')
+    analysis.run_analyzers([RefAnalyzer(output_format=output_format)], pages,
+                           books, **analysis.parse_run_options(opts))
 
 
 if __name__ == '__main__':
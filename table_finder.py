@@ -6,7 +6,21 @@ When run as a standalone script this performs all necessary steps for analysing
 all tables which are used in the Mathe für Nicht-Freaks project.
 """
 
-from util import bookinfo, content_stats
+from util import analysis, bookinfo, content_stats, record_writer, wikitext
+
+
+@analysis.register_analyzer
+class TableAnalyzer(content_stats.ContentAnalyzer):
+    """Collect the contents of all tables."""
+    name = 'table'
+    base_name = 'table'
+    span_kind = wikitext.TABLE
+    version = 4
+    excluded_books = ('Mitmachen_für_(Nicht-)Freaks',)
+    prefilter = ('{|',)
+
+    def span_content(self, content, span):
+        return span.text(content)
 
 
 def main():
@@ -16,9 +30,13 @@ def main():
         'Über_das_Projekt',
         'Mitmachen_für_(Nicht-)Freaks',
     )
-    (_, pages, _) = bookinfo.book_argument_parser()
+    (books, pages, (opts_list, _)) = bookinfo.book_argument_parser(
+        'f:', stream=True)
+    opts = dict(opts_list)
+    output_format = record_writer.parse_output_format(opts)
 
-    content_stats.basic_analysis('table', pages, '({\\|[^\n]*\n.+?\\|})')
+    analysis.run_analyzers([TableAnalyzer(output_format=output_format)], pages,
+                           books, **analysis.parse_run_options(opts))
 
 
 if __name__ == '__main__':
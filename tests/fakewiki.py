@@ -0,0 +1,277 @@
+"""
+Module providing a local stand-in of Wikibooks for the tests.
+
+FakeWiki serves the parts of a MediaWiki which the scripts use: the sitemap
+and the pages under /w/index.php (action=raw and action=view) and the queries
+of the MediaWiki API under /w/api.php (revisions, recent changes). The
+content of the wiki is kept in memory and can be edited by the tests while
+the server runs. Deletions and moves of pages are listed in the recent
+changes as log entries.
+"""
+
+import html
+import json
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from util import bookinfo
+
+# Prefix of the titles of the articles
+PREFIX = 'Mathe für Nicht-Freaks: '
+# Title of the sitemap
+SITEMAP = PREFIX + 'Sitemap'
+# Timestamp of the pages which weren't edited by a test
+INITIAL_TIMESTAMP = '2020-01-01T00:00:00Z'
+
+
+def title_to_url(title):
+    """Return the link to the article with the given title."""
+    return '/wiki/' + urllib.parse.quote(title.replace(' ', '_'), safe=':')
+
+
+class FakeWiki:
+    """
+    Wiki with the books given as dictionary of the titles of their pages
+    indexed by the book names. Every page starts with a single revision.
+
+    The API returns the revisions of at most batch_limit pages per response
+    and continues the query for the other pages, as MediaWiki does for long
+    pages. All requests are recorded in requests as (path, parameters)
+    pairs. Requests of pages whose titles are in failing are answered with
+    a server error.
+    """
+
+    def __init__(self, books=None, batch_limit=2):
+        self.books = {}
+        self.pages = {}
+        self.changes = []
+        self.requests = []
+        self.failing = set()
+        self.batch_limit = batch_limit
+        self.next_revid = 1
+        self.server = None
+        self.previous_url = None
+        for (book, titles) in (books or {}).items():
+            self.books[book] = list(titles)
+            for title in titles:
+                if title not in self.pages:
+                    self.edit(title, 'Text of {}'.format(title),
+                              INITIAL_TIMESTAMP, log_change=False)
+
+    def start(self):
+        """
+        Start the server in a background thread and send all requests of
+        util.bookinfo to it. Return the url of the wiki.
+        """
+        wiki = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Handler passing the requests to the wiki."""
+
+            def log_message(self, *_):  # pylint: disable=arguments-differ
+                pass
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Answer a GET request."""
+                query = urllib.parse.urlsplit(self.path).query
+                self.answer(dict(urllib.parse.parse_qsl(query)))
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Answer a POST request with form data."""
+                length = int(self.headers.get('Content-Length', 0))
+                self.answer(dict(urllib.parse.parse_qsl(
+                    self.rfile.read(length).decode('ascii'))))
+
+            def answer(self, params):
+                """Send the response of the wiki to the request."""
+                path = urllib.parse.urlsplit(self.path).path
+                (status, content_type, body) = wiki.respond(path, params)
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
+        url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        self.previous_url = bookinfo.WIKI_URL
+        bookinfo.set_wiki_url(url)
+        return url
+
+    def stop(self):
+        """
+        Stop the server, close the connections to it and send the requests
+        of util.bookinfo to the previous wiki again.
+        """
+        bookinfo.HTTP_CLIENT.close()
+        bookinfo.set_wiki_url(self.previous_url)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def edit(self, title, content, timestamp, log_change=True, namespace=0):
+        """
+        Save a new revision of the page title in the given namespace with the
+        given content and timestamp. The edit is listed in the recent changes
+        if log_change is True.
+        """
+        revid = self.next_revid
+        self.next_revid += 1
+        new = title not in self.pages
+        self.pages[title] = {'content': content, 'revid': revid,
+                             'timestamp': timestamp, 'touched': timestamp}
+        if log_change:
+            self.changes.append({
+                'type': 'new' if new else 'edit', 'ns': namespace,
+                'title': title,
+                'rcid': len(self.changes) + 1, 'revid': revid,
+                'timestamp': timestamp})
+        return revid
+
+    def delete(self, title, timestamp):
+        """Delete the page title and log the deletion."""
+        del self.pages[title]
+        self.log(title, timestamp, 'delete', 'delete', {})
+
+    def move(self, title, target, timestamp):
+        """
+        Move the page title to the title target without leaving a redirect
+        and log the move.
+        """
+        self.pages[target] = self.pages.pop(title)
+        self.log(title, timestamp, 'move', 'move',
+                 {'target_ns': 0, 'target_title': target})
+
+    def log(self, title, timestamp, logtype, logaction, logparams):
+        """Add a log entry about the page title to the recent changes."""
+        self.changes.append({
+            'type': 'log', 'ns': 0, 'title': title,
+            'rcid': len(self.changes) + 1, 'revid': 0,
+            'timestamp': timestamp, 'logtype': logtype,
+            'logaction': logaction, 'logparams': logparams})
+
+    def touch(self, title, timestamp):
+        """
+        Render the page title again without a new revision, as MediaWiki
+        does when a template used by the page is edited.
+        """
+        self.pages[title]['touched'] = timestamp
+
+    def api_requests(self, **params):
+        """
+        Return the parameters of the API requests which contain the given
+        parameters.
+        """
+        return [request for (path, request) in self.requests
+                if path.endswith('/api.php') and
+                all(request.get(key) == value
+                    for (key, value) in params.items())]
+
+    def respond(self, path, params):
+        """
+        Answer a request for path with the given parameters. Return the
+        status, the content type and the body of the response.
+        """
+        self.requests.append((path, params))
+        requested = params.get('titles', params.get('title', ''))
+        if self.failing.intersection(title.replace('_', ' ') for title
+                                     in requested.split('|')):
+            return (500, 'text/plain', 'Internal server error')
+        if path == '/w/api.php':
+            return (200, 'application/json', json.dumps(self.api(params)))
+        if path != '/w/index.php':
+            return (404, 'text/plain', 'Not found')
+        title = params.get('title', '').replace('_', ' ')
+        if title == SITEMAP:
+            return (200, 'text/html', self.sitemap())
+        if title not in self.pages:
+            return (404, 'text/plain', 'Not found')
+        if params.get('action') == 'raw':
+            return (200, 'text/plain', self.pages[title]['content'])
+        return (200, 'text/html', self.render(title))
+
+    def sitemap(self):
+        """Return the HTML of the sitemap."""
+        parts = ['<html><body><h2>Inhalt</h2>']
+        for (book, titles) in self.books.items():
+            parts.append('<h2><span class="mw-headline" id="{0}">{0}</span>'
+                         '</h2><ul>'.format(book))
+            for title in titles:
+                parts.append('<li><a href="{}">{}</a></li>'.format(
+                    title_to_url(title), html.escape(title)))
+            parts.append('</ul>')
+        parts.append('<h2><span class="mw-headline" id="Über_das_Projekt">'
+                     'Über das Projekt</span></h2><h2>Navigationsmenü</h2>'
+                     '</body></html>')
+        return ''.join(parts)
+
+    def render(self, title):
+        """
+        Return the HTML of the page title. Lines of the WikiText of the form
+        [[title]] become links, all other lines paragraphs.
+        """
+        parts = ['<html><body><h1 id="firstHeading">{}</h1>'.format(
+            html.escape(title))]
+        for line in self.pages[title]['content'].splitlines():
+            if line.startswith('[[') and line.endswith(']]'):
+                parts.append('<p><a href="{}">link</a></p>'.format(
+                    title_to_url(line[2:-2])))
+            else:
+                parts.append('<p>{}</p>'.format(html.escape(line)))
+        parts.append('</body></html>')
+        return ''.join(parts)
+
+    def api(self, params):
+        """Answer a query of the MediaWiki API."""
+        if params.get('list') == 'recentchanges':
+            return self.recent_changes(params)
+        titles = params['titles'].split('|')
+        normalized = [{'from': title, 'to': title.replace('_', ' ')}
+                      for title in titles if '_' in title]
+        titles = [title.replace('_', ' ') for title in titles]
+        start = int(params.get('rvcontinue', 0))
+        props = params.get('prop', '').split('|')
+        with_content = 'content' in params.get('rvprop', '').split('|')
+        pages = []
+        for (number, title) in enumerate(titles):
+            if title not in self.pages:
+                pages.append({'title': title, 'missing': True})
+                continue
+            page = self.pages[title]
+            entry = {'title': title}
+            if 'info' in props:
+                entry.update(lastrevid=page['revid'], touched=page['touched'])
+            if 'revisions' in props and \
+               (start <= number < start + self.batch_limit or
+                not with_content):
+                revision = {'revid': page['revid'],
+                            'timestamp': page['timestamp']}
+                if with_content:
+                    revision['slots'] = {'main': {
+                        'content': page['content']}}
+                entry['revisions'] = [revision]
+            pages.append(entry)
+        response = {'query': {'pages': pages, 'normalized': normalized}}
+        if 'revisions' in props and with_content and \
+           start + self.batch_limit < len(titles):
+            response['continue'] = {
+                'rvcontinue': str(start + self.batch_limit),
+                'continue': '||'}
+        return response
+
+    def recent_changes(self, params):
+        """
+        Answer a query of the recent changes since the timestamp rcend
+        (inclusive), newest first.
+        """
+        changes = [change for change in reversed(self.changes)
+                   if change['timestamp'] >= params.get('rcend', '')]
+        if 'rcnamespace' in params:
+            namespaces = {int(namespace) for namespace
+                          in params['rcnamespace'].split('|')}
+            changes = [change for change in changes
+                       if change['ns'] in namespaces]
+        return {'query': {'recentchanges': changes}}
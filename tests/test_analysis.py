@@ -0,0 +1,181 @@
+"""
+Tests of running analyzers over cached and fetched pages with util.analysis.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import glob
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from util import analysis, metrics, site_caching
+
+# Urls of the pages of the tests
+URLS = ['/wiki/Mathe_f%C3%BCr_Nicht-Freaks:_Analysis_{}'.format(number)
+        for number in range(3)]
+# Books of the tests
+BOOKS = {'Analysis': URLS}
+
+
+class FractionAnalyzer(analysis.Analyzer):
+    """Analyzer finding the word Bruch, which is its prefilter."""
+
+    name = 'fractions'
+    prefilter = ('Bruch',)
+
+    def extract(self, content):
+        return ['Bruch'] * content.count('Bruch')
+
+    def write_results(self):
+        pass
+
+
+class PrefilterTest(unittest.TestCase):
+    """Test skipping pages with the text index of the cache."""
+
+    def setUp(self):
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, 'cache.db')
+        site_caching.cache_page_data(
+            BOOKS, {URLS[0]: 'Ein Bruch', URLS[1]: 'Eine Zahl',
+                    URLS[2]: 'Ein Satz'}, cache=self.cache)
+        try:
+            site_caching.create_text_index(self.cache)
+        except sqlite3.OperationalError:
+            self.skipTest('SQLite has no trigram tokenizer')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_fractions(self, processes):
+        """Run the analyzer over the cached pages and a changed page."""
+        pages = list(site_caching.iter_pages(self.cache))
+        pages[1] = (URLS[1], 'Ein neuer Bruch')
+        [analyzer] = analysis.run_analyzers(
+            [FractionAnalyzer()], pages, BOOKS, cache=self.cache,
+            processes=processes)
+        return analyzer.results
+
+    def test_changed_page(self):
+        """
+        A page which isn't a candidate according to the text index is
+        analysed when its content changed since it was indexed.
+        """
+        self.assertEqual(self.run_fractions(1),
+                         {URLS[0]: ['Bruch'], URLS[1]: ['Bruch']})
+
+    def test_changed_page_in_pool(self):
+        """The worker processes analyse changed pages as well."""
+        self.assertEqual(self.run_fractions(2),
+                         {URLS[0]: ['Bruch'], URLS[1]: ['Bruch']})
+
+
+class PoolMetricsTest(unittest.TestCase):
+    """Test the metrics recorded by the worker processes."""
+
+    def test_worker_stages(self):
+        """The times of the analyses in the workers reach the parent."""
+        metrics.reset()
+        pages = [(url, 'Ein Bruch') for url in URLS]
+        analysis.run_analyzers([FractionAnalyzer()], pages, BOOKS,
+                               processes=2)
+        stages = metrics.summary()['stages']
+        self.assertEqual(stages['analyze.fractions']['calls'], len(URLS))
+        self.assertEqual(stages['collect.fractions']['calls'], len(URLS))
+
+
+class CachedCorpusTest(unittest.TestCase):
+    """Test analysing cached pages in a corpus exported from the cache."""
+
+    def setUp(self):
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, 'cache.db')
+        site_caching.cache_page_data(
+            BOOKS, {url: 'Ein Bruch' for url in URLS}, cache=self.cache)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_fractions(self):
+        """
+        Run the analyzer over the cached pages in two processes. Return its
+        results and the exported corpus files.
+        """
+        [analyzer] = analysis.run_analyzers(
+            [FractionAnalyzer()], site_caching.CachedPages(self.cache), BOOKS,
+            cache=self.cache, processes=2)
+        return (analyzer.results, glob.glob(self.cache + '.*.corpus'))
+
+    def test_reuse(self):
+        """
+        The corpus is reused while the cached pages are unchanged and
+        replaced once they changed.
+        """
+        (results, corpora) = self.run_fractions()
+        self.assertEqual(results, {url: ['Bruch'] for url in URLS})
+        self.assertEqual(len(corpora), 1)
+        modified = os.path.getmtime(corpora[0])
+        self.assertEqual(self.run_fractions(), (results, corpora))
+        self.assertEqual(os.path.getmtime(corpora[0]), modified)
+        site_caching.cache_page_data(
+            BOOKS, {URLS[0]: 'Ein Bruch', URLS[1]: 'Zwei Bruch Bruch',
+                    URLS[2]: 'Kein'}, cache=self.cache)
+        (results, changed) = self.run_fractions()
+        self.assertEqual(results, {URLS[0]: ['Bruch'],
+                                   URLS[1]: ['Bruch', 'Bruch']})
+        self.assertEqual(len(changed), 1)
+        self.assertNotEqual(changed, corpora)
+
+
+
+class LookupFirstTest(unittest.TestCase):
+    """Test reading only the cached pages whose findings aren't cached."""
+
+    def setUp(self):
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, 'cache.db')
+        site_caching.cache_page_data(
+            BOOKS, {url: 'Ein Bruch' for url in URLS}, cache=self.cache)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_fractions(self, processes):
+        """
+        Run the analyzer over the cached pages with lookup_first. Return its
+        results and the number of pages read from the cache.
+        """
+        metrics.reset()
+        [analyzer] = analysis.run_analyzers(
+            [FractionAnalyzer()], site_caching.CachedPages(self.cache), BOOKS,
+            cache=self.cache, processes=processes, lookup_first=True)
+        return (analyzer.results,
+                metrics.summary()['counters'].get('pages_read', 0))
+
+    def test_changed_page(self):
+        """
+        Only the changed page is read, the findings of the others are taken
+        from the result cache.
+        """
+        self.assertEqual(self.run_fractions(1),
+                         ({url: ['Bruch'] for url in URLS}, len(URLS)))
+        contents = {url: 'Ein Bruch' for url in URLS}
+        for (processes, url) in ((1, URLS[1]), (2, URLS[2])):
+            contents[url] = 'Bruch ' * (processes + 1)
+            site_caching.cache_page_data(BOOKS, contents, cache=self.cache)
+            self.assertEqual(self.run_fractions(processes), (
+                {page: ['Bruch'] * content.count('Bruch')
+                 for (page, content) in contents.items()}, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Tests of the link index of bad_finder.py.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import os
+import tempfile
+import unittest
+
+from util import site_caching
+
+import bad_finder
+
+# Url of the page of the tests
+URL = '/wiki/Mathe_f%C3%BCr_Nicht-Freaks:_Analysis'
+# Url of a page which is removed from the books
+REMOVED_URL = '/wiki/Mathe_f%C3%BCr_Nicht-Freaks:_Alt'
+# HTML of the page before and after an edit
+OLD_HTML = '<html><head><title>Alt</title></head><body>' + \
+    '<a href="/wiki/Alt">Alt</a></body></html>'
+NEW_HTML = '<html><head><title>Neu</title></head><body>' + \
+    '<a href="/wiki/Neu">Neu</a></body></html>'
+
+
+class LinkIndexTest(unittest.TestCase):
+    """Test reusing the link index stored in the cache."""
+
+    def setUp(self):
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, 'cache.db')
+        site_caching.cache_page_data({'Analysis': [URL]}, {URL: OLD_HTML},
+                                     cache=self.cache, action='view')
+        bad_finder.build_link_index([(URL, OLD_HTML)], self.cache)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_unchanged_page(self):
+        """The cached entry of an unchanged page is used."""
+        index = bad_finder.build_link_index([(URL, OLD_HTML)], self.cache)
+        self.assertEqual(index[URL].links, ['/wiki/Alt'])
+
+    def test_fetched_again(self):
+        """
+        A page which is fetched again is indexed again, although the cache
+        still contains its old HTML.
+        """
+        index = bad_finder.build_link_index([(URL, NEW_HTML)], self.cache)
+        self.assertEqual(index[URL].title, 'Neu')
+        self.assertEqual(index[URL].links, ['/wiki/Neu'])
+
+    def test_removed_page(self):
+        """
+        The cached entry of a page which left the books is dropped, although
+        the cache still contains its HTML.
+        """
+        site_caching.cache_page_data(
+            {'Analysis': [URL, REMOVED_URL]},
+            {URL: OLD_HTML, REMOVED_URL: NEW_HTML}, cache=self.cache,
+            action='view')
+        bad_finder.build_link_index([(REMOVED_URL, NEW_HTML)], self.cache)
+        index = bad_finder.build_link_index([(URL, OLD_HTML)], self.cache,
+                                            books={'Analysis': [URL]})
+        self.assertEqual(list(index), [URL])
+        self.assertEqual(list(site_caching.read_link_index(self.cache)),
+                         [URL])
+
+
+if __name__ == '__main__':
+    unittest.main()
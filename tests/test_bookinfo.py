@@ -0,0 +1,120 @@
+"""
+Tests of fetching the pages from a fake wiki with util.bookinfo.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import os
+import tempfile
+import unittest
+
+from util import bookinfo
+
+from tests.fakewiki import FakeWiki, PREFIX, title_to_url
+
+# Titles of the pages of the fake wiki
+TITLES = [PREFIX + 'Analysis {}'.format(number) for number in range(7)]
+
+
+class FetchViaApiTest(unittest.TestCase):
+    """Test fetching the WikiText in batches through the MediaWiki API."""
+
+    def setUp(self):
+        self.wiki = FakeWiki({'Analysis_1': TITLES}, batch_limit=2)
+        self.wiki.start()
+        self.urls = [title_to_url(title) for title in TITLES]
+
+    def tearDown(self):
+        self.wiki.stop()
+
+    def test_batches_and_continuation(self):
+        """All pages are fetched, although every batch is continued."""
+        revisions = {}
+        errors = {}
+        pages = list(bookinfo.iter_pages_via_api(
+            self.urls, revisions=revisions, errors=errors, rate_limit=None,
+            batch_size=3))
+        self.assertEqual(pages, [(url, 'Text of {}'.format(title))
+                                 for (url, title) in zip(self.urls, TITLES)])
+        self.assertEqual(errors, {})
+        for (url, title) in zip(self.urls, TITLES):
+            self.assertEqual(revisions[url]['revid'],
+                             self.wiki.pages[title]['revid'])
+        # Three batches, the first two of them need a continuation.
+        self.assertEqual(len(self.wiki.api_requests(prop='revisions')), 5)
+        self.assertEqual(len(self.wiki.api_requests(rvcontinue='2')), 2)
+        for request in self.wiki.api_requests(prop='revisions'):
+            self.assertLessEqual(len(request['titles'].split('|')), 3)
+
+    def test_missing_page(self):
+        """Nonexistent pages are reported as errors and left out."""
+        missing = title_to_url(PREFIX + 'Gibt es nicht')
+        errors = {}
+        pages = bookinfo.fetch_pages_via_api(
+            self.urls[:2] + [missing], errors=errors, rate_limit=None)
+        self.assertEqual(set(pages), set(self.urls[:2]))
+        self.assertEqual(list(errors), [missing])
+
+    def test_book_pages(self):
+        """Pages of several books are fetched once through the API."""
+        self.wiki.books['Analysis_2'] = TITLES[5:] + [TITLES[0]]
+        books = bookinfo.fetch_article_list()
+        self.assertEqual(list(books), ['Analysis_1', 'Analysis_2'])
+        pages = bookinfo.fetch_book_pages(books, use_api=True,
+                                          rate_limit=None)
+        self.assertEqual(list(pages), self.urls)
+        titles = [title for request
+                  in self.wiki.api_requests(prop='revisions')
+                  if 'rvcontinue' not in request
+                  for title in request['titles'].split('|')]
+        self.assertEqual(len(titles), len(TITLES))
+
+
+class UpdateCacheTest(unittest.TestCase):
+    """Test updating the cached pages with only the changed ones."""
+
+    def setUp(self):
+        self.wiki = FakeWiki({'Analysis_1': TITLES[:4]})
+        self.wiki.start()
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, 'cache.db')
+        self.books = bookinfo.fetch_article_list()
+
+    def tearDown(self):
+        self.wiki.stop()
+        self.directory.cleanup()
+
+    def update(self, action):
+        """
+        Update the cache and return the titles of the pages which were
+        downloaded.
+        """
+        self.wiki.requests.clear()
+        bookinfo.update_cache(self.books, self.cache, action=action,
+                              rate_limit=None)
+        return [params['title'].replace('_', ' ')
+                for (path, params) in self.wiki.requests
+                if path == '/w/index.php']
+
+    def test_raw_pages(self):
+        """Only edited pages are downloaded again."""
+        self.assertEqual(self.update('raw'), TITLES[:4])
+        self.wiki.edit(TITLES[1], 'Edited', '2021-01-01T00:00:00Z')
+        self.wiki.touch(TITLES[2], '2021-01-01T00:00:00Z')
+        self.assertEqual(self.update('raw'), [TITLES[1]])
+        self.assertEqual(self.update('raw'), [])
+
+    def test_rendered_pages(self):
+        """Rendered pages are downloaded again after an edit of a template."""
+        self.assertEqual(self.update('view'), TITLES[:4])
+        self.wiki.edit(TITLES[1], 'Edited', '2021-01-01T00:00:00Z')
+        self.wiki.touch(TITLES[2], '2021-01-01T00:00:00Z')
+        self.assertEqual(self.update('view'), TITLES[1:3])
+        self.assertEqual(self.update('view'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+Tests of collecting the contents of WikiText constructs with
+util.content_stats.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import os
+import tempfile
+import unittest
+
+from util import content_stats, wikitext
+
+# WikiText of the page of the tests
+TEXT = 'Text\n<gallery>\nBild.png\n</gallery>\n{|\n| Zelle\n|}'
+
+
+class ExtractContentTest(unittest.TestCase):
+    """Test the helper functions of the module."""
+
+    def test_spans_and_regex(self):
+        """Spans and regular expression matches give the same contents."""
+        self.assertEqual(
+            content_stats.extract_content(TEXT, span_kind=wikitext.GALLERY),
+            ['\nBild.png\n'])
+        self.assertEqual(
+            content_stats.extract_content(TEXT, '<gallery>(.*?)</gallery>'),
+            ['\nBild.png\n'])
+
+    def test_basic_analysis(self):
+        """The contents are returned and written to the output files."""
+        working_directory = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                contents = content_stats.basic_analysis(
+                    'table', {'Seite': TEXT, 'Leer': 'Text'},
+                    span_kind=wikitext.TABLE)
+                with open('out/table_stats.txt') as stats:
+                    self.assertEqual(stats.read(), 'Seite\t1')
+            finally:
+                os.chdir(working_directory)
+        self.assertEqual(contents, {'Seite': ['\n| Zelle\n']})
+
+
+if __name__ == '__main__':
+    unittest.main()
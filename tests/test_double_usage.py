@@ -0,0 +1,85 @@
+"""
+Tests of the analysis of the marked sections by double_usage_finder.py.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from util import analysis, site_caching
+
+import double_usage_finder
+
+# Prefix of the urls of the articles
+PREFIX = '/wiki/Mathe_f%C3%BCr_Nicht-Freaks:_'
+# Book whose pages the analyzer excludes
+EXCLUDED = double_usage_finder.DoubleUsageAnalyzer.excluded_books[0]
+# Books and pages of the tests
+BOOKS = {'Analysis': [PREFIX + 'Folgen', PREFIX + 'Reihen'],
+         EXCLUDED: [PREFIX + 'Mitmachen']}
+PAGES = [
+    (PREFIX + 'Folgen',
+     '{{#lst:Mathe für Nicht-Freaks: Reihen|fehlt}}\n'
+     '{{#lst:Mathe für Nicht-Freaks: Mitmachen|hilfe}}\n'
+     '{{#lst:Mathe für Nicht-Freaks: Gibt es nicht|x}}'),
+    (PREFIX + 'Reihen', 'Keine Abschnitte'),
+    (PREFIX + 'Mitmachen', '<section begin=hilfe />Hilfe<section end=hilfe />'),
+]
+
+
+class DanglingSectionsTest(unittest.TestCase):
+    """Test reporting the usages of sections which don't exist."""
+
+    def setUp(self):
+        self.working_directory = os.getcwd()
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+
+    def tearDown(self):
+        os.chdir(self.working_directory)
+        self.directory.cleanup()
+
+    def dangling_sections(self, cache=None):
+        """
+        Run the analyzer over the pages and return the kinds and contents of
+        the records of the dangling sections.
+        """
+        analysis.run_analyzers(
+            [double_usage_finder.DoubleUsageAnalyzer('jsonl')], PAGES, BOOKS,
+            cache=cache)
+        with open('out/dangling_sections.jsonl') as records:
+            return [(record['kind'], record['content'])
+                    for record in map(json.loads, records)]
+
+    def test_pages_outside_of_the_run(self):
+        """
+        Usages of sections on excluded pages aren't reported, usages of
+        missing sections on analysed pages and of unknown pages are.
+        """
+        self.assertEqual(self.dangling_sections(), [
+            ('dangling_usage', 'Mathe für Nicht-Freaks: Reihen|fehlt'),
+            ('unknown_page', 'Mathe für Nicht-Freaks: Gibt es nicht|x')])
+
+    def test_skipped_page(self):
+        """
+        A page skipped because of the text index counts as analysed page
+        without sections.
+        """
+        site_caching.cache_page_data(BOOKS, dict(PAGES), cache='cache.db')
+        try:
+            site_caching.create_text_index('cache.db')
+        except sqlite3.OperationalError:
+            self.skipTest('SQLite has no trigram tokenizer')
+        self.assertEqual(self.dangling_sections('cache.db')[0], (
+            'dangling_usage', 'Mathe für Nicht-Freaks: Reihen|fehlt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+Tests of finding near-duplicates with util.minhash.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import random
+import unittest
+from unittest import mock
+
+from util import minhash
+
+
+def boilerplate_passages(count):
+    """
+    Return count passages consisting of the same boilerplate sentence and
+    random words followed by near-duplicates of the passages 5 and 7.
+    """
+    generator = random.Random(1)
+    boilerplate = ' '.join('Vorlage{}'.format(number) for number in range(30))
+    passages = [boilerplate + ' ' + ' '.join(
+        'Wort{}'.format(generator.randrange(10 ** 6)) for _ in range(30))
+                for _ in range(count)]
+    return passages + [passages[5] + ' Ende', passages[7] + ' Ende']
+
+
+class DuplicateGroupsTest(unittest.TestCase):
+    """Test grouping the passages by their signatures."""
+
+    def test_all_pairs_of_a_bucket(self):
+        """
+        Near-duplicates are found although the first passage sharing their
+        LSH keys is no near-duplicate of them.
+        """
+        keys = list(range(1, minhash.LSH_KEYS + 1))
+        unrelated = keys + list(range(500, 556))
+        duplicate = keys + list(range(100, 156))
+        signatures = [unrelated, duplicate, list(duplicate)]
+        self.assertEqual(minhash.duplicate_groups(signatures), [[1, 2]])
+
+    def test_boilerplate(self):
+        """
+        Passages sharing boilerplate text are compared a number of times
+        which grows linearly with the number of passages.
+        """
+        for count in (1000, 4000):
+            signatures = [minhash.signature(minhash.shingles(minhash.words(
+                passage))) for passage in boilerplate_passages(count)]
+            with mock.patch.object(minhash, 'similarity',
+                                   wraps=minhash.similarity) as similarity:
+                groups = minhash.duplicate_groups(signatures)
+            self.assertEqual(groups, [[5, count], [7, count + 1]])
+            self.assertLessEqual(similarity.call_count, count // 10)
+
+    def test_similar_texts(self):
+        """Passages differing in a single word form a group."""
+        text = ' '.join('Wort{}'.format(number) for number in range(200))
+        other = ' '.join('Anders{}'.format(number) for number in range(200))
+        signatures = [minhash.signature(minhash.shingles(minhash.words(
+            passage))) for passage in (other, text, text + ' Ende')]
+        self.assertEqual(minhash.duplicate_groups(signatures), [[1, 2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+"""
+Tests of the shards and their partial results with util.sharding.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from util import bookinfo, sharding, site_caching
+
+from tests.fakewiki import FakeWiki, PREFIX, title_to_url
+
+# Urls of the pages of the tests
+URLS = ['/wiki/Mathe_f%C3%BCr_Nicht-Freaks:_Analysis_{}'.format(number)
+        for number in range(6)]
+# Books of the tests
+BOOKS = {'Analysis': URLS}
+# Books of the fake wiki of the tests
+WIKI_BOOKS = {book: [PREFIX + '{} {}'.format(book, number)
+                     for number in range(8)]
+              for book in ('Analysis', 'Lineare Algebra')}
+
+
+def shard_header(number, pages, path):
+    """
+    Select the pages of the shard number of two shards, write them to the
+    partial result file path and return its header.
+    """
+    shard = sharding.Shard(number, 2)
+    fingerprint = sharding.new_fingerprint(BOOKS)
+    positions = {}
+    writer = sharding.PartialWriter(path, 'analyses', shard)
+    for (url, _) in sharding.select_pages(pages, shard, BOOKS, positions,
+                                          fingerprint):
+        writer.write(position=positions[url], url=url)
+    writer.close(fingerprint)
+    return sharding.read_header(path)
+
+
+class FingerprintTest(unittest.TestCase):
+    """Test detecting shards which were run over different pages."""
+
+    def setUp(self):
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = [os.path.join(self.directory.name, 'part{}.jsonl'.format(
+            number)) for number in (1, 2)]
+        self.pages = [(url, 'Text of {}'.format(url)) for url in URLS]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_same_corpus(self):
+        """Shards over the same pages can be merged."""
+        headers = [shard_header(number, self.pages, path)
+                   for (number, path) in zip((1, 2), self.paths)]
+        self.assertIsNone(sharding.different_corpora(headers))
+        self.assertIsNone(sharding.missing_shards(headers))
+        positions = sorted(record['position'] for path in self.paths
+                           for record in sharding.iter_records(path))
+        self.assertEqual(positions, list(range(len(URLS))))
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['part1.jsonl', 'part2.jsonl'])
+
+    def test_changed_page(self):
+        """Shards over different contents of a page are refused."""
+        changed = list(self.pages)
+        changed[3] = (URLS[3], 'Edited')
+        headers = [shard_header(1, self.pages, self.paths[0]),
+                   shard_header(2, changed, self.paths[1])]
+        self.assertIsNotNone(sharding.different_corpora(headers))
+
+    def test_changed_order(self):
+        """Shards over the pages in different orders are refused."""
+        headers = [shard_header(1, self.pages, self.paths[0]),
+                   shard_header(2, self.pages[::-1], self.paths[1])]
+        self.assertIsNotNone(sharding.different_corpora(headers))
+
+
+class ShardPagesTest(unittest.TestCase):
+    """Test selecting the pages of the shards before they are fetched."""
+
+    def setUp(self):
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, 'cache.db')
+        self.wiki = FakeWiki(WIKI_BOOKS)
+        self.wiki.start()
+
+    def tearDown(self):
+        self.wiki.stop()
+        self.directory.cleanup()
+
+    def run_shard(self, number, *options):
+        """
+        Read or fetch the pages of the shard number of two shards with
+        book_argument_parser and the given options. Return the pages.
+        """
+        argv = ['diagnostics.py', '--rate', '0', '--shard',
+                '{}/2'.format(number), '--partial',
+                os.path.join(self.directory.name, 'part.jsonl')]
+        with mock.patch.object(sys, 'argv', argv + list(options)):
+            (_, pages, _) = bookinfo.book_argument_parser(stream=True)
+        self.assertIsInstance(pages, sharding.ShardPages)
+        self.assertEqual([url for (url, _) in pages], list(pages.positions))
+        return pages
+
+    def check_shards(self, shards):
+        """
+        Check that the shards got disjoint pages at their positions in the
+        whole run and the same fingerprints.
+        """
+        positions = {}
+        for pages in shards:
+            self.assertFalse(set(positions) & set(pages.positions))
+            positions.update(pages.positions)
+        urls = {title_to_url(title) for titles in WIKI_BOOKS.values()
+                for title in titles}
+        self.assertEqual(set(positions), urls)
+        self.assertEqual(sorted(positions.values()), list(range(len(urls))))
+        self.assertEqual(shards[0].fingerprint.hexdigest(),
+                         shards[1].fingerprint.hexdigest())
+
+    def test_fetch(self):
+        """Every shard only downloads its own pages."""
+        shards = []
+        for number in (1, 2):
+            self.wiki.requests.clear()
+            pages = self.run_shard(number)
+            fetched = [params['title'] for (path, params) in self.wiki.requests
+                       if path == '/w/index.php' and
+                       params.get('action') == 'raw']
+            self.assertEqual(sorted(title_to_url(title) for title in fetched),
+                             sorted(pages.positions))
+            shards.append(pages)
+        self.check_shards(shards)
+
+    def test_cache(self):
+        """Every shard only reads its own pages from the cache."""
+        books = bookinfo.fetch_article_list()
+        site_caching.cache_page_data(books, bookinfo.fetch_book_pages(
+            books, rate_limit=None), cache=self.cache)
+        self.wiki.requests.clear()
+        shards = [self.run_shard(number, '-c', self.cache)
+                  for number in (1, 2)]
+        self.check_shards(shards)
+        self.assertFalse(self.wiki.requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
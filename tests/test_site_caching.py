@@ -0,0 +1,46 @@
+"""
+Tests of the cache database of util.site_caching.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import os
+import tempfile
+import unittest
+
+from util import site_caching
+
+# Url of the page of the tests
+URL = '/wiki/Mathe_f%C3%BCr_Nicht-Freaks:_Analysis'
+
+
+class OpenCacheTest(unittest.TestCase):
+    """Test opening the cache database."""
+
+    def setUp(self):
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, 'cache.db')
+        site_caching.cache_page_data({'Analysis': [URL]}, {URL: 'Text'},
+                                     cache=self.cache)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_open_while_writing(self):
+        """A current cache can be read while another connection writes."""
+        writer = site_caching.open_cache_db(self.cache)
+        writer.execute('BEGIN IMMEDIATE')
+        writer.execute('DELETE FROM books')
+        try:
+            self.assertEqual(list(site_caching.read_page_hashes(self.cache)),
+                             [URL])
+        finally:
+            writer.rollback()
+            writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
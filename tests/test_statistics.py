@@ -0,0 +1,61 @@
+"""
+Tests of storing the item counts of the analyzers with util.statistics.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from util import result_cache, site_caching, statistics
+
+# Urls of the pages of the tests
+URLS = ['/wiki/Mathe_f%C3%BCr_Nicht-Freaks:_Analysis_{}'.format(number)
+        for number in range(5)]
+# Books of the tests, the last page belongs to two books
+BOOKS = {'Analysis': URLS, 'Lineare_Algebra': URLS[-1:]}
+
+
+class StatisticsStoreTest(unittest.TestCase):
+    """Test writing the counts in batches."""
+
+    def setUp(self):
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, 'cache.db')
+        site_caching.cache_page_data(BOOKS, {url: 'Text' for url in URLS},
+                                     cache=self.cache)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_batches(self):
+        """
+        Only a batch of counts is kept in memory and the counts of a page
+        with several analyzers survive the batches.
+        """
+        with mock.patch.object(result_cache, 'FLUSH_SIZE', 2):
+            store = statistics.StatisticsStore(['macros', 'templates'],
+                                               self.cache)
+            for url in URLS:
+                store.add_page(url)
+                books = [book for book in BOOKS if url in BOOKS[book]]
+                store.add('macros', url, books, {'\\R': 1})
+                store.add('templates', url, books, {'Satz': 2})
+                self.assertLessEqual(len(store.rows), 6)
+            store.close()
+        self.assertEqual(statistics.top_items('macros', cache=self.cache),
+                         [('\\R', 5, 5)])
+        self.assertEqual(
+            statistics.book_counts('templates', 'Satz', cache=self.cache),
+            [('Analysis', 10, 5), ('Lineare_Algebra', 2, 1)])
+        self.assertEqual(len(statistics.query(
+            self.cache, 'SELECT * FROM statistics', ())), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
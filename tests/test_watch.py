@@ -0,0 +1,142 @@
+"""
+Tests of keeping the cache and the analyses up to date with watch.py.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from util import bookinfo, site_caching
+
+import watch
+
+from tests.fakewiki import FakeWiki, PREFIX, SITEMAP, title_to_url
+
+# Titles of the pages of the fake wiki
+TITLES = [PREFIX + 'Analysis {}'.format(number) for number in range(4)]
+# Timestamps of the edits of the tests, the pages were created before
+START = '2021-01-01T00:00:00Z'
+EDITED = '2021-01-01T00:01:00Z'
+
+
+class WatchTest(unittest.TestCase):
+    """Test polling the recent changes and updating the cache."""
+
+    def setUp(self):
+        self.working_directory = os.getcwd()
+        # Removed by tearDown
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        self.wiki = FakeWiki({'Analysis': TITLES})
+        self.wiki.pages[TITLES[0]]['content'] = '[[{}]]'.format(TITLES[1])
+        self.wiki.start()
+        books = bookinfo.fetch_article_list()
+        revisions = {}
+        pages = bookinfo.fetch_book_pages(books, use_api=True,
+                                          revisions=revisions,
+                                          rate_limit=None)
+        site_caching.cache_page_data(books, pages, cache='cache.db',
+                                     revisions=revisions)
+        self.watcher = watch.Watcher(['gallery'], 'cache.db',
+                                     logfile='bad.csv', rate_limit=None)
+        self.watcher.since = START
+        self.watcher.start(books, site_caching.iter_pages('cache.db'))
+
+    def tearDown(self):
+        self.wiki.stop()
+        os.chdir(self.working_directory)
+        self.directory.cleanup()
+
+    def poll_and_update(self):
+        """
+        Poll the recent changes and process them. Return the result of the
+        poll.
+        """
+        self.wiki.requests.clear()
+        polled = self.watcher.poll()
+        if polled is None:
+            return None
+        self.watcher.process(*polled)
+        return polled[0]
+
+    def rendered_titles(self):
+        """Return the titles of the pages rendered since the last poll."""
+        return [params['title'].replace('_', ' ')
+                for (path, params) in self.wiki.requests
+                if path == '/w/index.php' and params.get('action') == 'view']
+
+    def test_edit(self):
+        """An edited page is fetched again and analysed."""
+        self.wiki.edit(TITLES[2], '<gallery>\nBild.png\n</gallery>', EDITED)
+        self.assertEqual(self.poll_and_update(),
+                         ([title_to_url(TITLES[2])], []))
+        pages = dict(site_caching.iter_pages('cache.db'))
+        self.assertIn('<gallery>', pages[title_to_url(TITLES[2])])
+        with open('out/gallery_content.txt') as gallery:
+            self.assertIn('Bild.png', gallery.read())
+        self.assertEqual(self.rendered_titles(), [TITLES[2]])
+        # The change isn't processed twice.
+        self.assertIsNone(self.poll_and_update())
+
+    def test_failed_update(self):
+        """
+        A change whose page couldn't be fetched is returned by the next poll
+        again.
+        """
+        self.wiki.edit(TITLES[2], '<gallery>\nBild.png\n</gallery>', EDITED)
+        self.wiki.failing.add(TITLES[2])
+        with mock.patch.object(bookinfo.HTTP_CLIENT, 'retries', 0):
+            self.watcher.watch(interval=0, polls=1)
+        pages = dict(site_caching.iter_pages('cache.db'))
+        self.assertNotIn('<gallery>', pages[title_to_url(TITLES[2])])
+        self.wiki.failing.clear()
+        self.assertEqual(self.poll_and_update(),
+                         ([title_to_url(TITLES[2])], []))
+        pages = dict(site_caching.iter_pages('cache.db'))
+        self.assertIn('<gallery>', pages[title_to_url(TITLES[2])])
+        self.assertIsNone(self.poll_and_update())
+
+    def test_other_namespaces(self):
+        """Changes outside of the articles are ignored."""
+        self.wiki.edit('Benutzer:Jemand', 'Text', EDITED, namespace=2)
+        self.assertIsNone(self.poll_and_update())
+        self.assertEqual(self.wiki.api_requests(
+            list='recentchanges')[0]['rcnamespace'], '0')
+
+    def test_delete(self):
+        """
+        A deleted page is removed from the cache and the pages linking to it
+        are rendered again.
+        """
+        self.wiki.delete(TITLES[1], EDITED)
+        self.assertEqual(self.poll_and_update(),
+                         ([], [title_to_url(TITLES[1])]))
+        for action in ('raw', 'view'):
+            self.assertNotIn(title_to_url(TITLES[1]),
+                             site_caching.read_page_hashes('cache.db',
+                                                           action))
+        self.assertEqual(self.rendered_titles(), [TITLES[0]])
+
+    def test_move(self):
+        """
+        A moved page is removed from the cache under its old title and
+        fetched under its new title, when the sitemap lists it.
+        """
+        moved = PREFIX + 'Analysis neu'
+        self.wiki.move(TITLES[3], moved, EDITED)
+        self.wiki.books['Analysis'][3] = moved
+        self.wiki.edit(SITEMAP, 'Sitemap', EDITED)
+        self.assertEqual(self.poll_and_update(),
+                         ([title_to_url(moved)], [title_to_url(TITLES[3])]))
+        self.assertEqual(
+            sorted(site_caching.read_page_hashes('cache.db')),
+            sorted(title_to_url(title) for title in TITLES[:3] + [moved]))
+
+
+if __name__ == '__main__':
+    unittest.main()
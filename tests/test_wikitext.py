@@ -0,0 +1,177 @@
+"""
+Tests of tokenizing the WikiText with util.wikitext and of the finders using
+its spans.
+
+Run the tests from the root directory of the repository with
+python -m unittest
+"""
+
+import re
+import unittest
+
+from util import wikitext
+
+from benchmarks import corpus
+
+import boxen_finder
+import double_usage_finder
+import gallery_finder
+import ref_finder
+import table_finder
+import tex_macro_finder
+
+# Number of pages of the generated corpus of the regression tests
+PAGE_COUNT = 40
+# Comments, which the finders before the tokenizer didn't skip
+COMMENT_REGEX = re.compile('<!--.*?-->', re.DOTALL)
+
+
+def spans(string):
+    """Return the spans of string as (kind, text, name, depth) tuples."""
+    return [(span.kind, span.text(string), span.name, span.depth)
+            for span in wikitext.page_spans(string)]
+
+
+def contents(analyzer_class, string):
+    """Return the contents collected by a ContentAnalyzer in string."""
+    return [content for (_, content) in analyzer_class().extract(string)]
+
+
+def regex_contents(regex_string, string, flags=re.DOTALL):
+    """Return the contents matched by the first group of regex_string."""
+    return [match.group(1)
+            for match in re.finditer(regex_string, string, flags)]
+
+
+class TokenizeTest(unittest.TestCase):
+    """Test the spans of constructs needing special care."""
+
+    def test_nested_tables(self):
+        """Nested tables are emitted with their depth."""
+        inner = '{|\n| b\n|}'
+        outer = '{|\n| a\n' + inner + '\n|}'
+        self.assertEqual(spans(outer), [
+            (wikitext.TABLE, outer, None, 0),
+            (wikitext.TABLE, inner, None, 1)])
+
+    def test_nested_templates(self):
+        """Templates closed by four braces are both closed."""
+        self.assertEqual(spans('{{A|{{B}}}}'), [
+            (wikitext.TEMPLATE, '{{A|{{B}}}}', 'A', 0),
+            (wikitext.TEMPLATE, '{{B}}', 'B', 1)])
+
+    def test_parameters(self):
+        """
+        Three braces close a template parameter if one is open and a
+        template otherwise.
+        """
+        self.assertEqual(spans('{{A|{{{1}}}}}'), [
+            (wikitext.TEMPLATE, '{{A|{{{1}}}}}', 'A', 0)])
+        self.assertEqual(spans('{{A|x}}} {{B}}'), [
+            (wikitext.TEMPLATE, '{{A|x}}', 'A', 0),
+            (wikitext.TEMPLATE, '{{B}}', 'B', 0)])
+
+    def test_unclosed_comment(self):
+        """An unclosed comment hides the rest of the page."""
+        self.assertEqual(spans('{{A}} <!-- {{B}} <math>x</math>'), [
+            (wikitext.TEMPLATE, '{{A}}', 'A', 0)])
+        self.assertEqual(spans('<!-- {{B}} --> {{C}}'), [
+            (wikitext.TEMPLATE, '{{C}}', 'C', 0)])
+
+    def test_pipe_before_template_end(self):
+        """A pipe followed by two braces closes no table."""
+        self.assertEqual(spans('{{A|x|}}'), [
+            (wikitext.TEMPLATE, '{{A|x|}}', 'A', 0)])
+        table = '{|\n| x\n|}'
+        self.assertEqual(spans('{{A|\n' + table + '\n}}'), [
+            (wikitext.TEMPLATE, '{{A|\n' + table + '\n}}', 'A', 0),
+            (wikitext.TABLE, table, None, 0)])
+
+    def test_braces_in_reference(self):
+        """Braces inside a reference don't close a template around it."""
+        text = '{{A|<ref>\\{ b \\}}</ref>}}'
+        self.assertEqual(spans(text), [
+            (wikitext.TEMPLATE, text, 'A', 0),
+            (wikitext.REF, '<ref>\\{ b \\}}</ref>', None, 0)])
+
+
+class PreSeriesRegressionTest(unittest.TestCase):
+    """
+    Compare the finders with the regular expressions they used before the
+    tokenizer on the pages of a generated corpus (see benchmarks.corpus).
+    The regular expressions see the pages without comments. The differences
+    which the tokenizer fixes are left out: math environments spanning
+    several lines, parameterless templates (reported with their closing
+    braces before) and tables containing nested tables or |} in math.
+    """
+
+    def setUp(self):
+        self.pages = [corpus.wikitext_page(0, number, PAGE_COUNT)
+                      for number in range(PAGE_COUNT)]
+
+    def compare(self, old_finder, new_finder):
+        """
+        Check that both finder functions return the same findings for every
+        page. old_finder gets the page without comments.
+        """
+        for page in self.pages:
+            self.assertEqual(old_finder(COMMENT_REGEX.sub('', page)),
+                             new_finder(page))
+
+    def test_math(self):
+        """The contents of single line math environments are the same."""
+        self.compare(
+            lambda page: regex_contents('<math>(.+?)</math>', page, 0),
+            lambda page: [content for content
+                          in tex_macro_finder.extract_math_substrings(page)
+                          if '\n' not in content])
+
+    def test_refs_and_galleries(self):
+        """The contents of references and galleries are the same."""
+        self.compare(lambda page: regex_contents('<ref>(.+?)</ref>', page),
+                     lambda page: contents(ref_finder.RefAnalyzer, page))
+        self.compare(
+            lambda page: regex_contents('<gallery[^>]*>(.+?)</gallery',
+                                        page),
+            lambda page: contents(gallery_finder.GalleryAnalyzer, page))
+
+    def test_templates(self):
+        """The custom templates are the same."""
+        self.compare(
+            lambda page: [re.sub('}}$', '', template.strip())
+                          for template in re.findall(
+                              '{{:Mathe\\s+für\\s+Nicht-Freaks:\\s+'
+                              'Vorlage:[^|\\n]+', page)],
+            boxen_finder.extract_templates)
+
+    def test_sections(self):
+        """The marked sections and their usages are the same."""
+        self.compare(
+            lambda page: regex_contents('<section begin(.+?)<section end',
+                                        page),
+            double_usage_finder.extract_sections)
+        self.compare(
+            lambda page: regex_contents('{{#lst:(.+?)}}', page, 0),
+            double_usage_finder.extract_section_usages)
+
+    def test_tables(self):
+        """
+        Simple tables outside of other tables are found by both, and the
+        regular expression only found beginnings of tables.
+        """
+        for page in self.pages:
+            old = regex_contents('({\\|[^\\n]*\\n.+?\\|})',
+                                 COMMENT_REGEX.sub('', page))
+            new = contents(table_finder.TableAnalyzer, page)
+            for span in wikitext.spans_of_kind(page, wikitext.TABLE):
+                table = span.text(page)
+                if not span.depth and table.count('{|') == 1 and \
+                   table.count('|}') == 1:
+                    self.assertIn(table, old)
+            for table in old:
+                self.assertTrue(any(other.startswith(table)
+                                    for other in new))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,23 +5,18 @@ When run as a standalone script this performs all necessary steps for finding
 all TeX macros in the Mathe für Nicht-Freaks project.
 """
 
-import os
-import sys
-import getopt
+import collections
 import re
 
-from util import bookinfo, site_caching
+from util import analysis, bookinfo, wikitext
 
 
 def extract_math_substrings(string):
     """
     Find all <math> environments and return their content as string array.
     """
-    math_regex = re.compile('<math>(.+?)</math>')
-    math_substrings = []
-    for match in math_regex.finditer(string):
-        math_substrings.append(match.group(1))
-    return math_substrings
+    return [span.inner(string)
+            for span in wikitext.spans_of_kind(string, wikitext.MATH)]
 
 
 def extract_tex_macros(string):
@@ -45,40 +40,51 @@ def extract_tex_macros_of_page(string):
     return tex_macros
 
 
-def main():
-    """Main program body."""
-    (opts_list, _) = getopt.getopt(sys.argv[1:], 'c:ro:')
-    opts = dict(opts_list)
+@analysis.register_analyzer
+class TexMacroAnalyzer(analysis.Analyzer):
+    """
+    Collect the TeX macros used in math environments. The alphabetically
+    sorted list of macros is printed and written to output (if not None).
+    The number of usages of every macro per page is stored in the statistics
+    of the cache.
+    """
+    name = 'tex_macros'
+    version = 2
+    prefilter = ('<math',)
 
-    if '-c' in opts and os.path.isfile(opts['-c']) and '-r' not in opts:
-        (books, pages) = site_caching.read_cached_data(cache=opts['-c'])
-    else:
-        books = bookinfo.fetch_article_list()
-        pages = {}
-        for book in books:
-            page_content = bookinfo.fetch_pages_from_list(
-                books[book], action='raw',
-                page_postprocessor=lambda byte_string:
-                byte_string.decode('utf-8'))
-            pages = {
-                **pages,
-                **page_content
-            }
-        if '-c' in opts:
-            site_caching.cache_page_data(books, pages, cache=opts['-c'])
+    def __init__(self, output='out/tex_macros.txt'):
+        super().__init__()
+        self.output = output
+        self.macros = set()
 
-    tex_macros = []
-    for page in pages:
-        tex_macros.extend(extract_tex_macros_of_page(pages[page]))
+    def extract(self, content):
+        return extract_tex_macros_of_page(content)
+
+    def collect(self, url, findings):
+        self.macros.update(findings)
 
-    discovered_macros = list(set(tex_macros))
-    discovered_macros.sort()
+    def count_items(self, findings):
+        return collections.Counter(findings)
 
-    print('\n'.join(discovered_macros))
+    def write_results(self):
+        discovered_macros = sorted(self.macros)
+
+        print('\n'.join(discovered_macros))
+
+        if self.output is not None:
+            analysis.make_output_dir(self.output)
+            with open(self.output, 'w') as filehandle:
+                filehandle.write('\n'.join(discovered_macros))
+
+
+def main():
+    """Main program body."""
+    (books, pages, (opts_list, _)) = bookinfo.book_argument_parser(
+        'o:', stream=True)
+    opts = dict(opts_list)
 
-    if '-o' in opts:
-        with open(opts['-o'], 'w') as filehandle:
-            filehandle.write('\n'.join(discovered_macros))
+    analysis.run_analyzers([TexMacroAnalyzer(opts.get('-o'))], pages,
+                           books, **analysis.parse_run_options(opts))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,707 @@
+"""
+Module for running several analyses over the pages of the Mathe für
+Nicht-Freaks project in a single pass.
+
+Every analysis is implemented as a subclass of Analyzer. Analyzers which are
+decorated with register_analyzer can be selected by their name, e.g. by the
+script diagnostics.py.
+"""
+
+import collections
+import heapq
+import json
+import os
+import pickle
+import sys
+import tempfile
+
+from . import corpus_file, metrics, parallel, sharding, site_caching
+from .result_cache import ResultCache
+from .statistics import StatisticsStore
+
+# All registered analyzer classes indexed by their names.
+ANALYZERS = {}
+# Number of pages sent to a worker process of run_analyzers at once
+CHUNK_SIZE = 64
+
+
+def register_analyzer(analyzer_class):
+    """Class decorator which adds the analyzer class to ANALYZERS."""
+    ANALYZERS[analyzer_class.name] = analyzer_class
+    return analyzer_class
+
+
+class Analyzer:
+    """
+    Base class for an analysis of the pages' contents.
+
+    The analysis of a page is split into two steps: extract returns the
+    findings of a single page and collect merges them into the results of the
+    analyzer. After all pages have been processed, write_results writes the
+    output files of the analyzer.
+    """
+
+    # Name under which the analyzer is registered.
+    name = None
+    # Version of extract. Increase it whenever extract returns different
+    # findings, so that cached findings of older versions aren't used.
+    version = 1
+    # Books whose pages should not be analysed.
+    excluded_books = ()
+    # Literals of which every page with findings contains at least one. If
+    # the cache has a text index, only the pages which may contain one of
+    # them are analysed. The other pages must have no findings, i.e. collect
+    # must be a no-op for them. Empty if every page has to be analysed.
+    prefilter = ()
+    # Format of the records written by analyzers which output their findings
+    # as records (see util.record_writer).
+    output_format = 'text'
+
+    def __init__(self):
+        self.results = {}
+        self.page_books = {}
+
+    def prepare(self, page_books):
+        """
+        Prepare the analysis before the first page is processed. page_books
+        maps the urls of the pages to the names of the first books they
+        belong to.
+        """
+        self.page_books = page_books
+
+    def extract(self, content):
+        """
+        Return the findings in the content of a page. The findings have to be
+        serialisable as JSON, since they are stored in the result cache.
+        """
+        raise NotImplementedError
+
+    def collect(self, url, findings):
+        """
+        Merge the findings of the page url into the results. By default
+        nonempty findings are stored in the dictionary self.results indexed
+        by the urls.
+        """
+        if findings:
+            self.results[url] = findings
+
+    def write_results(self):
+        """Output the results of the analysis."""
+        raise NotImplementedError
+
+    def skip(self, url):
+        """
+        Note that the page url wasn't analysed, since the text index of the
+        cache shows that it contains none of the prefilter literals. Thus it
+        has no findings. Does nothing by default.
+        """
+
+    def count_matches(self, findings):
+        """
+        Return the number of matches in the findings of a page, which is
+        recorded in the metrics (see util.metrics). By default this is the
+        length of the findings.
+        """
+        return len(findings)
+
+    def count_items(self, findings):  # pylint: disable=unused-argument
+        """
+        Return a dictionary mapping the items in the findings of a page (e.g.
+        templates) to the number of their occurrences or None if the analyzer
+        doesn't count items. The counts are stored in the statistics of the
+        cache (see util.statistics).
+        """
+        return None
+
+    def describe_findings(self, findings):
+        """
+        Return the findings of a page as list of strings which don't depend
+        on the positions of the findings on the page. They are compared to
+        find the new and resolved findings between two snapshots (see
+        util.snapshots). By default every finding is described by itself or
+        by its JSON representation if it isn't a string.
+        """
+        return [finding if isinstance(finding, str)
+                else json.dumps(finding, ensure_ascii=False)
+                for finding in findings]
+
+
+def parse_analyzer_names(opts):
+    """
+    Return the names of the analyzers selected by the option -A in the
+    dictionary opts (all registered analyzers by default). Exit if one of
+    them isn't available.
+    """
+    if '-A' not in opts:
+        return list(ANALYZERS)
+    names = opts['-A'].split(',')
+    for name in names:
+        if name not in ANALYZERS:
+            print('The analyzer "{}" is not available.'.format(name))
+            sys.exit(1)
+    return names
+
+
+def parse_run_options(opts):
+    """
+    Return the keyword arguments of run_analyzers given by the options -c,
+    --processes, --shard, --shard-by and --partial in the dictionary opts.
+    """
+    return {
+        'cache': opts.get('-c'),
+        'processes': parallel.parse_processes(opts),
+        'shard': sharding.parse_shard(opts),
+        'partial': opts.get('--partial'),
+    }
+
+
+def make_output_dir(filename):
+    """Create the directory which will contain filename."""
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def allowed_pages(analyzer, books):
+    """
+    Return the set of page urls which the analyzer should process or None if
+    it processes every page.
+    """
+    if not analyzer.excluded_books:
+        return None
+    return {url for book in books if book not in analyzer.excluded_books
+            for url in books[book]}
+
+
+def first_books(books):
+    """
+    Return a dictionary mapping every page url in books to the name of the
+    first book containing it.
+    """
+    page_books = {}
+    for book in books:
+        for url in books[book]:
+            page_books.setdefault(url, book)
+    return page_books
+
+
+def all_books(books):
+    """
+    Return a dictionary mapping every page url in books to the list of the
+    names of all books containing it.
+    """
+    page_books = {}
+    for book in books:
+        for url in books[book]:
+            page_books.setdefault(url, []).append(book)
+    return page_books
+
+
+def candidate_pages(analyzer, cache):
+    """
+    Return the set of page urls which may contain one of the prefilter
+    literals of the analyzer according to the text index of the cache or
+    None if every page has to be analysed.
+    """
+    if cache is None or not analyzer.prefilter:
+        return None
+    return site_caching.find_candidate_pages(analyzer.prefilter, cache)
+
+
+def analyses_page(page_filter, url, page_hash, indexed_hashes):
+    """
+    Check whether an analyzer processes the page url whose content has the
+    hash page_hash. page_filter is the pair of the allowed pages (see
+    allowed_pages) and the candidates (see candidate_pages) of the analyzer.
+    The candidates only describe the indexed contents, whose hashes are
+    given by indexed_hashes, so a page whose content differs from the
+    indexed one is analysed anyway.
+    """
+    (allowed, candidates) = page_filter
+    if allowed is not None and url not in allowed:
+        return False
+    return candidates is None or url in candidates or \
+        indexed_hashes.get(url) != page_hash
+
+
+# Corpus file and analyzers of the worker processes of run_analyzers
+WORKER_STATE = {}
+
+
+def init_extract_worker(path, analyzers):
+    """
+    Initialise a worker process of run_analyzers by mapping the corpus file
+    path into memory (see corpus_file.ContentMap) and unpickling the
+    analyzers. The metrics inherited from the parent process are discarded.
+    """
+    metrics.reset()
+    WORKER_STATE['contents'] = corpus_file.ContentMap(path)
+    WORKER_STATE['analyzers'] = pickle.loads(analyzers)
+
+
+def extract_worker(chunk):
+    """
+    Extract the findings of a chunk of pages in a worker process. chunk is
+    a list of (location, positions of the analyzers) pairs, where location
+    is the position and length of the content of the page in the corpus
+    file. Return a list containing a list of (position, findings) pairs for
+    every page together with the metrics recorded meanwhile (see
+    metrics.take).
+    """
+    contents = WORKER_STATE['contents']
+    analyzers = WORKER_STATE['analyzers']
+    results = []
+    for (location, positions) in chunk:
+        content = contents.content(*location) if positions else None
+        extracted = []
+        for position in positions:
+            with metrics.stage('analyze.' + analyzers[position].name):
+                extracted.append((position,
+                                  analyzers[position].extract(content)))
+        results.append(extracted)
+    return (results, metrics.take())
+
+
+def write_corpus_pages(pages, writer, hashed):
+    """
+    Generator writing pages, an iterable of (url, content) pairs, with the
+    CorpusWriter writer and yielding an (url, hash, location) triple for
+    every page (see extract_located). The hashes are None unless hashed is
+    True.
+    """
+    for (url, content) in metrics.timed_iter('load_pages', pages):
+        page = writer.add(url, content)
+        page_hash = site_caching.content_hash(content) if hashed else None
+        yield (url, page_hash, writer.location(page))
+
+
+def cached_findings(analyzers, filters, indexed_hashes, result_cache, url,
+                    page_hash):
+    """
+    Look up the findings of the analyzers in the page url with the given
+    hash in result_cache (if given). Return the found findings indexed by
+    the positions of the analyzers and the positions of the analyzers whose
+    findings have to be extracted. Analyzers which skip the page according
+    to their filters in filters are left out of both (see analyses_page).
+    """
+    found = {}
+    positions = []
+    for (position, page_filter) in enumerate(filters):
+        if not analyses_page(page_filter, url, page_hash, indexed_hashes):
+            continue
+        findings = None
+        if result_cache is not None:
+            findings = result_cache.get(page_hash, analyzers[position])
+        if findings is None:
+            positions.append(position)
+        else:
+            found[position] = findings
+    return (found, positions)
+
+
+def add_extracted(analyzers, result_cache, page, extracted):
+    """
+    Add the findings extracted by a worker process, a list of (position,
+    findings) pairs, to the findings found in result_cache (see
+    cached_findings) and store them in result_cache (if given). page is the
+    (url, hash, found findings) triple of the page. Return the url and the
+    findings of every analyzer (None if it skipped the page).
+    """
+    (url, page_hash, found) = page
+    for (position, findings) in extracted:
+        found[position] = findings
+        if result_cache is not None:
+            result_cache.put(page_hash, analyzers[position], findings)
+    return (url, [found.get(position) for position in range(len(analyzers))])
+
+
+def extract_located(analyzers, filters, indexed_hashes, located,
+                    result_cache, processes, worker_args, flush=None):
+    """
+    Generator yielding the findings of the pages in located, an iterable of
+    (url, hash, location) triples of the pages in a corpus file, as
+    extract_in_pool does. The hashes are only needed if result_cache or
+    indexed_hashes is given. worker_args are the arguments of
+    init_extract_worker. flush is called before a chunk of pages is
+    dispatched to the workers.
+    """
+    cached = collections.deque()
+
+    def chunks():
+        chunk = []
+        for (url, page_hash, location) in located:
+            (found, positions) = cached_findings(
+                analyzers, filters, indexed_hashes, result_cache, url,
+                page_hash)
+            cached.append((url, page_hash, found))
+            chunk.append((location, positions))
+            if len(chunk) == CHUNK_SIZE:
+                if flush is not None:
+                    flush()
+                yield chunk
+                chunk = []
+        if chunk:
+            if flush is not None:
+                flush()
+            yield chunk
+
+    for (results, recorded) in parallel.ordered_map(
+            extract_worker, chunks(), processes,
+            initializer=init_extract_worker, initargs=worker_args):
+        metrics.merge(recorded)
+        for extracted in results:
+            yield add_extracted(analyzers, result_cache, cached.popleft(),
+                                extracted)
+
+
+def extract_in_pool(analyzers, filters, indexed_hashes, pages, result_cache,
+                    processes, pickled_analyzers):
+    """
+    Generator yielding a (url, findings) pair for every page of pages, where
+    findings contains the findings of every analyzer (None if the page is
+    skipped by the analyzer according to its filter in filters, see
+    analyses_page). The findings are extracted by a pool of processes
+    worker processes, which map a corpus file (see util.corpus_file) into
+    memory, so only the locations of the pages and the findings are sent
+    between the processes. Findings found in result_cache aren't extracted
+    again. The metrics recorded by the workers are added to the ones of
+    this process.
+    If pages is a site_caching.CachedPages without page_postprocessor, the
+    workers map a corpus exported from the cache, which is reused while the
+    cached pages are unchanged (see corpus_file.cached_corpus), and this
+    process doesn't read the pages at all. Otherwise the pages are written
+    into a temporary corpus file and every chunk of pages is dispatched to
+    the workers as soon as it is written.
+    """
+    path = None
+    if isinstance(pages, site_caching.CachedPages) and \
+       pages.page_postprocessor is None:
+        hashes = site_caching.read_page_hashes(pages.cache, pages.action)
+        with metrics.stage('export_corpus'):
+            path = corpus_file.cached_corpus(pages.cache, pages.action,
+                                             hashes)
+    if path is not None:
+        corpus = corpus_file.CorpusFile(path)
+        try:
+            numbers = {corpus.url(page): page for page in range(len(corpus))}
+            located = [(url, hashes[url], corpus.location(numbers[url]))
+                       for url in pages.page_urls() if url in numbers]
+        finally:
+            corpus.close()
+        yield from extract_located(
+            analyzers, filters, indexed_hashes, located, result_cache,
+            processes, (path, pickled_analyzers))
+        return
+    hashed = result_cache is not None or indexed_hashes is not None
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'corpus')
+        with corpus_file.CorpusWriter(path) as writer:
+            yield from extract_located(
+                analyzers, filters, indexed_hashes,
+                write_corpus_pages(pages, writer, hashed), result_cache,
+                processes, (path, pickled_analyzers), writer.flush)
+
+
+def shard_pages(analyzers, pages, books, shard=None, partial=None):
+    """
+    Select the pages of shard for run_analyzers (see util.sharding). Return
+    the selected pages, a dictionary mapping their urls to their positions
+    in the whole run, the PartialWriter of the partial result file partial
+    and the fingerprint of the run (both None if partial is None).
+    """
+    positions = {}
+    writer = None
+    fingerprint = None
+    if isinstance(pages, sharding.ShardPages):
+        # The pages of the shard were selected before they were read.
+        positions = pages.positions
+        fingerprint = pages.fingerprint
+        pages = pages.pages
+    elif shard is not None or partial is not None:
+        if partial is not None:
+            fingerprint = sharding.new_fingerprint(books)
+        pages = sharding.select_pages(pages, shard, books, positions,
+                                      fingerprint)
+    if partial is not None:
+        writer = sharding.PartialWriter(
+            partial, 'analyses', shard, books=books,
+            analyzers=[[analyzer.name, analyzer.version]
+                       for analyzer in analyzers])
+    return (pages, positions, writer, fingerprint)
+
+
+def page_filters(analyzers, books, cache=None):
+    """
+    Return the filters of the analyzers (see analyses_page) together with
+    the hashes of the pages in the text index of cache, which are None if
+    no analyzer uses the text index.
+    """
+    # The hashes are read before the candidates, so pages which are cached
+    # in between (e.g. while they are fetched again) count as changed.
+    indexed_hashes = None
+    if cache is not None and any(analyzer.prefilter
+                                 for analyzer in analyzers):
+        indexed_hashes = site_caching.read_page_hashes(cache)
+    filters = [(allowed_pages(analyzer, books) if books else None,
+                candidate_pages(analyzer, cache)) for analyzer in analyzers]
+    if all(candidates is None for (_, candidates) in filters):
+        indexed_hashes = None
+    return (filters, indexed_hashes)
+
+
+class PageCollector:
+    """
+    Collector of the findings of the pages of run_analyzers. It prepares
+    the analyzers for the books and sets up their filters, the result cache
+    and the statistics of cache (if given). The findings of every page are
+    fed to the analyzers or, if writer is given, written to this
+    PartialWriter together with the positions of the pages.
+    """
+
+    def __init__(self, analyzers, books, cache=None, processes=1,
+                 writer=None, positions=None):
+        self.analyzers = analyzers
+        self.processes = processes
+        self.writer = writer
+        self.positions = positions
+        (self.filters, self.indexed_hashes) = page_filters(analyzers, books,
+                                                           cache)
+        self.book_lists = all_books(books)
+        # The workers get the analyzers before prepare, so the books aren't
+        # sent to every worker.
+        self.pickled_analyzers = None
+        if processes > 1:
+            self.pickled_analyzers = pickle.dumps(analyzers)
+        page_books = first_books(books)
+        for analyzer in analyzers:
+            analyzer.prepare(page_books)
+        self.result_cache = None
+        self.statistics = None
+        if cache is not None:
+            self.result_cache = ResultCache(cache)
+            self.statistics = StatisticsStore(
+                [analyzer.name for analyzer in analyzers], cache)
+        # With processes > 1 the workers record the time of the analyses and
+        # this process only collects the findings.
+        stage_prefix = 'collect.' if processes > 1 else 'analyze.'
+        self.stages = [metrics.stage(stage_prefix + analyzer.name)
+                       for analyzer in analyzers]
+
+    def page_stream(self, pages):
+        """
+        Generator yielding an (url, content, findings) triple for every page
+        of pages. With processes > 1 the findings of every analyzer are
+        extracted by the worker processes and the content is None (see
+        extract_in_pool), otherwise the findings are None.
+        """
+        if self.processes > 1:
+            for (url, extracted) in extract_in_pool(
+                    self.analyzers, self.filters, self.indexed_hashes, pages,
+                    self.result_cache, self.processes,
+                    self.pickled_analyzers):
+                yield (url, None, extracted)
+        else:
+            for (url, content) in metrics.timed_iter('load_pages', pages):
+                yield (url, content, None)
+
+    def lookup_stream(self, pages):
+        """
+        Generator yielding an (url, None, findings) triple for every page of
+        pages, a site_caching.CachedPages without page_postprocessor, like
+        page_stream. The findings are looked up in the result cache by the
+        hashes stored in the cache first. Only the pages with missing
+        findings are read and these findings are extracted in this process.
+        """
+        hashes = site_caching.read_page_hashes(pages.cache, pages.action)
+        looked_up = collections.deque()
+        missing = {}
+        for url in pages.page_urls():
+            page_hash = hashes.get(url)
+            (found, positions) = cached_findings(
+                self.analyzers, self.filters, self.indexed_hashes,
+                self.result_cache, url, page_hash)
+            looked_up.append((url, page_hash, found))
+            if positions:
+                missing[url] = positions
+        read = site_caching.CachedPages(pages.cache, pages.book,
+                                        action=pages.action, urls=missing)
+        for (url, content) in metrics.timed_iter('load_pages', read):
+            # The pages are read in the order of page_urls.
+            while looked_up[0][0] != url:
+                yield self.reused_findings(looked_up.popleft())
+            (_, page_hash, found) = looked_up.popleft()
+            extracted = []
+            for position in missing[url]:
+                with self.stages[position]:
+                    extracted.append((position, self.analyzers[position]
+                                      .extract(content)))
+            if page_hash is None:
+                page_hash = site_caching.content_hash(content)
+            (_, findings) = add_extracted(self.analyzers, self.result_cache,
+                                          (url, page_hash, found), extracted)
+            yield (url, None, findings)
+        while looked_up:
+            yield self.reused_findings(looked_up.popleft())
+
+    def reused_findings(self, page):
+        """
+        Return the (url, None, findings) triple of a page of lookup_stream
+        whose findings were all found in the result cache. page is the
+        (url, hash, found findings) triple of the page.
+        """
+        (url, findings) = add_extracted(self.analyzers, self.result_cache,
+                                        page, [])
+        return (url, None, findings)
+
+    def add_page(self, url, content, extracted):
+        """
+        Collect the findings of a page yielded by page_stream. If extracted
+        is None, they are extracted from the content.
+        """
+        metrics.count('pages_analysed')
+        if self.statistics is not None:
+            self.statistics.add_page(url)
+        page_hash = None
+        if self.indexed_hashes is not None and content is not None:
+            page_hash = site_caching.content_hash(content)
+        for (position, (analyzer, page_filter, stage)) in enumerate(
+                zip(self.analyzers, self.filters, self.stages)):
+            (allowed, _) = page_filter
+            if allowed is not None and url not in allowed:
+                continue
+            if extracted is None:
+                skipped = not analyses_page(page_filter, url, page_hash,
+                                            self.indexed_hashes)
+            else:
+                # The worker processes return no findings for skipped pages.
+                skipped = extracted[position] is None
+            if skipped:
+                self.skip(analyzer, url)
+                continue
+            with stage:
+                if extracted is not None:
+                    findings = extracted[position]
+                elif self.result_cache is None:
+                    findings = analyzer.extract(content)
+                else:
+                    if page_hash is None:
+                        page_hash = site_caching.content_hash(content)
+                    findings = self.result_cache.findings(page_hash, analyzer,
+                                                          content)
+                self.collect(analyzer, url, findings)
+
+    def skip(self, analyzer, url):
+        """Tell analyzer that it skipped the page url."""
+        if self.writer is None:
+            analyzer.skip(url)
+        else:
+            self.writer.write(position=self.positions[url], url=url,
+                              analyzer=analyzer.name, skipped=True)
+
+    def collect(self, analyzer, url, findings):
+        """
+        Feed the findings of analyzer in the page url to the analyzer, count
+        the matches and store the counted items.
+        """
+        if self.writer is None:
+            analyzer.collect(url, findings)
+        else:
+            self.writer.write(position=self.positions[url], url=url,
+                              analyzer=analyzer.name, findings=findings)
+        metrics.count('matches.' + analyzer.name,
+                      analyzer.count_matches(findings))
+        if self.statistics is not None:
+            counts = analyzer.count_items(findings)
+            if counts:
+                self.statistics.add(analyzer.name, url,
+                                    self.book_lists.get(url, [None]), counts)
+
+    def close(self):
+        """Write the cached findings and the statistics."""
+        if self.result_cache is not None:
+            print('Reused {} cached findings, computed {} findings.'.format(
+                self.result_cache.hits, self.result_cache.misses))
+            metrics.count('result_cache_hits', self.result_cache.hits)
+            metrics.count('result_cache_misses', self.result_cache.misses)
+            self.result_cache.close()
+        if self.statistics is not None:
+            with metrics.stage('write_statistics'):
+                self.statistics.close()
+
+
+def run_analyzers(analyzers, pages, books=None, cache=None, processes=1,
+                  shard=None, partial=None, lookup_first=False):
+    """
+    Feed every page to all analyzers and write their results afterwards.
+    pages is an iterable of (url, content) pairs. If books is given, pages
+    belonging only to books excluded by an analyzer are skipped for this
+    analyzer. If cache is given, the findings of every page are memoized in
+    this cache database, so unchanged pages aren't analysed again. If the
+    cache has a text index, pages not containing the prefilter literals of
+    an analyzer are skipped for this analyzer, too, unless their content
+    differs from the cached one. The items counted by the
+    analyzers are stored in the statistics of the cache.
+    With processes > 1 the findings are extracted by a pool of processes
+    worker processes (see extract_in_pool), while the analyzers collect them
+    in the order of pages as before.
+    If shard is given, only the pages of this shard (see util.sharding) are
+    analysed. If partial is given, the findings are written to this partial
+    result file instead of the results of the analyzers, so they can be
+    merged with the findings of the other shards by merge_findings. Its
+    header contains the fingerprint of the books and all pages. If pages is
+    a sharding.ShardPages, it already contains only the pages of the shard
+    together with their positions and the fingerprint.
+    If lookup_first is True, pages has to be a site_caching.CachedPages
+    without page_postprocessor of cache. The findings are looked up by the
+    hashes stored in the cache first, so only the pages whose findings
+    aren't cached (e.g. the few pages changed since the last run) are read
+    and analysed (see PageCollector.lookup_stream).
+    """
+    if books is None:
+        books = {}
+    (pages, positions, writer, fingerprint) = shard_pages(
+        analyzers, pages, books, shard, partial)
+    collector = PageCollector(analyzers, books, cache, processes, writer,
+                              positions)
+    for page in (collector.lookup_stream(pages) if lookup_first
+                 else collector.page_stream(pages)):
+        collector.add_page(*page)
+    collector.close()
+    if writer is not None:
+        writer.close(fingerprint)
+        print('Wrote the findings of {} pages to {}.'.format(
+            len(positions), partial))
+        return analyzers
+    for analyzer in analyzers:
+        with metrics.stage('write_results.' + analyzer.name):
+            analyzer.write_results()
+    return analyzers
+
+
+def merge_findings(analyzers, paths, books):
+    """
+    Feed the findings stored in the partial result files paths (see
+    run_analyzers) to the analyzers in the order of the pages of the whole
+    run and write their results afterwards. The files have to contain the
+    findings of disjoint shards in the order of the pages, as written by
+    run_analyzers. books are the books of the run.
+    """
+    by_name = {analyzer.name: analyzer for analyzer in analyzers}
+    page_books = first_books(books)
+    for analyzer in analyzers:
+        analyzer.prepare(page_books)
+    records = heapq.merge(*(sharding.iter_records(path) for path in paths),
+                          key=lambda record: record['position'])
+    for record in metrics.timed_iter('load_findings', records):
+        analyzer = by_name[record['analyzer']]
+        if record.get('skipped'):
+            analyzer.skip(record['url'])
+            continue
+        with metrics.stage('collect.' + analyzer.name):
+            analyzer.collect(record['url'], record['findings'])
+        metrics.count('matches.' + analyzer.name,
+                      analyzer.count_matches(record['findings']))
+    for analyzer in analyzers:
+        with metrics.stage('write_results.' + analyzer.name):
+            analyzer.write_results()
+    return analyzers
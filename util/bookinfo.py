@@ -2,21 +2,278 @@
 Module for collection information about the articles which are in the book of
 the Mathe für Nicht-Freaks project.
 """
-import urllib.request
+import collections
+import email.utils
+import gzip
+import http.client
+import json
+import urllib.error
+import urllib.parse
 import sys
 import os
 import getopt
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from bs4 import BeautifulSoup
 
-from . import site_caching
+from . import metrics, parallel, sharding, site_caching
+from .cache_writer import CacheWriter
 
 EXCLUDED_HEADING_IDS = (
     'Buchanfänge',
     'Über_das_Projekt',
 )
 
+WIKI_URL = 'https://de.wikibooks.org'
+INDEX_URL = WIKI_URL + '/w/index.php'
+API_URL = WIKI_URL + '/w/api.php'
+SITEMAP_TITLE = 'Mathe_f%C3%BCr_Nicht-Freaks:_Sitemap'
+
+# Links to articles of the Mathe für Nicht-Freaks project. The first group is
+# the (url encoded) title of the article.
+ARTICLE_URL_REGEX = re.compile(
+    '^/wiki/((?:Mathe_f%C3%BCr_Nicht-Freaks|Serlo):.+)$')
+
+# getopt string of the options parsed by book_argument_parser
+BOOK_OPTIONS = 'c:rj:auz:'
+# Long getopt options parsed by book_argument_parser
+BOOK_LONG_OPTIONS = metrics.LONG_OPTIONS + sharding.LONG_OPTIONS + \
+    parallel.LONG_OPTIONS + ['timeout=', 'retries=', 'wiki=', 'rate=']
+
+# Maximal number of titles which can be queried in one API request.
+API_BATCH_SIZE = 50
+# Maximal number of fetched pages waiting to be processed
+PREFETCH_WINDOW = 100
+# Error stored for the requested pages which don't exist
+MISSING_PAGE = 'Page does not exist'
+
+# Maximal number of requests per second which are sent to a single host.
+DEFAULT_RATE_LIMIT = 10
+
+# Timeout of the network operations of a request in seconds
+DEFAULT_TIMEOUT = 60
+# Number of times a failed request is repeated
+DEFAULT_RETRIES = 5
+# Delay before the first repetition of a failed request in seconds. It is
+# doubled for every further repetition.
+DEFAULT_BACKOFF = 1
+# Maximal delay between two attempts of a request in seconds
+MAX_BACKOFF = 120
+# Maximal number of redirects followed for a single request
+MAX_REDIRECTS = 5
+# Status codes of responses to requests which are repeated
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Status codes of redirects
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+# Maximal replication lag of the database servers in seconds up to which
+# the MediaWiki API answers queries. When the lag is higher, the API asks to
+# repeat the query later.
+API_MAXLAG = 5
+USER_AGENT = ('MfNF-Diagnostic-Scripts/1.0 '
+              '(https://github.com/gruenerBogen/MfNF-Diagnostic-Scripts) '
+              'python-http.client')
+
+
+class RateLimiter:
+    """
+    Limit the number of requests per second sent to each host. A single
+    instance can be shared between multiple threads.
+    """
+
+    def __init__(self, requests_per_second=DEFAULT_RATE_LIMIT):
+        if requests_per_second:
+            self.interval = 1 / requests_per_second
+        else:
+            self.interval = 0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        """Block until the next request to the host of url may be sent."""
+        if not self.interval:
+            return
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def retry_after(response):
+    """
+    Return the delay in seconds requested by the Retry-After header of the
+    response or None if it has no valid one.
+    """
+    value = response.getheader('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(date.timestamp() - time.time(), 0)
+
+
+class HttpClient:
+    """
+    Client for HTTP requests which keeps one connection per host and thread
+    alive, so consecutive requests don't need new TCP and TLS handshakes.
+    Responses are requested gzip compressed.
+
+    Requests which fail with a network error, a timeout or a temporary error
+    of the server (including the maxlag error of the MediaWiki API) are
+    repeated up to retries times. The delay before the next attempt starts
+    with backoff seconds and doubles with every attempt, unless the server
+    requests a delay with Retry-After. A single instance can be shared
+    between multiple threads.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, user_agent=USER_AGENT):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.user_agent = user_agent
+        self.local = threading.local()
+
+    def connection(self, scheme, host):
+        """Return the connection of the current thread to host."""
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+        connection = self.local.connections.get((scheme, host))
+        if connection is None:
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(
+                    host, timeout=self.timeout)
+            elif scheme == 'http':
+                connection = http.client.HTTPConnection(
+                    host, timeout=self.timeout)
+            else:
+                raise ValueError('unsupported URL scheme "{}"'.format(scheme))
+            self.local.connections[(scheme, host)] = connection
+        return connection
+
+    def close(self):
+        """Close the connections of the current thread."""
+        for connection in getattr(self.local, 'connections', {}).values():
+            connection.close()
+        self.local.connections = {}
+
+    def send(self, url, body=None):
+        """
+        Send a single request for url. If body is given, it is sent as url
+        encoded form data in a POST request. Return the response together
+        with its raw body.
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = {
+            'User-Agent': self.user_agent,
+            'Accept-Encoding': 'gzip',
+        }
+        if body is None:
+            method = 'GET'
+        else:
+            method = 'POST'
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection = self.connection(parts.scheme, parts.netloc)
+        reused = connection.sock is not None
+        try:
+            with metrics.stage('http_request'):
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                content = response.read()
+        except Exception as error:
+            connection.close()
+            del self.local.connections[(parts.scheme, parts.netloc)]
+            if reused and isinstance(error, (http.client.RemoteDisconnected,
+                                             ConnectionResetError,
+                                             BrokenPipeError)):
+                # The server closed the idle connection, so try again with a
+                # new one.
+                return self.send(url, body)
+            raise
+        metrics.count('http_requests')
+        metrics.count('bytes_downloaded', len(content))
+        return (response, content)
+
+    def request(self, url, data=None):
+        """
+        Request url and return the response body as byte string. If data is
+        given, it is sent as url encoded form data in a POST request.
+        Redirects are followed. Raise urllib.error.HTTPError if the server
+        answers with an error and the last error if all attempts failed.
+        """
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data).encode('ascii')
+        attempt = 0
+        redirects = 0
+        while True:
+            try:
+                (response, content) = self.send(url, body)
+            except (OSError, http.client.HTTPException) as error:
+                if attempt >= self.retries:
+                    raise
+                reason = error
+                delay = None
+            else:
+                if response.status in REDIRECT_STATUS_CODES and \
+                   response.getheader('Location') and \
+                   redirects < MAX_REDIRECTS:
+                    redirects += 1
+                    url = urllib.parse.urljoin(url,
+                                               response.getheader('Location'))
+                    if response.status not in (307, 308):
+                        body = None
+                    continue
+                maxlag = response.getheader('MediaWiki-API-Error') == 'maxlag'
+                if (response.status not in RETRY_STATUS_CODES and
+                        not maxlag) or attempt >= self.retries:
+                    if response.status >= 300:
+                        raise urllib.error.HTTPError(
+                            url, response.status, response.reason,
+                            response.headers, None)
+                    if response.getheader('Content-Encoding') == 'gzip':
+                        content = gzip.decompress(content)
+                    return content
+                reason = 'maxlag' if maxlag else \
+                    'HTTP {} {}'.format(response.status, response.reason)
+                delay = retry_after(response)
+            if delay is None:
+                delay = self.backoff * 2 ** attempt
+            delay = min(delay, MAX_BACKOFF)
+            print('Retrying {} in {:.0f} s: {}'.format(url, delay, reason))
+            metrics.count('http_retries')
+            time.sleep(delay)
+            attempt += 1
+
+
+# Client used for all requests to the wiki
+HTTP_CLIENT = HttpClient()
+
+
+def set_wiki_url(url):
+    """
+    Send all requests to the wiki at url (e.g. a local test server) instead
+    of Wikibooks.
+    """
+    global WIKI_URL, INDEX_URL, API_URL  # pylint: disable=global-statement
+    WIKI_URL = url.rstrip('/')
+    INDEX_URL = WIKI_URL + '/w/index.php'
+    API_URL = WIKI_URL + '/w/api.php'
+
 
 def is_heading_excluded(heading):
     """Check whether a heading should be exluded from processing."""
@@ -52,18 +309,34 @@ def clean_urls(url_list):
     return url_list
 
 
+# Regex to filter nonexistent pages and edit links
+EXISTENCE_REGEX = re.compile('\\?(?:.+&)?action=edit(?:&|$)')
+# Regex to filter nonexistent pages
+REDLINK_REGEX = re.compile('\\?(?:.+&)?redlink=1(?:&|$)')
+# Regex to ignore Discussion and User pages
+LINK_IGNORE_REGEX = re.compile('\\?(.+&)?title=(?:Diskussion|Benutzer)')
+
+
+def classify_link(link):
+    """
+    Classify the href of a link. Return 'link' for a link to an existing
+    page, 'redlink' for a link to a nonexistent page and None for links which
+    should be ignored (e.g. edit links).
+    """
+    if EXISTENCE_REGEX.search(link):
+        if REDLINK_REGEX.search(link) and \
+           not LINK_IGNORE_REGEX.search(link):
+            return 'redlink'
+        return None
+    return 'link'
+
+
 def find_links(bs_obj, warn_redlinks=True):
     """
     Find all href-tags inside the given bs_obj.
     If warn_redlinks=True this prints a warning message for every redlink it
     encounters.
     """
-    # Regex to filter nonexistent pages and edit links
-    existence_regex = re.compile('\\?(?:.+&)?action=edit(?:&|$)')
-    # Regex to filter nonexistent pages
-    redlink_regex = re.compile('\\?(?:.+&)?redlink=1(?:&|$)')
-    # Regex to ignore Discussion and User pages
-    link_ignore_regex = re.compile('\\?(.+&)?title=(?:Diskussion|Benutzer)')
     link_objects = bs_obj.find_all('a')
     links = []
     redlinks = []
@@ -72,94 +345,630 @@ def find_links(bs_obj, warn_redlinks=True):
         # Ignore a-tags without a href attribute
         if not link:
             continue
-        if existence_regex.search(link):
-            if redlink_regex.search(link) and warn_redlinks and \
-               not link_ignore_regex.search(link):
-                print('Found link pointing to nonexistent page: {}'.format(link))
-                redlinks.append(link)
-            continue
-        links.append(link)
+        kind = classify_link(link)
+        if kind == 'redlink' and warn_redlinks:
+            print('Found link pointing to nonexistent page: {}'.format(link))
+            redlinks.append(link)
+        elif kind == 'link':
+            links.append(link)
     return links, redlinks
 
 
+def parse_article_list(sitemap_html):
+    """
+    Extract the books and the links to their articles from the HTML of the
+    sitemap. Return a dictionary containing the list of article urls of
+    every book indexed by the book names.
+    """
+    sitemap = BeautifulSoup(sitemap_html, "html.parser")
+    # Get all headings, the first result is dropped as it is the table of
+    # contents.
+    # The last result is a mysterious "Navigationsmenü".
+    headings = sitemap.find_all('h2')[1:-1]
+    books = {}
+    for i in range(len(headings)):
+        if is_heading_excluded(headings[i]):
+            continue
+        # fetch content of heading
+        books[get_heading_id(headings[i])] = clean_urls(find_links(
+            BeautifulSoup(get_content_till_tag(headings[i], headings[i+1]),
+                          'html.parser'),
+            False)[0])
+    return books
+
+
+@metrics.timed('fetch_article_list')
 def fetch_article_list():
     """Download the sitemap and extract all links from it"""
     # Retrieve sitemap
-    with urllib.request.urlopen(
-            'https://de.wikibooks.org/w/index.php?title=Mathe_f%C3%BCr_Nicht-Freaks:_Sitemap') \
-            as response:
-        sitemap = BeautifulSoup(response.read(), "html.parser")
-        # Get all headings, the first result is dropped as it is the table of
-        # contents.
-        # The last result is a mysterious "Navigationsmenü".
-        headings = sitemap.find_all('h2')[1:-1]
-        books = {}
-        for i in range(len(headings)):
-            if is_heading_excluded(headings[i]):
-                continue
-            # fetch content of heading
-            books[get_heading_id(headings[i])] = clean_urls(find_links(
-                BeautifulSoup(get_content_till_tag(headings[i], headings[i+1]),
-                              'html.parser'),
-                False)[0])
-        return books
+    return parse_article_list(fetch_page(
+        '{}?title={}'.format(INDEX_URL, SITEMAP_TITLE)))
+
+
+def fetch_page(url, rate_limiter=None, data=None):
+    """
+    Download url with HTTP_CLIENT and return the response body as byte
+    string. If rate_limiter is given, its rate limit is respected. If data
+    is given, it is sent as url encoded form data in a POST request.
+    """
+    if rate_limiter is not None:
+        rate_limiter.wait(url)
+    return HTTP_CLIENT.request(url, data)
+
+
+def url_to_title(url):
+    """
+    Convert a link to an article (e.g. /wiki/Serlo:Mitmachen) into the title
+    of the article (e.g. Serlo:Mitmachen). Return None for external links.
+    """
+    match = ARTICLE_URL_REGEX.match(url)
+    if match is None:
+        return None
+    return urllib.parse.unquote(match.group(1)).replace('_', ' ')
+
+
+def api_query(params, rate_limiter=None):
+    """
+    Send a query to the MediaWiki API and follow its continuation. This is a
+    generator yielding the decoded JSON response of every request.
+    """
+    params = {
+        'action': 'query',
+        'format': 'json',
+        'formatversion': '2',
+        'maxlag': str(API_MAXLAG),
+        **params
+    }
+    while True:
+        response = json.loads(fetch_page(API_URL, rate_limiter,
+                                         data=params))
+        if 'error' in response:
+            raise RuntimeError('API error {}: {}'.format(
+                response['error'].get('code'), response['error'].get('info')))
+        yield response
+        if 'continue' not in response:
+            return
+        params = {**params, **response['continue']}
+
+
+def resolve_api_titles(query, titles):
+    """
+    Map the titles of the pages in an API query response to the titles which
+    were requested. This undoes the normalisation and redirects done by the
+    API. titles is the dictionary of requested titles, which is updated.
+    """
+    for key in ('normalized', 'redirects'):
+        for entry in query.get(key, []):
+            if entry['from'] in titles:
+                titles[entry['to']] = titles[entry['from']]
+
+
+def iter_pages_via_api(page_urls,
+                       page_postprocessor=lambda string: string,
+                       revisions=None, errors=None,
+                       rate_limit=DEFAULT_RATE_LIMIT,
+                       batch_size=API_BATCH_SIZE):
+    """
+    Generator fetching the WikiText of every url in page_urls which
+    corresponds to an article on the Mathe für Nicht-Freaks project in
+    batches through the MediaWiki API. The contents are processed with
+    page_postprocessor and yielded as (url, content) pairs as soon as their
+    batch has arrived.
+
+    If revisions is given, it is filled with a dictionary for every fetched
+    url containing the 'revid' and 'timestamp' of the fetched revision before
+    the url is yielded. Pages which couldn't be fetched are left out. The
+    reasons are stored in errors (if given) indexed by the urls.
+    """
+    if errors is None:
+        errors = {}
+    if revisions is None:
+        revisions = {}
+    rate_limiter = RateLimiter(rate_limit)
+    titles = {}
+    for url in page_urls:
+        title = url_to_title(url)
+        if title is not None:
+            titles[title] = url
+    title_list = list(titles)
+    for i in range(0, len(title_list), batch_size):
+        batch = title_list[i:i+batch_size]
+        contents = {}
+        print("Fetching {} pages via the API, starting with: {}".format(
+            len(batch), batch[0]))
+        try:
+            for response in api_query({
+                    'prop': 'revisions',
+                    'rvprop': 'content|ids|timestamp',
+                    'rvslots': 'main',
+                    'redirects': '1',
+                    'titles': '|'.join(batch)}, rate_limiter):
+                query = response.get('query', {})
+                resolve_api_titles(query, titles)
+                for page in query.get('pages', []):
+                    url = titles.get(page['title'])
+                    if url is None:
+                        continue
+                    if page.get('missing') or page.get('invalid'):
+                        errors[url] = MISSING_PAGE
+                    # Revisions of long pages may be returned only after a
+                    # continuation.
+                    if not page.get('revisions'):
+                        continue
+                    revision = page['revisions'][0]
+                    contents[url] = revision['slots']['main']['content']
+                    revisions[url] = {
+                        'revid': revision['revid'],
+                        'timestamp': revision['timestamp']
+                    }
+        except Exception as error:  # pylint: disable=broad-except
+            print('Couldn\'t fetch batch starting with "{}": {}'.format(
+                batch[0], error))
+            for title in batch:
+                errors[titles[title]] = error
+        for url in dict.fromkeys(titles[title] for title in batch):
+            if url in contents:
+                metrics.count('pages_fetched')
+                yield (url, page_postprocessor(contents[url]))
+            elif url not in errors:
+                errors[url] = 'Page missing in API response'
+
+
+def fetch_pages_via_api(page_urls,
+                        page_postprocessor=lambda string: string,
+                        revisions=None, errors=None,
+                        rate_limit=DEFAULT_RATE_LIMIT,
+                        batch_size=API_BATCH_SIZE):
+    """
+    Fetch the WikiText of every url in page_urls through the MediaWiki API
+    (see iter_pages_via_api). Return a dictionary of the processed contents
+    indexed by the urls.
+    """
+    return dict(iter_pages_via_api(page_urls, page_postprocessor, revisions,
+                                   errors, rate_limit, batch_size))
+
+
+def iter_pages_from_list(page_urls, action='view',
+                         page_postprocessor=lambda byte_string: byte_string,
+                         jobs=1, rate_limit=DEFAULT_RATE_LIMIT, errors=None,
+                         window=None):
+    """
+    Generator fetching every url in page_urls which corresponds to an article
+    on the Mathe für Nicht-Freaks project. The responses are processed with
+    page_postprocessor and yielded as (url, content) pairs in the order of
+    page_urls.
+
+    jobs is the number of pages which are downloaded concurrently and
+    rate_limit the maximal number of requests per second (None for no limit).
+    Downloads continue while the consumer processes the yielded pages, but at
+    most window pages (4 * jobs by default) are fetched ahead.
+    Pages which couldn't be fetched are left out. The occurred exceptions are
+    stored in errors (if given) indexed by the urls.
+    """
+    if errors is None:
+        errors = {}
+    if window is None:
+        window = 4 * max(jobs, 1)
+    url_scheme = INDEX_URL + '?title={}&action={}'
+    rate_limiter = RateLimiter(rate_limit)
+
+    def fetch(url, title):
+        print("Fetching: {}".format(url))
+        try:
+            page = page_postprocessor(fetch_page(
+                url_scheme.format(title, action), rate_limiter))
+            metrics.count('pages_fetched')
+            return page
+        except Exception as error:  # pylint: disable=broad-except
+            print('Couldn\'t fetch "{}": {}'.format(url, error))
+            errors[url] = error
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        pending = collections.deque()
+        for url in page_urls:
+            # Ignore external links:
+            match = ARTICLE_URL_REGEX.match(url)
+            if match is not None:
+                pending.append((url, executor.submit(fetch, url,
+                                                     match.group(1))))
+            while len(pending) > window or \
+                    (pending and pending[0][1].done()):
+                (url, future) = pending.popleft()
+                page = future.result()
+                if url not in errors:
+                    yield (url, page)
+        while pending:
+            (url, future) = pending.popleft()
+            page = future.result()
+            if url not in errors:
+                yield (url, page)
 
 
 def fetch_pages_from_list(page_urls, action='view',
-                          page_postprocessor=lambda byte_string: byte_string):
+                          page_postprocessor=lambda byte_string: byte_string,
+                          jobs=1, rate_limit=DEFAULT_RATE_LIMIT, errors=None):
     """
     Fetch every url in page_urls which corresponds to an article on the Mathe
-    für Nicht-Freaks project, process the response with page_postprocessor and
-    store the results in a dictionary, which is indexed by the urls.
-    Return the filled dictionary.
-    """
-    page_content = {}
-    existing_article_regex = re.compile(
-        '^/wiki/((?:Mathe_f%C3%BCr_Nicht-Freaks|Serlo):.+)$')
-    url_scheme = 'https://de.wikibooks.org/w/index.php?title={}&action={}'
+    für Nicht-Freaks project (see iter_pages_from_list). Return a dictionary
+    of the processed responses indexed by the urls.
+    """
+    return dict(iter_pages_from_list(page_urls, action, page_postprocessor,
+                                     jobs, rate_limit, errors))
+
+
+def fetch_latest_revisions(page_urls, rate_limit=DEFAULT_RATE_LIMIT,
+                           batch_size=API_BATCH_SIZE):
+    """
+    Ask the MediaWiki API for the latest revision of every article in
+    page_urls. Return a dictionary containing the 'revid' and 'timestamp' of
+    the latest revision and the time the page was 'touched' (last rendered
+    again, e.g. because a template it uses was edited) indexed by the urls.
+    Nonexistent pages are left out.
+    """
+    rate_limiter = RateLimiter(rate_limit)
+    titles = {}
     for url in page_urls:
-        # Ignore external links:
-        match = existing_article_regex.match(url)
-        if match is None:
-            continue
-        print("Fetching: {}".format(url))
-        with urllib.request.urlopen(
-                url_scheme.format(match.group(1), action)) as response:
-            page = page_postprocessor(response.read())
-            page_content[url] = page
-    return page_content
+        title = url_to_title(url)
+        if title is not None:
+            titles[title] = url
+    revisions = {}
+    title_list = list(titles)
+    for i in range(0, len(title_list), batch_size):
+        for response in api_query({
+                'prop': 'info|revisions',
+                'rvprop': 'ids|timestamp',
+                'redirects': '1',
+                'titles': '|'.join(title_list[i:i+batch_size])},
+                                  rate_limiter):
+            query = response.get('query', {})
+            resolve_api_titles(query, titles)
+            for page in query.get('pages', []):
+                if page['title'] in titles and page.get('revisions'):
+                    revision = page['revisions'][0]
+                    revisions[titles[page['title']]] = {
+                        'revid': revision['revid'],
+                        'timestamp': revision['timestamp'],
+                        'touched': page.get('touched')
+                    }
+    return revisions
 
 
-def book_argument_parser(extra_opts=''):
+def fetch_recent_changes(since, rate_limiter=None):
+    """
+    Ask the MediaWiki API for the recent changes of the articles (edits, new
+    pages and log entries like moves or deletions in the main namespace) from
+    the timestamp since (inclusive) on. Return them as list of dictionaries
+    containing the 'type', 'rcid', 'title', 'revid' and 'timestamp' of every
+    change, newest first. Log entries contain their 'logtype', 'logaction'
+    and 'logparams' as well, e.g. the 'target_title' of a move.
+    """
+    changes = []
+    for response in api_query({
+            'list': 'recentchanges',
+            'rcprop': 'title|ids|timestamp|loginfo',
+            'rctype': 'edit|new|log',
+            'rcnamespace': '0',
+            'rclimit': 'max',
+            'rcend': since}, rate_limiter):
+        changes.extend(response.get('query', {}).get('recentchanges', []))
+    return changes
+
+
+def iter_book_pages(books, action='raw',
+                    page_postprocessor=lambda string: string, jobs=1,
+                    errors=None, use_api=False, revisions=None,
+                    window=PREFETCH_WINDOW, rate_limit=DEFAULT_RATE_LIMIT):
+    """
+    Generator fetching all pages of the given books and yielding them as
+    (url, content) pairs. Pages which belong to multiple books are only
+    downloaded once. The responses are decoded as UTF-8 and then processed
+    by page_postprocessor.
+    If use_api is True and action is 'raw', the pages are fetched in batches
+    through the MediaWiki API and revisions is filled with their revision
+    metadata (see iter_pages_via_api).
+    The pages are fetched in the background while the consumer processes
+    the yielded ones. At most window fetched pages wait for the consumer.
+    At most rate_limit requests per second are sent (None for no limit).
+    """
+    page_urls = list(dict.fromkeys(
+        url for book in books for url in books[book]))
+    if use_api and action == 'raw':
+        pages = iter_pages_via_api(page_urls,
+                                   page_postprocessor=page_postprocessor,
+                                   revisions=revisions, errors=errors,
+                                   rate_limit=rate_limit)
+    else:
+        pages = iter_pages_from_list(
+            page_urls, action=action, jobs=jobs, errors=errors,
+            rate_limit=rate_limit,
+            page_postprocessor=lambda byte_string:
+            page_postprocessor(byte_string.decode('utf-8')))
+    return parallel.prefetch(pages, window)
+
+
+def fetch_book_pages(books, action='raw',
+                     page_postprocessor=lambda string: string, jobs=1,
+                     errors=None, use_api=False, revisions=None,
+                     rate_limit=DEFAULT_RATE_LIMIT):
+    """
+    Fetch all pages of the given books (see iter_book_pages). Return a
+    dictionary of the pages indexed by their urls.
+    """
+    return dict(iter_book_pages(books, action, page_postprocessor, jobs,
+                                errors, use_api, revisions,
+                                rate_limit=rate_limit))
+
+
+def select_book_pages(books, urls):
+    """Return the books containing only their pages in the set urls."""
+    return {book: [url for url in books[book] if url in urls]
+            for book in books}
+
+
+def stream_book_pages(books, action='raw',
+                      page_postprocessor=lambda string: string, jobs=1,
+                      errors=None, use_api=False, cache=None,
+                      storage_format='text', book=None,
+                      rate_limit=DEFAULT_RATE_LIMIT, urls=None):
+    """
+    Generator fetching all pages of the given books and yielding them as
+    (url, content) pairs while they arrive (see iter_book_pages). If cache
+    is given, the cached books and pages in the representation action are
+    replaced by the fetched ones, which are written in batches in the
+    background. If book is given, only the pages of this book are yielded,
+    but all pages are cached. If urls is given, only the pages in this set
+    are fetched and cached. The fetch errors are printed at the end.
+    """
+    if errors is None:
+        errors = {}
+    revisions = {}
+    writer = None
+    if cache is not None:
+        writer = CacheWriter(books, cache=cache,
+                             storage_format=storage_format, action=action)
+    book_urls = set(books.get(book, [])) if book is not None else None
+    for (url, page) in metrics.timed_iter('fetch_pages', iter_book_pages(
+            books if urls is None else select_book_pages(books, urls),
+            action=action, page_postprocessor=page_postprocessor,
+            jobs=jobs, errors=errors, use_api=use_api, revisions=revisions,
+            rate_limit=rate_limit)):
+        if writer is not None:
+            writer.put(url, page, revisions.get(url))
+        if book_urls is None or url in book_urls:
+            yield (url, page)
+    if writer is not None:
+        writer.close()
+    print_errors(errors)
+
+
+def print_errors(errors):
+    """Print the pages which couldn't be fetched."""
+    if errors:
+        print('{} pages couldn\'t be fetched:'.format(len(errors)))
+        for url in errors:
+            print('{}: {}'.format(url, errors[url]))
+
+
+def failed_fetches(errors):
+    """
+    Return the urls in errors (see print_errors) whose pages couldn't be
+    fetched for another reason than that they don't exist, e.g. because of
+    a network error.
+    """
+    return [url for (url, error) in errors.items()
+            if error != MISSING_PAGE and
+            not (isinstance(error, urllib.error.HTTPError) and
+                 error.code == 404)]
+
+
+@metrics.timed('update_cache')
+def update_cache(books, cache, action='raw', jobs=1, errors=None,
+                 use_api=False, storage_format='text',
+                 rate_limit=DEFAULT_RATE_LIMIT):
+    """
+    Bring the cached pages of books up to date. Only pages whose latest
+    revision differs from the cached one are downloaded. Rendered pages
+    (action 'view') are also downloaded when they were rendered again since
+    they were cached, since their HTML changes without a new revision when
+    a template they use is edited. Pages which don't
+    belong to any of the books anymore are removed from the cache. Downloaded
+    pages are stored in storage_format. At most rate_limit requests per
+    second are sent.
+    """
+    page_urls = list(dict.fromkeys(
+        url for book in books for url in books[book]))
+    latest = fetch_latest_revisions(page_urls, rate_limit=rate_limit)
+    if action == 'view':
+        # The time the HTML was rendered is cached as timestamp.
+        for revision in latest.values():
+            revision['timestamp'] = revision['touched']
+    cached = site_caching.read_cached_revisions(cache, action=action)
+    changed = [url for url in page_urls if url in latest and
+               cached.get(url) != (latest[url]['revid'],
+                                   latest[url]['timestamp'])]
+    print('{} of {} pages changed since the last update.'.format(
+        len(changed), len(page_urls)))
+    revisions = dict(latest)
+    pages = fetch_book_pages({'changed': changed}, action=action, jobs=jobs,
+                             errors=errors, use_api=use_api,
+                             revisions=revisions, rate_limit=rate_limit)
+    deleted = site_caching.update_page_data(books, pages, cache=cache,
+                                            revisions=revisions,
+                                            storage_format=storage_format,
+                                            action=action)
+    print('Removed {} pages from the cache.'.format(deleted))
+
+
+def parse_rate_limit(opts):
+    """
+    Return the maximal number of requests per second given by the option
+    --rate in the dictionary opts (None for no limit if it is 0).
+    """
+    rate_limit = float(opts.get('--rate', DEFAULT_RATE_LIMIT))
+    if rate_limit < 0:
+        raise getopt.GetoptError(
+            'negative rate limit {}'.format(opts['--rate']), '--rate')
+    return rate_limit or None
+
+
+def select_cached_shard(opts, books, cache, action='raw', book=None):
+    """
+    Select the pages of the shard given by opts (see select_shard) among
+    the pages cached in the representation action (of book if given) in
+    the order of their urls. The fingerprint contains the cached hashes of
+    the pages.
+    """
+    hashes = site_caching.read_page_hashes(cache, action)
+    book_urls = set(books.get(book, []))
+    page_urls = sorted(url for url in hashes
+                       if book is None or url in book_urls)
+    return select_shard(opts, books, page_urls,
+                        lambda: [(url, hashes[url]) for url in page_urls])
+
+
+def select_fetched_shard(opts, books, book=None,
+                         rate_limit=DEFAULT_RATE_LIMIT):
+    """
+    Select the pages of the shard given by opts (see select_shard) among
+    the pages of books (of book if given) in the order in which they are
+    fetched. The fingerprint contains the ids of the latest revisions of
+    the pages.
+    """
+    book_urls = set(books.get(book, []))
+    page_urls = [url for url in dict.fromkeys(
+        url for name in books for url in books[name])
+                 if book is None or url in book_urls]
+
+    def versions():
+        latest = fetch_latest_revisions(page_urls, rate_limit=rate_limit)
+        return [(url, latest.get(url, {}).get('revid')) for url in page_urls]
+
+    return select_shard(opts, books, page_urls, versions)
+
+
+def shard_urls(selection):
+    """
+    Return the set of the urls of the pages selected by selection (see
+    select_shard) or None if selection is None.
+    """
+    return None if selection is None else set(selection.positions)
+
+
+def select_shard(opts, books, page_urls, versions):
+    """
+    Select the pages of the shard given by the option --shard in the
+    dictionary opts (see util.sharding) among page_urls, the urls of the
+    pages of the whole run in their order. Return a sharding.ShardPages
+    without pages containing the positions of the selected pages (see
+    sharding.select_urls) and the fingerprint of the run if a partial result
+    file is written (None otherwise). versions is a function returning the
+    (url, version) pairs of the fingerprint (see sharding.new_fingerprint),
+    which is only called in this case.
+    """
+    positions = sharding.select_urls(page_urls, sharding.parse_shard(opts),
+                                     books)
+    fingerprint = None
+    if '--partial' in opts:
+        fingerprint = sharding.new_fingerprint(books, versions())
+    return sharding.ShardPages(None, positions, fingerprint)
+
+
+def book_argument_parser(extra_opts='', action='raw', page_postprocessor=None,
+                         stream=False, book=None, sharded=True):
     """
     Parse the content for retrieving the books' contents. Currently the
     following options will be parsed:
 
     -c [cache file] cache file
     -r rebuild chache
+    -j [jobs] number of concurrent downloads
+    -a fetch WikiText in batches through the MediaWiki API
+    -u update the cache by downloading only changed pages
+    -z [format] storage format of cached pages (text, zlib or lzma)
+    --profile print the times of the stages and the counters at exit
+    --metrics [file] write the times and counters as JSON at exit
+    --cprofile [file] dump cProfile statistics of the run at exit
+    --timeout [seconds] timeout of the network operations of a request
+    --retries [number] number of times a failed request is repeated
+    --wiki [url] send the requests to the wiki at url instead of Wikibooks
+    --rate [number] maximal number of requests per second sent to a host
+    --processes [number] number of processes analysing the pages
+    --shard [number/count] only process the pages of a shard
+    --shard-by [url|book] distribute the pages by url hash or by book
+    --partial [file] write partial results to be merged by merge.py
 
     extra options can be provided via extra_opts as getiots string
+    action is the representation of the pages which is downloaded ('raw' for
+    WikiText, 'view' for HTML). page_postprocessor (if given) is applied to
+    every page string.
+
+    If stream is True, pages is an iterable of (url, content) pairs instead
+    of a dictionary. When reading from cache, the pages are then read one at
+    a time by a site_caching.CachedPages. Otherwise they are yielded while
+    they are downloaded and cached in the background, so only a bounded
+    number of pages is held in memory.
+    If book is given, pages only contains the pages of this book.
+
+    If the run is split into shards (see util.sharding) and stream is True,
+    only the pages of the shard are read or fetched and pages is a
+    sharding.ShardPages containing their positions in the whole run and the
+    fingerprint of the run. The fingerprint is computed from the cached
+    hashes of the pages or the ids of their latest revisions. If sharded
+    is False, all pages are read or fetched in any case.
 
     return (books, pages, return of getopt.getopt)
     """
-    (opts_list, arg_list) = getopt.getopt(sys.argv[1:], extra_opts + 'c:r')
-    opts = dict(opts_list)
+    parsed = getopt.getopt(sys.argv[1:], extra_opts + BOOK_OPTIONS,
+                           BOOK_LONG_OPTIONS)
+    opts = dict(parsed[0])
+    metrics.enable_reports(opts)
+    HTTP_CLIENT.timeout = float(opts.get('--timeout', DEFAULT_TIMEOUT))
+    HTTP_CLIENT.retries = int(opts.get('--retries', DEFAULT_RETRIES))
+    if '--wiki' in opts:
+        set_wiki_url(opts['--wiki'])
 
-    if '-c' in opts and os.path.isfile(opts['-c']) and '-r' not in opts:
-        (books, pages) = site_caching.read_cached_data(cache=opts['-c'])
+    jobs = int(opts.get('-j', 1))
+    rate_limit = parse_rate_limit(opts)
+    storage_format = opts.get('-z', 'text')
+    if storage_format not in site_caching.STORAGE_FORMATS:
+        raise getopt.GetoptError(
+            'unknown storage format {}'.format(storage_format), '-z')
+    errors = {}
+    selection = None
+    sharded = sharded and stream and ('--shard' in opts or
+                                      '--partial' in opts)
+    if '-c' in opts and os.path.isfile(opts['-c']) and '-r' not in opts \
+       and site_caching.has_pages(opts['-c'], action=action):
+        if '-u' in opts:
+            update_cache(fetch_article_list(), opts['-c'], action=action,
+                         jobs=jobs, errors=errors, use_api='-a' in opts,
+                         storage_format=storage_format,
+                         rate_limit=rate_limit)
+        books = site_caching.read_books(cache=opts['-c'])
+        if sharded:
+            selection = select_cached_shard(opts, books, opts['-c'], action,
+                                            book)
+        pages = site_caching.CachedPages(
+            opts['-c'], book=book, page_postprocessor=page_postprocessor,
+            action=action, urls=shard_urls(selection))
+        print_errors(errors)
     else:
         books = fetch_article_list()
-        pages = {}
-        for book in books:
-            page_content = fetch_pages_from_list(
-                books[book], action='raw',
-                page_postprocessor=lambda byte_string:
-                byte_string.decode('utf-8'))
-            pages = {
-                **pages,
-                **page_content
-            }
-        if '-c' in opts:
-            site_caching.cache_page_data(books, pages, cache=opts['-c'])
-
-    return (books, pages, (opts_list, arg_list))
+        if sharded:
+            selection = select_fetched_shard(opts, books, book, rate_limit)
+        pages = stream_book_pages(books, action=action,
+                                  page_postprocessor=page_postprocessor or
+                                  (lambda string: string),
+                                  jobs=jobs, errors=errors,
+                                  use_api='-a' in opts, cache=opts.get('-c'),
+                                  storage_format=storage_format, book=book,
+                                  rate_limit=rate_limit,
+                                  urls=shard_urls(selection))
+    if not stream:
+        pages = dict(pages)
+    elif selection is not None:
+        selection.pages = pages
+        pages = selection
+
+    return (books, pages, parsed)
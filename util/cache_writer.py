@@ -0,0 +1,96 @@
+"""
+Module for storing pages in the cache database while they are fetched.
+
+A CacheWriter persists the pages handed to it in batches on a background
+thread, so the pages can be analysed while earlier ones are written and later
+ones are still downloaded.
+"""
+
+import queue
+import threading
+
+from . import metrics, site_caching
+
+# Number of pages written in a single transaction
+BATCH_SIZE = 50
+# Maximal number of pages waiting to be written
+QUEUE_SIZE = 200
+
+
+class CacheWriter:
+    """
+    Writer replacing the cached books and the pages in the representation
+    action by the given books and the pages handed to put. The pages are
+    written in batches of batch_size pages in storage_format. Pages of this
+    representation which weren't handed to put are deleted by close.
+    """
+
+    def __init__(self, books, cache='cache.db', storage_format='text',
+                 action='raw', batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+        self.cache = cache
+        self.storage_format = storage_format
+        self.action = action
+        self.batch_size = batch_size
+        self.page_urls = set()
+        self.error = None
+        # The database is set up before any other connection uses it.
+        db_connection = site_caching.open_cache_db(cache)
+        site_caching.insert_books(db_connection, books)
+        db_connection.close()
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, url, content, revision=None):
+        """
+        Hand the page url with the given content and revision metadata (see
+        bookinfo.fetch_pages_via_api) to the writer.
+        """
+        self.page_urls.add(url)
+        self.queue.put((url, content, revision))
+
+    def run(self):
+        """Write the pages waiting in the queue until close is called."""
+        db_connection = site_caching.open_cache_db(self.cache)
+        entry = ()
+        try:
+            pages = {}
+            revisions = {}
+            while True:
+                entry = self.queue.get()
+                if entry is not None:
+                    (url, content, revision) = entry
+                    pages[url] = content
+                    if revision is not None:
+                        revisions[url] = revision
+                if len(pages) >= self.batch_size or \
+                   (entry is None and pages):
+                    with metrics.stage('cache_write'):
+                        site_caching.insert_pages(
+                            db_connection, pages, revisions,
+                            self.storage_format, self.action)
+                    metrics.count('pages_cached', len(pages))
+                    pages = {}
+                    revisions = {}
+                if entry is None:
+                    break
+            site_caching.remove_other_pages(db_connection, self.page_urls,
+                                            self.action)
+        except Exception as error:  # pylint: disable=broad-except
+            self.error = error
+            # Keep consuming, so put doesn't block forever.
+            while entry is not None:
+                entry = self.queue.get()
+        finally:
+            db_connection.close()
+
+    def close(self):
+        """
+        Wait until all pages are written and remove the pages which weren't
+        handed to the writer. Raise the error which stopped the writer, if
+        any.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
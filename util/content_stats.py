@@ -1,45 +1,149 @@
+"""
+Module for collecting the contents of WikiText constructs (e.g. galleries,
+tables or references) in the pages of the Mathe für Nicht-Freaks project.
+
+The contents are either the WikiText spans of a kind found by the tokenizer
+of util.wikitext or the matches of a regular expression. ContentAnalyzer
+collects them while the pages are analysed and writes them together with the
+number of contents of every page.
+"""
+
 import re
-import os
+
+from . import record_writer, wikitext
+from .analysis import Analyzer, make_output_dir, run_analyzers
 
 
-def extract_content(string, regex_string):
+def extract_content(string, regex_string=None, span_kind=None):
     """
-    Find all <section> environments and return their content as string array.
+    Return the contents of the WikiText spans of kind span_kind (see
+    util.wikitext) in string or, if span_kind is None, the contents matched by
+    the first group of regex_string as list of strings in the order of their
+    positions.
     """
-    gallery_regex = re.compile(regex_string, re.DOTALL)
-    return [match.group(1) for match in gallery_regex.finditer(string)]
+    analyzer = ContentAnalyzer(regex_string=regex_string)
+    analyzer.span_kind = span_kind
+    return [content for (_, content) in analyzer.extract(string)]
 
 
-def find_content(pages, regex_string):
+def find_content(pages, regex_string=None, span_kind=None):
+    """
+    Return a dictionary mapping the urls of the pages, which is a dictionary
+    of page contents indexed by their urls, to the lists of their contents
+    (see extract_content). Pages without contents are left out.
+    """
     content_dict = {}
     for page in pages:
-        content = extract_content(pages[page], regex_string)
+        content = extract_content(pages[page], regex_string, span_kind)
         if len(content) > 0:
             content_dict[page] = content
     return content_dict
 
 
 def map_content(fn, content_dict):
+    """
+    Return a copy of content_dict (see find_content) with fn applied to
+    every content.
+    """
     new_dict = {}
     for page in content_dict:
         new_dict[page] = [fn(content) for content in content_dict[page]]
     return new_dict
 
 
-def basic_analysis(base_name, pages, regex_string):
-    content_dict = find_content(pages, regex_string)
-    content_pages = [(page, len(content_dict[page])) for page in content_dict]
-    content_counter = sum([t for (_, t) in content_pages])
+class ContentAnalyzer(Analyzer):
+    """
+    Analyzer collecting the contents matched by the first group of
+    regex_string or the contents of the WikiText spans of kind span_kind (see
+    util.wikitext). The contents are written as records of the kind base_name
+    to out/<base_name>_content.<extension> in output_format while the pages
+    are processed. The number of contents of every page is written to
+    out/<base_name>_stats.txt. If keep_results is True, the contents are
+    also stored in self.results indexed by the urls.
+    """
 
-    print("Found {} content uses.".format(content_counter))
+    base_name = None
+    regex_string = None
+    span_kind = None
+    keep_results = False
 
-    os.makedirs("out", exist_ok=True)
-    with open("out/{}_stats.txt".format(base_name), 'w+') as file:
-        file.write('\n'.join(map(lambda t: "{}\t{}".format(t[0], t[1]),
-                                 content_pages)))
+    def __init__(self, base_name=None, regex_string=None, output_format=None):
+        super().__init__()
+        if base_name is not None:
+            self.base_name = base_name
+        if regex_string is not None:
+            self.regex_string = regex_string
+        if output_format is not None:
+            self.output_format = output_format
+        self.content_counter = 0
+        self.writer = None
+        self.stats_file = None
 
-    with open("out/{}_content.txt".format(base_name), "w+") as file:
-        file.write('\n--------------------------------------------\n'.join(
-            map(lambda t: '{}\n\n{}'.format(t[0], '\n----\n'.join(t[1])),
-                content_dict.items())))
-    return content_dict
+    def extract(self, content):
+        """Return the offsets and contents of the findings as pairs."""
+        if self.span_kind is not None:
+            return [[span.start, self.span_content(content, span)] for span in
+                    wikitext.spans_of_kind(content, self.span_kind)]
+        regex = re.compile(self.regex_string, re.DOTALL)
+        return [[match.start(), match.group(1)]
+                for match in regex.finditer(content)]
+
+    def span_content(self, content, span):
+        """Return the collected content of a span of the page content."""
+        return span.inner(content)
+
+    def open_files(self):
+        """Open the output files unless they are open already."""
+        if self.writer is not None:
+            return
+        self.writer = record_writer.open_writer(
+            'out/{}_content'.format(self.base_name), self.output_format,
+            separator='\n----\n',
+            page_separator='\n--------------------------------------------\n')
+        stats_filename = 'out/{}_stats.txt'.format(self.base_name)
+        make_output_dir(stats_filename)
+        # Closed by write_results
+        self.stats_file = open(  # pylint: disable=consider-using-with
+            stats_filename, 'w+')
+
+    def collect(self, url, findings):
+        if not findings:
+            return
+        self.open_files()
+        for (offset, content) in findings:
+            self.writer.write(url, self.page_books.get(url), self.base_name,
+                              offset, content)
+        if self.content_counter:
+            self.stats_file.write('\n')
+        self.stats_file.write('{}\t{}'.format(url, len(findings)))
+        self.content_counter += len(findings)
+        if self.keep_results:
+            self.results[url] = [content for (_, content) in findings]
+
+    def describe_findings(self, findings):
+        return [content for (_, content) in findings]
+
+    def write_results(self):
+        print("Found {} content uses.".format(self.content_counter))
+
+        self.open_files()
+        self.writer.close()
+        self.stats_file.close()
+        self.writer = None
+        self.stats_file = None
+
+
+def basic_analysis(base_name, pages, regex_string=None, span_kind=None):
+    """
+    Collect the contents (see extract_content) of pages, which is a
+    dictionary of page contents indexed by their urls, and write them to the
+    output files of base_name (see ContentAnalyzer). Return a dictionary
+    mapping the urls of the pages with contents to the lists of their
+    contents.
+    """
+    analyzer = ContentAnalyzer(base_name, regex_string)
+    analyzer.name = base_name
+    analyzer.span_kind = span_kind
+    analyzer.keep_results = True
+    run_analyzers([analyzer], pages.items())
+    return analyzer.results
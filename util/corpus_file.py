@@ -0,0 +1,243 @@
+"""
+Module for exporting pages into a read-only corpus file, which processes can
+map into memory to read the pages without copying or unpickling them.
+
+A corpus file consists of a header, the UTF-8 encoded contents of all pages
+one after another, the UTF-8 encoded urls one after another and an index.
+The header contains the magic bytes, the number of pages and the positions
+of the urls and of the index. The index contains four 64 bit integers for
+every page: the position and length of its content and the position and
+length of its url. Thus opening a corpus file only reads the header, no
+matter how many pages it contains, and every page is a slice of the mapped
+file. Since the contents come first, they can already be read by their
+positions while the file is written (see ContentMap).
+"""
+
+import glob
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+
+from . import site_caching
+
+MAGIC = b'MFNFCORP'
+# Magic bytes, number of pages, position of the urls, position of the index
+HEADER = struct.Struct('<8sQQQ')
+# Type code of the integers in the index
+INDEX_TYPE = 'q'
+# Number of integers per page in the index
+INDEX_FIELDS = 4
+
+
+class CorpusWriter:
+    """
+    Writer of a corpus file. The pages are added one at a time, only their
+    urls are kept in memory until the writer is closed.
+    """
+
+    def __init__(self, path):
+        # Closed by close
+        self.file = open(path, 'wb')  # pylint: disable=consider-using-with
+        self.file.write(HEADER.pack(MAGIC, 0, 0, 0))
+        self.position = HEADER.size
+        self.urls = []
+        self.index = array(INDEX_TYPE)
+
+    def add(self, url, content):
+        """Add a page to the corpus and return its number."""
+        data = content.encode('utf-8')
+        self.file.write(data)
+        self.index.extend((self.position, len(data), 0, 0))
+        self.position += len(data)
+        self.urls.append(url)
+        return len(self.urls) - 1
+
+    def location(self, page):
+        """
+        Return the position and the length of the content of the page with
+        number page in the file.
+        """
+        return (self.index[INDEX_FIELDS * page],
+                self.index[INDEX_FIELDS * page + 1])
+
+    def flush(self):
+        """Write the added contents to the file, so they can be read."""
+        self.file.flush()
+
+    def close(self):
+        """Write the urls, the index and the header and close the file."""
+        urls_position = self.position
+        for (page, url) in enumerate(self.urls):
+            data = url.encode('utf-8')
+            self.file.write(data)
+            self.index[INDEX_FIELDS * page + 2] = self.position
+            self.index[INDEX_FIELDS * page + 3] = len(data)
+            self.position += len(data)
+        # Align the index, so it can be read as array from the mapped file.
+        padding = -self.position % self.index.itemsize
+        self.file.write(bytes(padding))
+        index_position = self.position + padding
+        self.file.write(self.index.tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, len(self.urls), urls_position,
+                                    index_position))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+class CorpusFile:
+    """
+    Corpus file mapped into memory. Pages are identified by their numbers,
+    which follow the order in which they were written.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as filehandle:
+            self.map = mmap.mmap(filehandle.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        (magic, self.size, _, index_position) = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError('{} is no corpus file'.format(path))
+        self.view = memoryview(self.map)
+        index_size = INDEX_FIELDS * self.size * array(INDEX_TYPE).itemsize
+        self.index = self.view[index_position:index_position +
+                               index_size].cast(INDEX_TYPE)
+
+    def __len__(self):
+        return self.size
+
+    def location(self, page):
+        """
+        Return the position and the length of the content of the page with
+        number page in the file.
+        """
+        return (self.index[INDEX_FIELDS * page],
+                self.index[INDEX_FIELDS * page + 1])
+
+    def content(self, page):
+        """Return the content of the page with number page."""
+        position = self.index[INDEX_FIELDS * page]
+        return str(self.view[position:position +
+                             self.index[INDEX_FIELDS * page + 1]], 'utf-8')
+
+    def url(self, page):
+        """Return the url of the page with number page."""
+        position = self.index[INDEX_FIELDS * page + 2]
+        return str(self.view[position:position +
+                             self.index[INDEX_FIELDS * page + 3]], 'utf-8')
+
+    def pages(self):
+        """Generator yielding all pages as (url, content) pairs."""
+        for page in range(self.size):
+            yield (self.url(page), self.content(page))
+
+    def close(self):
+        """Unmap the file."""
+        self.index.release()
+        self.view.release()
+        self.map.close()
+
+
+class ContentMap:
+    """
+    Memory map of the contents in a corpus file, which may still be written
+    by a CorpusWriter. The contents are read by their locations (see
+    CorpusWriter.location). The file is mapped again when a content behind
+    the mapped part is read.
+    """
+
+    def __init__(self, path):
+        # Closed by close
+        self.file = open(path, 'rb')  # pylint: disable=consider-using-with
+        self.map = None
+
+    def content(self, position, length):
+        """Return the content at the given position with the given length."""
+        if self.map is None or position + length > len(self.map):
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        return str(self.map[position:position + length], 'utf-8')
+
+    def close(self):
+        """Unmap and close the file."""
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+
+def write_corpus(path, pages):
+    """
+    Write the pages, an iterable of (url, content) pairs, into the corpus
+    file path. Return the number of pages.
+    """
+    with CorpusWriter(path) as writer:
+        for (url, content) in pages:
+            writer.add(url, content)
+        return len(writer.urls)
+
+
+def export_corpus(path, cache='cache.db', action='raw'):
+    """
+    Write the cached pages in the representation action into the corpus
+    file path. Return the number of pages.
+    """
+    return write_corpus(path, site_caching.iter_pages(cache, action=action))
+
+
+def hashes_digest(hashes):
+    """
+    Return the hex digest of the page hashes given as dictionary indexed by
+    the urls.
+    """
+    digest = hashlib.sha1()
+    for url in sorted(hashes):
+        digest.update('{}\0{}\0'.format(url, hashes[url]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cached_corpus(cache='cache.db', action='raw', hashes=None):
+    """
+    Return the path of a corpus file next to the cache containing the pages
+    cached in the representation action. The corpus is exported once and
+    reused as long as the hashes of the cached pages are unchanged, older
+    corpora of the cache are removed. hashes are the hashes of the cached
+    pages indexed by their urls (see site_caching.read_page_hashes), they
+    are read from the cache if not given. Return None if the cached pages
+    changed while they were exported.
+    """
+    if hashes is None:
+        hashes = site_caching.read_page_hashes(cache, action)
+    digest = hashes_digest(hashes)
+    prefix = '{}.{}.'.format(cache, action)
+    path = prefix + digest + '.corpus'
+    if os.path.isfile(path):
+        return path
+    # Concurrent runs over the cache write their own temporary files.
+    (handle, temporary) = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(cache)))
+    os.close(handle)
+    try:
+        export_corpus(temporary, cache, action)
+        if hashes_digest(site_caching.read_page_hashes(cache, action)) != \
+           digest:
+            os.remove(temporary)
+            return None
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    for other in glob.glob(glob.escape(prefix) + '*.corpus'):
+        if other != path:
+            os.remove(other)
+    return path
@@ -0,0 +1,190 @@
+"""
+Module for analysing the graph of the internal links between the pages of the
+Mathe für Nicht-Freaks project.
+
+The graph is built from the link index (see util.link_index) and stored in
+compressed sparse row (CSR) form: every page gets an integer id, and the ids
+of the pages linked by a page are a slice of a single array of targets. The
+pages of the books and the linked sections (anchors) are stored the same
+way. Thus the graph consists of a few arrays of integers and lists of
+strings, which are stored in the cache as they are. The analyses work on the
+arrays only and need no dictionaries keyed by urls.
+"""
+
+import collections
+import json
+from array import array
+
+from . import site_caching
+
+# Type code of the integer arrays
+ARRAY_TYPE = 'i'
+
+
+class LinkGraph:
+    """
+    Graph of the internal links between pages:
+    urls: list of the page urls, the id of a page is its position
+    offsets, targets: the ids of the pages linked by the page with id i are
+        targets[offsets[i]:offsets[i+1]] (every linked page once, links of a
+        page to itself are left out)
+    degrees: the number of pages linking to the page with id i is
+        degrees[i]
+    books: list of the book names
+    book_offsets, book_pages: the ids of the pages of the book with position
+        j in books are book_pages[book_offsets[j]:book_offsets[j+1]] in the
+        order of the sitemap
+    section_pages, section_anchors, section_counts: the sections (anchors)
+        linked from other pages, i.e. the anchor section_anchors[k] on the
+        page section_pages[k] is linked by section_counts[k] pages. The
+        sections are sorted by their counts, most linked first.
+    """
+
+    def __init__(self, urls, offsets, targets, degrees, books, book_offsets,
+                 book_pages, section_pages, section_anchors, section_counts):
+        self.urls = urls
+        self.offsets = offsets
+        self.targets = targets
+        self.degrees = degrees
+        self.books = books
+        self.book_offsets = book_offsets
+        self.book_pages = book_pages
+        self.section_pages = section_pages
+        self.section_anchors = section_anchors
+        self.section_counts = section_counts
+
+    def linked_pages(self, page):
+        """Return the ids of the pages linked by the page with id page."""
+        return self.targets[self.offsets[page]:self.offsets[page + 1]]
+
+    def linking_pages(self, pages):
+        """
+        Return the ids of the pages which link to at least one of the pages
+        with the ids in pages.
+        """
+        wanted = bytearray(len(self.urls))
+        for page in pages:
+            wanted[page] = 1
+        return [page for page in range(len(self.urls))
+                if any(wanted[target] for target in self.linked_pages(page))]
+
+    def pages_of_book(self, book):
+        """Return the ids of the pages of the book with position book."""
+        return self.book_pages[self.book_offsets[book]:
+                               self.book_offsets[book + 1]]
+
+    def orphans(self, book):
+        """
+        Return the ids of the pages of the book with position book which no
+        other page links to. The first page of the book is left out, since it
+        is the entry point of the book.
+        """
+        return [page for page in self.pages_of_book(book)[1:]
+                if not self.degrees[page]]
+
+    def unreachable(self, book):
+        """
+        Return the ids of the pages of the book with position book which
+        can't be reached from its first page by following links between the
+        pages of the book.
+        """
+        pages = self.pages_of_book(book)
+        if not pages:
+            return []
+        in_book = bytearray(len(self.urls))
+        for page in pages:
+            in_book[page] = 1
+        seen = bytearray(len(self.urls))
+        seen[pages[0]] = 1
+        stack = [pages[0]]
+        while stack:
+            for target in self.linked_pages(stack.pop()):
+                if in_book[target] and not seen[target]:
+                    seen[target] = 1
+                    stack.append(target)
+        return [page for page in pages if not seen[page]]
+
+    def most_linked_sections(self, limit=20):
+        """
+        Return the limit most linked sections as list of (url, anchor, number
+        of linking pages) tuples.
+        """
+        return [(self.urls[self.section_pages[k]], self.section_anchors[k],
+                 self.section_counts[k])
+                for k in range(min(limit, len(self.section_counts)))]
+
+    def save(self, cache='cache.db'):
+        """Store the graph in the cache, replacing the stored graph."""
+        db_connection = site_caching.open_cache_db(cache)
+        with db_connection:
+            db_connection.execute('DELETE FROM link_graph')
+            db_connection.executemany(
+                'INSERT INTO link_graph(name, data) VALUES (?, ?)',
+                [(name, json.dumps(getattr(self, name)).encode('utf-8'))
+                 for name in ('urls', 'books', 'section_anchors')] +
+                [(name, getattr(self, name).tobytes())
+                 for name in ('offsets', 'targets', 'degrees', 'book_offsets',
+                              'book_pages', 'section_pages',
+                              'section_counts')])
+        db_connection.close()
+
+
+def load_link_graph(cache='cache.db'):
+    """Load the graph stored in the cache. Return None if there is none."""
+    db_connection = site_caching.open_cache_db(cache)
+    data = dict(db_connection.execute('SELECT name, data FROM link_graph'))
+    db_connection.close()
+    if not data:
+        return None
+    fields = {}
+    for (name, value) in data.items():
+        if name in ('urls', 'books', 'section_anchors'):
+            fields[name] = json.loads(value.decode('utf-8'))
+        else:
+            fields[name] = array(ARRAY_TYPE)
+            fields[name].frombytes(value)
+    return LinkGraph(**fields)
+
+
+def build_link_graph(books, index):
+    """
+    Build the graph of the links between the pages of the books and the
+    pages in index, which maps the page urls to their PageRecords (see
+    util.link_index). Links to pages which are neither in index nor in books
+    are left out.
+    """
+    urls = sorted(set(index).union(url for book in books
+                                   for url in books[book]))
+    ids = {url: page for (page, url) in enumerate(urls)}
+    offsets = array(ARRAY_TYPE, [0])
+    targets = array(ARRAY_TYPE)
+    sections = collections.Counter()
+    for (page, url) in enumerate(urls):
+        linked = set()
+        anchors = set()
+        record = index.get(url)
+        for link in record.links if record is not None else ():
+            (linked_url, _, anchor) = link.partition('#')
+            target = ids.get(linked_url)
+            if target is None or target == page:
+                continue
+            linked.add(target)
+            if anchor:
+                anchors.add((target, anchor))
+        sections.update(anchors)
+        targets.extend(sorted(linked))
+        offsets.append(len(targets))
+    counts = collections.Counter(targets)
+    degrees = array(ARRAY_TYPE, (counts[page] for page in range(len(urls))))
+    book_offsets = array(ARRAY_TYPE, [0])
+    book_pages = array(ARRAY_TYPE)
+    for book in books:
+        book_pages.extend(ids[url] for url in dict.fromkeys(books[book]))
+        book_offsets.append(len(book_pages))
+    ranking = sorted(sections.items(), key=lambda item: (-item[1], item[0]))
+    return LinkGraph(
+        urls, offsets, targets, degrees, list(books), book_offsets,
+        book_pages,
+        array(ARRAY_TYPE, (target for ((target, _), _) in ranking)),
+        [anchor for ((_, anchor), _) in ranking],
+        array(ARRAY_TYPE, (count for (_, count) in ranking)))
@@ -0,0 +1,108 @@
+"""
+Module for indexing the anchors and links of the rendered pages of the Mathe
+für Nicht-Freaks project.
+
+Checking links only needs the ids present on every page and the links going
+out of every page. Both are extracted once per page while the HTML is parsed
+as a stream, so no parse tree is kept and link checks become set lookups
+instead of walks through parse trees.
+"""
+
+from html.parser import HTMLParser
+
+from . import bookinfo
+
+# Elements which never have an end tag
+VOID_ELEMENTS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr'))
+
+
+class PageRecord:
+    """
+    Compact record of a rendered page:
+    title: the text of the page's title tag
+    ids: frozenset of all element ids on the page
+    links: list of the hrefs of all links outside the Serlo header
+    redlinks: list of the hrefs of all redlinks outside the Serlo header
+    """
+    __slots__ = ('title', 'ids', 'links', 'redlinks')
+
+    def __init__(self, title, ids, links, redlinks):
+        self.title = title
+        self.ids = ids
+        self.links = links
+        self.redlinks = redlinks
+
+    def astuple(self):
+        """Return the record as (title, ids, links, redlinks) tuple."""
+        return (self.title, self.ids, self.links, self.redlinks)
+
+
+class PageRecordParser(HTMLParser):
+    """
+    Streaming HTML parser which collects the data of a PageRecord. The links
+    inside the Serlo header are skipped, since it contains parts of the
+    sitemap. We don't wan't to check the links in there. They all exist or
+    provide unnecessary redlink warnings.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.title_parts = None
+        self.ids = set()
+        self.links = []
+        self.redlinks = []
+        # Tag name and nesting depth of the Serlo header while inside of it
+        self.header_tag = None
+        self.header_depth = 0
+        self.header_seen = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if self.header_tag == tag:
+            self.header_depth += 1
+        if 'id' in attrs:
+            element_id = attrs['id'] or ''
+            self.ids.add(element_id)
+            if element_id == 'serlo-header' and not self.header_seen:
+                self.header_seen = True
+                self.header_tag = tag
+                self.header_depth = 1
+                if tag in VOID_ELEMENTS:
+                    self.handle_endtag(tag)
+        if tag == 'a' and self.header_tag is None and attrs.get('href'):
+            kind = bookinfo.classify_link(attrs['href'])
+            if kind == 'link':
+                self.links.append(attrs['href'])
+            elif kind == 'redlink':
+                self.redlinks.append(attrs['href'])
+        if tag == 'title' and self.title is None:
+            self.title_parts = []
+
+    def handle_endtag(self, tag):
+        if self.header_tag == tag:
+            self.header_depth -= 1
+            if self.header_depth == 0:
+                self.header_tag = None
+        if tag == 'title' and self.title_parts is not None:
+            self.title = ''.join(self.title_parts)
+            self.title_parts = None
+
+    def handle_data(self, data):
+        if self.title_parts is not None:
+            self.title_parts.append(data)
+
+    def record(self):
+        """Return the PageRecord of the parsed page."""
+        return PageRecord(self.title or '', frozenset(self.ids), self.links,
+                          self.redlinks)
+
+
+def parse_page_record(html):
+    """Parse the HTML of a rendered page into a PageRecord."""
+    parser = PageRecordParser()
+    parser.feed(html)
+    parser.close()
+    return parser.record()
@@ -0,0 +1,190 @@
+"""
+Module for instrumenting the diagnostic scripts for the Mathe für Nicht-Freaks
+project.
+
+The scripts record how much time they spend in their stages (e.g. fetching
+the sitemap, downloading pages, reading the cache, analysing pages) and count
+events like HTTP requests, downloaded bytes and found matches. Recording is
+cheap, so it is always done. The options --profile and --metrics of the
+scripts (see book_argument_parser) print or store the summary when the script
+exits and --cprofile dumps cProfile statistics of the whole run.
+
+The times of stages running on several threads or processes are summed up,
+so they can exceed the wall time. Worker processes send the metrics they
+recorded to the parent process (see take and merge).
+"""
+
+import atexit
+import cProfile
+import functools
+import json
+import threading
+import time
+
+# Long getopt options handled by enable_reports
+LONG_OPTIONS = ['profile', 'metrics=', 'cprofile=']
+
+# Total time and number of calls of every stage indexed by the stage names
+STAGES = {}
+# Counted events indexed by their names
+COUNTERS = {}
+LOCK = threading.Lock()
+START_TIME = time.perf_counter()
+
+
+class Stage:
+    """
+    Context manager adding the time spent inside of it to the stage name.
+    """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(name):
+    """Return a context manager timing the stage name."""
+    return Stage(name)
+
+
+def timed(name):
+    """Decorator timing every call of the decorated function as stage name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            with Stage(name):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorator
+
+
+def timed_iter(name, iterable):
+    """
+    Generator yielding the items of iterable. The time spent waiting for the
+    items is added to the stage name.
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            add_time(name, time.perf_counter() - start)
+            return
+        add_time(name, time.perf_counter() - start)
+        yield item
+
+
+def add_time(name, seconds):
+    """Add seconds to the time of the stage name and count the call."""
+    with LOCK:
+        entry = STAGES.get(name)
+        if entry is None:
+            STAGES[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+
+def count(name, amount=1):
+    """Increase the counter name by amount."""
+    with LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + amount
+
+
+def reset():
+    """Discard all recorded times and counters."""
+    global START_TIME  # pylint: disable=global-statement
+    with LOCK:
+        STAGES.clear()
+        COUNTERS.clear()
+        START_TIME = time.perf_counter()
+
+
+def take():
+    """
+    Return the times and counters recorded since the last reset or take as
+    pair of dictionaries and discard them. Worker processes use this to send
+    their metrics to the parent process, which adds them with merge.
+    """
+    with LOCK:
+        recorded = ({name: tuple(entry) for (name, entry) in STAGES.items()},
+                    dict(COUNTERS))
+        STAGES.clear()
+        COUNTERS.clear()
+    return recorded
+
+
+def merge(recorded):
+    """Add the times and counters returned by take to the recorded ones."""
+    (stages, counters) = recorded
+    with LOCK:
+        for (name, (seconds, calls)) in stages.items():
+            entry = STAGES.setdefault(name, [0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+        for (name, amount) in counters.items():
+            COUNTERS[name] = COUNTERS.get(name, 0) + amount
+
+
+def summary():
+    """
+    Return the recorded metrics as dictionary containing the 'wall_time', the
+    'stages' with their 'seconds' and 'calls' and the 'counters'.
+    """
+    with LOCK:
+        return {
+            'wall_time': time.perf_counter() - START_TIME,
+            'stages': {name: {'seconds': seconds, 'calls': calls}
+                       for (name, (seconds, calls)) in STAGES.items()},
+            'counters': dict(COUNTERS),
+        }
+
+
+def print_summary():
+    """Print the recorded metrics."""
+    metrics = summary()
+    print('Wall time: {:.3f} s'.format(metrics['wall_time']))
+    print('{:<40} {:>10} {:>12}'.format('Stage', 'Calls', 'Seconds'))
+    for (name, entry) in sorted(metrics['stages'].items()):
+        print('{:<40} {:>10} {:>12.3f}'.format(name, entry['calls'],
+                                               entry['seconds']))
+    print('{:<40} {:>23}'.format('Counter', 'Value'))
+    for (name, value) in sorted(metrics['counters'].items()):
+        print('{:<40} {:>23}'.format(name, value))
+
+
+def write_metrics(filename):
+    """Write the recorded metrics as JSON to filename."""
+    with open(filename, 'w') as file:
+        json.dump(summary(), file, indent=2, sort_keys=True)
+
+
+def enable_reports(opts):
+    """
+    Set up the reports requested by the options in the dictionary opts:
+    --profile prints the summary and --metrics <file> writes it as JSON when
+    the script exits. --cprofile <file> profiles the rest of the run and
+    dumps the statistics to the file (see the module pstats).
+    """
+    if '--cprofile' in opts:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def dump_profile():
+            profiler.disable()
+            profiler.dump_stats(opts['--cprofile'])
+        atexit.register(dump_profile)
+    if '--metrics' in opts:
+        atexit.register(write_metrics, opts['--metrics'])
+    if '--profile' in opts:
+        atexit.register(print_summary)
@@ -0,0 +1,128 @@
+"""
+Module for finding near-duplicate passages of text with MinHash signatures and
+locality sensitive hashing (LSH).
+
+Every passage is reduced to the set of its shingles (sequences of
+SHINGLE_SIZE consecutive words), which is summarised by a bottom-k MinHash
+signature: the SIGNATURE_SIZE smallest values of a hash function on the
+shingles. This needs a single hash function instead of one per value and
+still estimates the Jaccard similarity of two shingle sets. Passages are only
+compared if they share one of their LSH_KEYS smallest hash values. The
+probability of this grows quickly with the similarity of the passages, so
+finding the near-duplicates doesn't need a comparison of all pairs of
+passages. Keys shared by more than MAX_BUCKET_SIZE passages (e.g. shingles of
+boilerplate text) aren't selective and are left out, and the passages of a
+key are only compared with one passage of every group found for this key.
+Thus the number of comparisons grows linearly with the number of passages.
+"""
+
+import random
+import re
+import zlib
+
+# Number of words in a shingle
+SHINGLE_SIZE = 5
+# Maximal number of hash values in a signature
+SIGNATURE_SIZE = 64
+# Number of the smallest hash values of a signature used as LSH keys
+LSH_KEYS = 8
+# Maximal number of passages sharing an LSH key which are compared
+MAX_BUCKET_SIZE = 50
+# Minimal estimated similarity of near-duplicates
+THRESHOLD = 0.8
+# Prime modulus of the hash function (the smallest prime above 2**32)
+PRIME = 4294967311
+
+WORD_REGEX = re.compile('\\w+')
+
+
+def hash_coefficients(seed=0):
+    """
+    Return the pair (a, b) defining the hash function x -> (a*x+b) mod PRIME.
+    A fixed seed keeps the signatures comparable between runs.
+    """
+    generator = random.Random(seed)
+    return (generator.randrange(1, PRIME), generator.randrange(PRIME))
+
+
+COEFFICIENTS = hash_coefficients()
+
+
+def words(text):
+    """Return the lower case words of text."""
+    return WORD_REGEX.findall(text.lower())
+
+
+def shingles(word_list):
+    """Return the set of hashes of the shingles of the list of words."""
+    return {zlib.crc32(' '.join(word_list[i:i+SHINGLE_SIZE]).encode('utf-8'))
+            for i in range(max(len(word_list) - SHINGLE_SIZE + 1, 1))}
+
+
+def signature(shingle_hashes):
+    """
+    Return the MinHash signature of a set of shingle hashes, i.e. the sorted
+    list of its SIGNATURE_SIZE smallest hash values.
+    """
+    (a, b) = COEFFICIENTS
+    return sorted((a * x + b) % PRIME for x in shingle_hashes)[:SIGNATURE_SIZE]
+
+
+def similarity(signature1, signature2):
+    """
+    Estimate the Jaccard similarity of two passages by their signatures: the
+    fraction of the smallest hash values of both passages together which
+    belong to both signatures.
+    """
+    values1 = set(signature1)
+    values2 = set(signature2)
+    union = sorted(values1 | values2)[:SIGNATURE_SIZE]
+    if not union:
+        return 0
+    return sum(1 for value in union
+               if value in values1 and value in values2) / len(union)
+
+
+def find_root(parents, index):
+    """Return the representative of index in the union-find forest parents."""
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+    return index
+
+
+def duplicate_groups(signatures, threshold=THRESHOLD):
+    """
+    Group the passages with the given list of signatures into near-duplicates.
+    Every passage is compared with a representative of every group of the
+    passages sharing an LSH key with it (for keys of at most MAX_BUCKET_SIZE
+    passages). It joins the first group whose representative is at least
+    threshold similar to it and becomes a representative otherwise.
+    Return the groups with at least two passages as sorted lists of the
+    indices of the passages.
+    """
+    buckets = {}
+    for (index, sig) in enumerate(signatures):
+        for value in sig[:LSH_KEYS]:
+            buckets.setdefault(value, []).append(index)
+    parents = list(range(len(signatures)))
+    for members in buckets.values():
+        if len(members) > MAX_BUCKET_SIZE:
+            continue
+        representatives = []
+        for index in members:
+            root = find_root(parents, index)
+            for representative in representatives:
+                representative_root = find_root(parents, representative)
+                if representative_root == root:
+                    break
+                if similarity(signatures[representative],
+                              signatures[index]) >= threshold:
+                    parents[root] = representative_root
+                    break
+            else:
+                representatives.append(index)
+    groups = {}
+    for index in range(len(signatures)):
+        groups.setdefault(find_root(parents, index), []).append(index)
+    return [group for group in groups.values() if len(group) > 1]
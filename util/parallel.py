@@ -0,0 +1,100 @@
+"""
+Module with helper functions for distributing work over multiple processes
+and threads.
+"""
+
+import collections
+import concurrent.futures
+import getopt
+import queue
+import threading
+
+# Long getopt options of the process pools
+LONG_OPTIONS = ['processes=']
+
+
+def parse_processes(opts):
+    """
+    Return the number of worker processes given by the option --processes
+    in the dictionary opts (1 if it isn't given).
+    """
+    processes = int(opts.get('--processes', 1))
+    if processes < 1:
+        raise getopt.GetoptError(
+            'invalid number of processes {}'.format(opts['--processes']),
+            '--processes')
+    return processes
+
+
+def ordered_map(function, iterable, jobs=1, window=None, initializer=None,
+                initargs=()):
+    """
+    Generator yielding function(item) for every item in iterable in the order
+    of iterable. With jobs > 1 the calls are distributed over a pool of jobs
+    processes, which are set up by calling initializer(*initargs). At most
+    window items (4 * jobs by default) are in flight at a time, so only a
+    bounded part of iterable is held in memory.
+    function and the items have to be picklable when jobs > 1.
+    """
+    if jobs <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in iterable:
+            yield function(item)
+        return
+    if window is None:
+        window = 4 * jobs
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=initializer,
+            initargs=initargs) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prefetch(iterable, size=1):
+    """
+    Generator yielding the items of iterable, which is iterated by a
+    background thread. Up to size items are produced ahead of the consumer
+    and wait in a bounded queue, so producing and consuming the items overlap
+    while only a bounded number of items is held in memory. Exceptions raised
+    by iterable are raised by the generator.
+    """
+    items = queue.Queue(maxsize=max(size, 1))
+    stopped = threading.Event()
+
+    def put(entry):
+        # Give up when the consumer doesn't want any more items.
+        while not stopped.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((True, item)):
+                    return
+            put((False, None))
+        except Exception as error:  # pylint: disable=broad-except
+            put((False, error))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            (is_item, item) = items.get()
+            if not is_item:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stopped.set()
@@ -0,0 +1,153 @@
+"""
+Module for writing the findings of analyses as records while they are found.
+
+Every record describes a single finding by the fields in RECORD_FIELDS: the
+url of the page, the book containing the page, the kind of the finding, its
+offset in the WikiText of the page and its content. The records are written
+one at a time, so the memory needed for the output doesn't grow with the
+number of findings. Besides the human readable text format, records can be
+written as JSON Lines or CSV for further processing.
+"""
+
+import csv
+import json
+import os
+import shutil
+import sys
+
+from .analysis import make_output_dir
+
+RECORD_FIELDS = ('page', 'book', 'kind', 'offset', 'content')
+
+
+class RecordWriter:
+    """
+    Base class of the writers of records to the file filename. A writer can
+    be used as context manager, which closes it on exit.
+    """
+
+    def __init__(self, filename):
+        make_output_dir(filename)
+        self.filename = filename
+        # Closed by close
+        self.file = open(  # pylint: disable=consider-using-with
+            filename, 'w', newline='')
+        self.count = 0
+
+    def write(self, page, book, kind, offset, content):
+        """Write a record to the file."""
+        self.count += 1
+        self.write_record((page, book, kind, offset, content))
+
+    def write_record(self, record):
+        """Write the tuple record containing the RECORD_FIELDS."""
+        raise NotImplementedError
+
+    def close(self):
+        """Finish the file."""
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+        return False
+
+
+class TextWriter(RecordWriter):
+    """
+    Writer of the contents of the records as text separated by separator.
+    If page_separator is not None, the contents are grouped by page: every
+    page starts with its url followed by an empty line and pages are
+    separated by page_separator. The records of a page have to be written
+    consecutively.
+    If header is given, it is called with the number of records when the
+    writer is closed and the returned string is put in front of the
+    contents. The contents are then written to a temporary file first.
+    """
+
+    def __init__(self, filename, separator='\n', page_separator=None,
+                 header=None):
+        super().__init__(filename if header is None else filename + '.part')
+        self.target = filename
+        self.separator = separator
+        self.page_separator = page_separator
+        self.header = header
+        self.page = None
+
+    def write_record(self, record):
+        (page, _, _, _, content) = record
+        if self.page_separator is not None and page != self.page:
+            if self.page is not None:
+                self.file.write(self.page_separator)
+            self.file.write('{}\n\n'.format(page))
+            self.page = page
+        elif self.count > 1:
+            self.file.write(self.separator)
+        self.file.write(content)
+
+    def close(self):
+        super().close()
+        if self.header is None:
+            return
+        with open(self.target, 'w') as target:
+            target.write(self.header(self.count))
+            with open(self.filename) as part:
+                shutil.copyfileobj(part, target)
+        os.remove(self.filename)
+
+
+class JsonLinesWriter(RecordWriter):
+    """Writer of every record as JSON object on its own line."""
+
+    def write_record(self, record):
+        self.file.write(json.dumps(dict(zip(RECORD_FIELDS, record)),
+                                   ensure_ascii=False))
+        self.file.write('\n')
+
+
+class CsvWriter(RecordWriter):
+    """Writer of the records as CSV file with a header row."""
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.csv_writer = csv.writer(self.file)
+        self.csv_writer.writerow(RECORD_FIELDS)
+
+    def write_record(self, record):
+        self.csv_writer.writerow(record)
+
+
+# Writer classes and file extensions of the output formats
+FORMATS = {
+    'text': (TextWriter, 'txt'),
+    'jsonl': (JsonLinesWriter, 'jsonl'),
+    'csv': (CsvWriter, 'csv'),
+}
+
+
+def open_writer(base_name, output_format='text', **text_options):
+    """
+    Return a writer of records in output_format to the file base_name with
+    the extension of the format. text_options are passed to the TextWriter
+    and ignored by the other formats.
+    """
+    (writer_class, extension) = FORMATS[output_format]
+    filename = '{}.{}'.format(base_name, extension)
+    if writer_class is TextWriter:
+        return TextWriter(filename, **text_options)
+    return writer_class(filename)
+
+
+def parse_output_format(opts):
+    """
+    Return the output format given by the option -f in the dictionary opts
+    ('text' by default). Exit if the format is unknown.
+    """
+    output_format = opts.get('-f', 'text')
+    if output_format not in FORMATS:
+        print('The output format "{}" is not available.'.format(
+            output_format))
+        sys.exit(1)
+    return output_format
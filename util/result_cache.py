@@ -0,0 +1,112 @@
+"""
+Module for memoizing the findings of analyzers for single pages.
+
+The findings are stored in the cache database and identified by the hash of
+the page content, the name of the analyzer and its version. Thus a page is
+only analysed again when its content or the analyzer has changed.
+"""
+
+import json
+import time
+
+from . import site_caching
+
+# Maximal number of findings kept in the result cache. The least recently
+# used findings are dropped first.
+MAX_RESULTS = 200000
+# Number of new findings or usages after which they are written to the
+# database
+FLUSH_SIZE = 1000
+
+
+class ResultCache:
+    """
+    Cache of the findings of analyzers stored in the cache database cache.
+    New findings and the usage times of cached ones are written in batches
+    of FLUSH_SIZE entries, so only a bounded number of them is held in
+    memory.
+    """
+
+    def __init__(self, cache='cache.db'):
+        self.db_connection = site_caching.open_cache_db(cache)
+        self.new_findings = []
+        self.used_keys = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, page_hash, analyzer):
+        """
+        Return the cached findings of analyzer for the page content with the
+        hash page_hash or None if there are none.
+        """
+        key = (page_hash, analyzer.name, analyzer.version)
+        row = self.db_connection.execute(
+            'SELECT findings FROM results WHERE hash = ? AND analyzer = ? ' +
+            'AND version = ?', key).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used_keys.append(key)
+        if len(self.used_keys) >= FLUSH_SIZE:
+            self.flush()
+        return json.loads(row[0])
+
+    def put(self, page_hash, analyzer, findings):
+        """Store the findings of analyzer for the content with page_hash."""
+        self.new_findings.append((page_hash, analyzer.name, analyzer.version,
+                                  json.dumps(findings)))
+        if len(self.new_findings) >= FLUSH_SIZE:
+            self.flush()
+
+    def findings(self, page_hash, analyzer, content):
+        """
+        Return the findings of analyzer in content, whose hash is page_hash.
+        They are computed only if they aren't cached yet.
+        """
+        findings = self.get(page_hash, analyzer)
+        if findings is None:
+            findings = analyzer.extract(content)
+            self.put(page_hash, analyzer, findings)
+        return findings
+
+    def flush(self):
+        """Write the new findings and the usage times to the database."""
+        now = time.time()
+        with self.db_connection:
+            self.db_connection.executemany(
+                'INSERT OR REPLACE INTO results(hash, analyzer, version, ' +
+                'findings, last_used) VALUES (?, ?, ?, ?, ?)',
+                [(*entry, now) for entry in self.new_findings])
+            self.db_connection.executemany(
+                'UPDATE results SET last_used = ? WHERE hash = ? AND ' +
+                'analyzer = ? AND version = ?',
+                [(now, *key) for key in self.used_keys])
+        self.new_findings = []
+        self.used_keys = []
+
+    def evict(self, max_results=None):
+        """
+        Drop the findings for contents which are neither cached nor part of
+        a snapshot (see util.snapshots) and the least recently used findings
+        beyond max_results entries.
+        Return the number of dropped findings.
+        """
+        if max_results is None:
+            max_results = MAX_RESULTS
+        with self.db_connection:
+            dropped = self.db_connection.execute(
+                'DELETE FROM results WHERE hash NOT IN ' +
+                '(SELECT hash FROM pages WHERE hash IS NOT NULL) AND ' +
+                'hash NOT IN (SELECT hash FROM snapshot_pages)').rowcount
+            dropped += self.db_connection.execute(
+                'DELETE FROM results WHERE rowid IN (SELECT rowid ' +
+                'FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (max_results,)).rowcount
+        return dropped
+
+    def close(self):
+        """Flush the cache, evict old findings and close the database."""
+        self.flush()
+        self.evict()
+        self.db_connection.close()
@@ -0,0 +1,255 @@
+"""
+Module for splitting a run of the diagnostic scripts into shards, which can
+run on different machines, and for the partial results of the shards.
+
+A shard is given as <number>/<count> by the option --shard. By default the
+pages are distributed by the hashes of their urls: every shard gets an equal
+range of the hash values. With --shard-by book whole books are distributed
+round robin in the order of the sitemap, where every page belongs to its
+first book. bad_finder.py always distributes the books, since it checks the
+links book by book.
+
+With the option --partial the findings of every page (or the bad links of
+every book) are written as JSON lines to a partial result file instead of
+writing the output files. The first line is a header describing the run.
+Every record contains the position of its page or book in the whole run, so
+merge.py can combine the partial results of all shards into the output
+files of a run without shards. Since the positions are only meaningful for
+the same pages in the same order, the header contains a fingerprint of the
+books and pages of the run, and merge.py refuses to merge shards with
+different fingerprints.
+
+The scripts select the pages of their shard by their urls before they are
+read or fetched (see bookinfo.book_argument_parser), so every shard only
+reads or downloads its own pages. The fingerprint is computed from the
+revision ids or the cached hashes of the pages instead of their contents.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import zlib
+
+# Long getopt options of the shards
+LONG_OPTIONS = ['shard=', 'shard-by=', 'partial=']
+# Ways of distributing the pages to the shards
+SHARD_BY = ('url', 'book')
+# Number of possible hash values of an url
+HASH_RANGE = 2 ** 32
+
+
+class Shard:
+    """
+    Shard number of count shards (counted from 1). by is the way the pages
+    are distributed (see SHARD_BY).
+    """
+
+    def __init__(self, number, count, by='url'):
+        self.number = number
+        self.count = count
+        self.by = by
+
+    def __str__(self):
+        return '{}/{}'.format(self.number, self.count)
+
+    def has_url(self, url):
+        """Check whether the hash of url lies in the range of the shard."""
+        value = zlib.crc32(url.encode('utf-8'))
+        return value * self.count // HASH_RANGE == self.number - 1
+
+    def has_book(self, position):
+        """
+        Check whether the book with the given position in the sitemap
+        belongs to the shard.
+        """
+        return position % self.count == self.number - 1
+
+    def has_page(self, url, book_positions):
+        """
+        Check whether the page url belongs to the shard. book_positions maps
+        the urls to the positions of their first books.
+        """
+        if self.by == 'book' and url in book_positions:
+            return self.has_book(book_positions[url])
+        return self.has_url(url)
+
+
+def parse_shard(opts):
+    """
+    Return the Shard given by the options --shard and --shard-by in the
+    dictionary opts or None if the run isn't sharded. Exit if the shard is
+    invalid.
+    """
+    if '--shard' not in opts:
+        return None
+    try:
+        (number, count) = (int(part) for part in opts['--shard'].split('/'))
+    except ValueError:
+        number = count = 0
+    if not 1 <= number <= count:
+        print('The shard "{}" is invalid. Expected <number>/<count>.'.format(
+            opts['--shard']))
+        sys.exit(1)
+    by = opts.get('--shard-by', 'url')
+    if by not in SHARD_BY:
+        print('Shards by "{}" are not available. Available: {}'.format(
+            by, ', '.join(SHARD_BY)))
+        sys.exit(1)
+    return Shard(number, count, by)
+
+
+def new_fingerprint(books, versions=()):
+    """
+    Return a hash object (see hashlib) for the fingerprint of a corpus with
+    the given books. versions are (url, version) pairs of the pages of the
+    corpus in their order, where the version identifies the content of the
+    page, e.g. its revision id or the hash of its cached content. Pages can
+    also be added by select_pages.
+    """
+    fingerprint = hashlib.sha1(json.dumps(books).encode('utf-8'))
+    for (url, version) in versions:
+        fingerprint.update('{}\0{}\0'.format(url, version).encode('utf-8'))
+    return fingerprint
+
+
+def first_book_positions(books):
+    """
+    Return a dictionary mapping the urls of the pages of books to the
+    positions of their first books.
+    """
+    book_positions = {}
+    for (position, book) in enumerate(books):
+        for url in books[book]:
+            book_positions.setdefault(url, position)
+    return book_positions
+
+
+def select_urls(urls, shard, books):
+    """
+    Return a dictionary mapping the urls in urls which belong to shard (all
+    urls if shard is None) to their positions in urls. urls are the pages of
+    the whole run in their order.
+    """
+    book_positions = first_book_positions(books)
+    return {url: position for (position, url) in enumerate(urls)
+            if shard is None or shard.has_page(url, book_positions)}
+
+
+def select_pages(pages, shard, books, positions, fingerprint=None):
+    """
+    Generator yielding the (url, content) pairs of pages which belong to
+    shard (all pages if shard is None). The positions of the yielded pages
+    in pages are stored in the dictionary positions indexed by the urls.
+    If fingerprint is given, all pages are added to this hash object in
+    their order, including the pages of other shards. This reads all pages,
+    so pages which can be selected before they are read are better given
+    as ShardPages.
+    """
+    book_positions = first_book_positions(books)
+    for (position, (url, content)) in enumerate(pages):
+        if fingerprint is not None:
+            fingerprint.update(url.encode('utf-8') + b'\0' +
+                               content.encode('utf-8') + b'\0')
+        if shard is None or shard.has_page(url, book_positions):
+            positions[url] = position
+            yield (url, content)
+
+
+class ShardPages:
+    """
+    Iterable of the (url, content) pairs of the pages of a shard, which were
+    selected by select_urls before they were read or fetched. positions maps
+    the urls of the pages to their positions in the whole run and
+    fingerprint is the hash object of the whole run (see new_fingerprint,
+    None if it isn't needed).
+    """
+
+    def __init__(self, pages, positions, fingerprint=None):
+        self.pages = pages
+        self.positions = positions
+        self.fingerprint = fingerprint
+
+    def __iter__(self):
+        return iter(self.pages)
+
+
+class PartialWriter:
+    """
+    Writer of a partial result file path of the given kind ('analyses' or
+    'bad_links') written by shard (None for a run without shards). The
+    header contains the additional fields given as keyword arguments. The
+    records are written to a temporary file first, since the fingerprint of
+    the corpus is only known after all pages were read.
+    """
+
+    def __init__(self, path, kind, shard, **header):
+        self.path = path
+        self.header = {'partial': kind, 'shard': str(shard or Shard(1, 1)),
+                       **header}
+        # Closed by close
+        self.file = open(  # pylint: disable=consider-using-with
+            path + '.tmp', 'w')
+
+    def write(self, **record):
+        """Write a record with the given fields."""
+        self.file.write(json.dumps(record) + '\n')
+
+    def close(self, fingerprint):
+        """
+        Write the header containing the hex digest of the hash object
+        fingerprint followed by the records to the partial result file.
+        """
+        self.file.close()
+        with open(self.path, 'w') as partial_file, \
+                open(self.path + '.tmp') as records:
+            partial_file.write(json.dumps(dict(
+                self.header, fingerprint=fingerprint.hexdigest())) + '\n')
+            shutil.copyfileobj(records, partial_file)
+        os.remove(self.path + '.tmp')
+
+
+def read_header(path):
+    """Return the header of the partial result file path."""
+    with open(path) as partial_file:
+        return json.loads(partial_file.readline())
+
+
+def iter_records(path):
+    """Generator yielding the records of the partial result file path."""
+    with open(path) as partial_file:
+        partial_file.readline()
+        for line in partial_file:
+            yield json.loads(line)
+
+
+def different_corpora(headers):
+    """
+    Check whether the partial results with the given headers were written
+    for the same books and pages. Return a description of the problem or
+    None if all fingerprints are equal.
+    """
+    fingerprints = {header.get('fingerprint') for header in headers}
+    if len(fingerprints) != 1 or None in fingerprints:
+        return 'the shards were run over different books or pages'
+    return None
+
+
+def missing_shards(headers):
+    """
+    Check whether the partial results with the given headers were written
+    by all shards of a run and by no shard twice. Return a description of
+    the problem or None if the partial results are complete.
+    """
+    shards = sorted(tuple(int(part) for part in header['shard'].split('/'))
+                    for header in headers)
+    counts = {count for (_, count) in shards}
+    if len(counts) != 1:
+        return 'the shards belong to runs with different numbers of shards'
+    count = counts.pop()
+    numbers = [number for (number, _) in shards]
+    if numbers != list(range(1, count + 1)):
+        return 'expected the shards 1 to {} once each, got {}'.format(
+            count, ', '.join(str(number) for number in numbers))
+    return None
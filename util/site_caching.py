@@ -2,7 +2,49 @@
 This module contains helper function for caching page-related data.
 """
 
+import hashlib
+import lzma
 import sqlite3
+import zlib
+
+from . import metrics
+
+# Version of the database layout. It is stored as user_version of the
+# database. Caches with an older version are upgraded when they are opened.
+SCHEMA_VERSION = 9
+
+# Storage formats of the page contents. The format of every page is stored in
+# the column format of the pages table. NULL means 'text'.
+STORAGE_FORMATS = {
+    'text': (lambda string: string, lambda content: content),
+    'zlib': (lambda string: zlib.compress(string.encode('utf-8'), 6),
+             lambda content: zlib.decompress(content).decode('utf-8')),
+    'lzma': (lambda string: lzma.compress(string.encode('utf-8')),
+             lambda content: lzma.decompress(content).decode('utf-8')),
+}
+
+# Optional full text index over the WikiText of the cached pages. It is a
+# contentless FTS5 table with trigram tokens whose rowids are the rowids of
+# the pages, so it adds no copy of the contents to the cache. Once it has been
+# created by create_text_index, it is kept up to date whenever pages change.
+TEXT_INDEX = 'page_text'
+# Literals shorter than a trigram can't be looked up in the text index.
+TRIGRAM_LENGTH = 3
+
+
+def content_hash(string):
+    """Return the hash used to identify the content of a page."""
+    return hashlib.sha1(string.encode('utf-8')).hexdigest()
+
+
+def encode_content(string, storage_format='text'):
+    """Convert a page string into the given storage format."""
+    return STORAGE_FORMATS[storage_format][0](string)
+
+
+def decode_content(content, storage_format=None):
+    """Convert a stored page content back into a string."""
+    return STORAGE_FORMATS[storage_format or 'text'][1](content)
 
 
 def reset_cache_db(db_connection):
@@ -12,57 +54,674 @@ def reset_cache_db(db_connection):
     with db_connection:
         db_connection.execute('DROP TABLE IF EXISTS books')
         db_connection.execute('DROP TABLE IF EXISTS pages')
+        for table in ('link_index', 'anchors', 'links', 'results',
+                      'statistics', 'blobs', 'snapshots', 'snapshot_pages',
+                      'snapshot_books', 'link_graph', TEXT_INDEX):
+            db_connection.execute('DROP TABLE IF EXISTS {}'.format(table))
         db_connection.execute('CREATE TABLE books (name TEXT, page_url TEXT)')
+        create_pages_table(db_connection)
+        create_link_index_tables(db_connection)
+        create_results_table(db_connection)
+        create_statistics_table(db_connection)
+        create_snapshot_tables(db_connection)
+        create_link_graph_table(db_connection)
         db_connection.execute(
-            'CREATE TABLE pages (url TEXT PRIMARY KEY ON CONFLICT REPLACE, ' +
-            'content TEXT)')
+            'PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+
+
+def create_results_table(db_connection):
+    """
+    Create the table storing the findings of analyzers for single pages (see
+    util.result_cache). The findings are stored as JSON and identified by the
+    hash of the analysed content, the analyzer's name and its version.
+    """
+    db_connection.execute(
+        'CREATE TABLE IF NOT EXISTS results (hash TEXT, analyzer TEXT, ' +
+        'version INTEGER, findings TEXT, last_used REAL, ' +
+        'PRIMARY KEY (hash, analyzer, version))')
+
+
+def create_statistics_table(db_connection):
+    """
+    Create the table storing how often the items counted by the analyzers
+    (e.g. templates or TeX macros) occur on every page (see
+    util.statistics). The indexes allow looking up the pages using an item
+    and the counts per book without scanning the whole table.
+    """
+    for statement in (
+            'CREATE TABLE IF NOT EXISTS statistics (analyzer TEXT, ' +
+            'item TEXT, book TEXT, page TEXT, count INTEGER, ' +
+            'PRIMARY KEY (analyzer, page, item, book))',
+            'CREATE INDEX IF NOT EXISTS statistics_item ON ' +
+            'statistics(analyzer, item)',
+            'CREATE INDEX IF NOT EXISTS statistics_book ON ' +
+            'statistics(analyzer, book, item)'):
+        db_connection.execute(statement)
+
+
+def create_snapshot_tables(db_connection):
+    """
+    Create the tables storing named snapshots of the cached books and pages
+    (see util.snapshots). The contents of the pages are stored once in the
+    table blobs identified by their hashes. A snapshot only stores the hashes
+    of the contents of its pages and the books it was taken of.
+    """
+    for statement in (
+            'CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, ' +
+            'content TEXT, format TEXT)',
+            'CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, ' +
+            'created REAL)',
+            'CREATE TABLE IF NOT EXISTS snapshot_pages (snapshot TEXT, ' +
+            'url TEXT, action TEXT, hash TEXT, revid INTEGER, ' +
+            'PRIMARY KEY (snapshot, action, url))',
+            'CREATE INDEX IF NOT EXISTS snapshot_pages_hash ON ' +
+            'snapshot_pages(hash)',
+            'CREATE TABLE IF NOT EXISTS snapshot_books (snapshot TEXT, ' +
+            'name TEXT, page_url TEXT)',
+            'CREATE INDEX IF NOT EXISTS snapshot_books_snapshot ON ' +
+            'snapshot_books(snapshot)'):
+        db_connection.execute(statement)
 
 
-def cache_page_data(books, page_urls, cache='cache.db'):
+def create_pages_table(db_connection, name='pages'):
     """
-    Save the given books and page_urls in the cache database.
-    cache is the location of the cache database.
-    WARNING: This destroys all other cached data.
+    Create the table storing the pages. Every page can be stored in multiple
+    representations, which are identified by the action used to fetch them
+    ('raw' for WikiText, 'view' for HTML).
+    """
+    db_connection.execute(
+        ('CREATE TABLE {} (url TEXT, action TEXT, content TEXT, ' +
+         'revid INTEGER, timestamp TEXT, hash TEXT, format TEXT, ' +
+         'PRIMARY KEY (url, action))').format(name))
+
+
+def create_link_index_tables(db_connection):
+    """
+    Create the tables storing the link index of the rendered pages (see
+    util.link_index). An index entry is valid as long as its hash matches the
+    hash of the cached page.
+    """
+    for statement in (
+            'CREATE TABLE IF NOT EXISTS link_index (url TEXT PRIMARY KEY, ' +
+            'hash TEXT, title TEXT)',
+            'CREATE TABLE IF NOT EXISTS anchors (url TEXT, anchor TEXT)',
+            'CREATE TABLE IF NOT EXISTS links (url TEXT, position INTEGER, ' +
+            'href TEXT, redlink INTEGER)',
+            'CREATE INDEX IF NOT EXISTS anchors_url ON anchors(url)',
+            'CREATE INDEX IF NOT EXISTS links_url ON links(url)'):
+        db_connection.execute(statement)
+
+
+def create_link_graph_table(db_connection):
+    """
+    Create the table storing the graph of the links between the rendered
+    pages (see util.link_graph). Every array and list of the graph is stored
+    as a single value.
+    """
+    db_connection.execute(
+        'CREATE TABLE IF NOT EXISTS link_graph (name TEXT PRIMARY KEY, ' +
+        'data BLOB)')
+
+
+def has_text_index(db_connection):
+    """Check whether the cache database contains the text index."""
+    return db_connection.execute(
+        'SELECT 1 FROM sqlite_master WHERE name = ?',
+        (TEXT_INDEX,)).fetchone() is not None
+
+
+def index_page_text(db_connection, condition, params=()):
+    """
+    Add the WikiText pages selected by the SQL condition on the pages table
+    to the text index.
+    """
+    for (rowid, content, storage_format) in db_connection.execute(
+            'SELECT rowid, content, format FROM pages ' +
+            'WHERE action = \'raw\' AND ' + condition, params).fetchall():
+        db_connection.execute(
+            'INSERT INTO {}(rowid, content) VALUES (?, ?)'.format(
+                TEXT_INDEX),
+            (rowid, decode_content(content, storage_format)))
+
+
+def unindex_page_text(db_connection, condition, params=()):
+    """
+    Remove the WikiText pages selected by the SQL condition on the pages
+    table from the text index. This has to happen before the pages are
+    changed or deleted, since the index needs the indexed content to remove
+    its entries.
+    """
+    for (rowid, content, storage_format) in db_connection.execute(
+            'SELECT rowid, content, format FROM pages ' +
+            'WHERE action = \'raw\' AND ' + condition, params).fetchall():
+        db_connection.execute(
+            ('INSERT INTO {0}({0}, rowid, content) ' +
+             'VALUES (\'delete\', ?, ?)').format(TEXT_INDEX),
+            (rowid, decode_content(content, storage_format)))
+
+
+def guess_action(content):
+    """
+    Guess the representation of a page content which was cached without
+    storing its representation.
+    """
+    start = content.lstrip()[:15].lower()
+    if start.startswith('<!doctype html') or start.startswith('<html'):
+        return 'view'
+    return 'raw'
+
+
+def upgrade_cache_db(db_connection):
+    """
+    Upgrade a cache database which was created by an older version of this
+    module to the current layout.
+    """
+    version = db_connection.execute('PRAGMA user_version').fetchone()[0]
+    with db_connection:
+        if version < 1:
+            # Revision information and content hashes of the pages.
+            for column in ('revid INTEGER', 'timestamp TEXT', 'hash TEXT'):
+                db_connection.execute(
+                    'ALTER TABLE pages ADD COLUMN {}'.format(column))
+            rows = db_connection.execute(
+                'SELECT url, content FROM pages').fetchall()
+            db_connection.executemany(
+                'UPDATE pages SET hash = ? WHERE url = ?',
+                [(content_hash(content), url) for (url, content) in rows])
+        if version < 2:
+            # Storage format of the page contents
+            db_connection.execute('ALTER TABLE pages ADD COLUMN format TEXT')
+        if version < 3:
+            # Pages are identified by their url and representation.
+            create_pages_table(db_connection, 'pages_v3')
+            for (url, content, revid, timestamp, page_hash,
+                 storage_format) in db_connection.execute(
+                     'SELECT url, content, revid, timestamp, hash, format ' +
+                     'FROM pages').fetchall():
+                db_connection.execute(
+                    'INSERT INTO pages_v3 VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (url, guess_action(decode_content(content,
+                                                      storage_format)),
+                     content, revid, timestamp, page_hash, storage_format))
+            db_connection.execute('DROP TABLE pages')
+            db_connection.execute('ALTER TABLE pages_v3 RENAME TO pages')
+        if version < 4:
+            create_link_index_tables(db_connection)
+        if version < 5:
+            create_results_table(db_connection)
+        if version < 6:
+            create_statistics_table(db_connection)
+        if version < 7:
+            create_snapshot_tables(db_connection)
+        if version < 8:
+            create_link_graph_table(db_connection)
+        if version < 9:
+            # The counts are stored for every book containing a page.
+            for index in ('statistics_item', 'statistics_book'):
+                db_connection.execute('DROP INDEX {}'.format(index))
+            db_connection.execute(
+                'ALTER TABLE statistics RENAME TO statistics_v8')
+            create_statistics_table(db_connection)
+            db_connection.execute(
+                'INSERT OR IGNORE INTO statistics(analyzer, item, book, ' +
+                'page, count) SELECT s.analyzer, s.item, b.name, s.page, ' +
+                's.count FROM statistics_v8 s JOIN books b ' +
+                'ON b.page_url = s.page')
+            db_connection.execute('DROP TABLE statistics_v8')
+        db_connection.execute(
+            'PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+
+
+def open_cache_db(cache):
+    """
+    Open the cache database and make sure it has the current layout.
+    Return the database connection.
+    The database uses a write-ahead log, so one connection can write while
+    others are reading (e.g. findings are stored in the result cache while
+    the pages are read). Databases with the current layout are only read
+    while they are opened, so opening them doesn't wait for writers.
     """
     db_connection = sqlite3.connect(cache)
-    reset_cache_db(db_connection)
-    # insert books into cache
+    version = db_connection.execute('PRAGMA user_version').fetchone()[0]
+    if version == SCHEMA_VERSION:
+        return db_connection
+    db_connection.execute('PRAGMA journal_mode = WAL')
+    tables = [row[0] for row in db_connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if 'pages' not in tables:
+        reset_cache_db(db_connection)
+    else:
+        upgrade_cache_db(db_connection)
+    return db_connection
+
+
+def insert_books(db_connection, books):
+    """Replace the cached books by the given books."""
     with db_connection:
+        db_connection.execute('DELETE FROM books')
         for book in books:
             for page in books[book]:
                 db_connection.execute(
                     'INSERT INTO books(name, page_url) VALUES (?, ?)',
                     (book, page))
-    # insert pages
+
+
+def insert_pages(db_connection, page_urls, revisions=None,
+                 storage_format='text', action='raw'):
+    """
+    Insert the given pages in the representation action into the cache
+    database. Pages which are already cached in this representation are
+    replaced. revisions optionally contains the revision metadata of the
+    pages (see bookinfo.fetch_pages_via_api). The contents are stored in
+    storage_format (see STORAGE_FORMATS).
+    """
+    if revisions is None:
+        revisions = {}
+    text_index = action == 'raw' and has_text_index(db_connection)
     with db_connection:
         for page_url in page_urls:
+            content = str(page_urls[page_url])
+            revision = revisions.get(page_url, {})
+            if text_index:
+                unindex_page_text(db_connection, 'url = ?', (page_url,))
             db_connection.execute(
-                'INSERT INTO pages(url, content) VALUES (?, ?)',
-                (page_url, str(page_urls[page_url])))
+                'INSERT INTO pages(url, action, content, revid, timestamp, ' +
+                'hash, format) VALUES (?, ?, ?, ?, ?, ?, ?) ' +
+                'ON CONFLICT(url, action) DO UPDATE SET ' +
+                'content = excluded.content, revid = excluded.revid, ' +
+                'timestamp = excluded.timestamp, hash = excluded.hash, ' +
+                'format = excluded.format',
+                (page_url, action, encode_content(content, storage_format),
+                 revision.get('revid'), revision.get('timestamp'),
+                 content_hash(content), storage_format))
+            if text_index:
+                index_page_text(db_connection, 'url = ?', (page_url,))
+
+
+@metrics.timed('cache_page_data')
+def cache_page_data(books, page_urls, cache='cache.db', revisions=None,
+                    storage_format='text', action='raw'):
+    """
+    Save the given books and page_urls in the representation action in the
+    cache database.
+    cache is the location of the cache database. revisions optionally
+    contains the revision metadata of the pages. The pages are stored in
+    storage_format.
+    The cached books and all cached pages in the representation action are
+    replaced. Pages cached in other representations are kept.
+    """
+    db_connection = open_cache_db(cache)
+    insert_books(db_connection, books)
+    insert_pages(db_connection, page_urls, revisions, storage_format, action)
+    remove_other_pages(db_connection, page_urls, action)
     db_connection.close()
 
 
-def read_cached_data(page_postprocessor=lambda string: string,
-                     cache='cache.db'):
+def remove_other_pages(db_connection, page_urls, action='raw'):
     """
-    Load cached books and pages.
-    You can apply page_postprocessor to each string associated to a page.
-    You can specify a different cache by changing the cache file.
-    Returns these dictionaries as a pair (books, pages).
+    Delete all pages cached in the representation action which are not in
+    page_urls.
     """
-    db_connection = sqlite3.connect(cache)
+    with db_connection:
+        cached_urls = [row[0] for row in db_connection.execute(
+            'SELECT url FROM pages WHERE action = ?', (action,))]
+        removed_urls = [url for url in cached_urls if url not in page_urls]
+        if action == 'raw' and has_text_index(db_connection):
+            for url in removed_urls:
+                unindex_page_text(db_connection, 'url = ?', (url,))
+        db_connection.executemany(
+            'DELETE FROM pages WHERE url = ? AND action = ?',
+            [(url, action) for url in removed_urls])
+
+
+def remove_pages(page_urls, cache='cache.db'):
+    """
+    Delete the pages with the given urls in all representations and their
+    item counts from the cache database, e.g. because they were deleted or
+    moved in the wiki. Return the number of deleted pages.
+    """
+    db_connection = open_cache_db(cache)
+    with db_connection:
+        if has_text_index(db_connection):
+            for url in page_urls:
+                unindex_page_text(db_connection, 'url = ?', (url,))
+        deleted = 0
+        for url in page_urls:
+            deleted += db_connection.execute(
+                'DELETE FROM pages WHERE url = ?', (url,)).rowcount
+        db_connection.executemany(
+            'DELETE FROM statistics WHERE page = ?',
+            [(url,) for url in page_urls])
+    db_connection.close()
+    return deleted
+
+
+def has_pages(cache='cache.db', action='raw'):
+    """Check whether the cache contains pages in the representation action."""
+    db_connection = open_cache_db(cache)
+    row = db_connection.execute(
+        'SELECT 1 FROM pages WHERE action = ? LIMIT 1', (action,)).fetchone()
+    db_connection.close()
+    return row is not None
+
+
+def convert_storage_format(storage_format, cache='cache.db'):
+    """
+    Convert all cached pages into storage_format and shrink the database
+    file afterwards. Return the number of converted pages.
+    """
+    db_connection = open_cache_db(cache)
+    rows = db_connection.execute(
+        'SELECT url, action, content, format FROM pages ' +
+        'WHERE coalesce(format, \'text\') != ?', (storage_format,))
+    converted = 0
+    with db_connection:
+        for (url, action, content, old_format) in rows.fetchall():
+            db_connection.execute(
+                'UPDATE pages SET content = ?, format = ? ' +
+                'WHERE url = ? AND action = ?',
+                (encode_content(decode_content(content, old_format),
+                                storage_format),
+                 storage_format, url, action))
+            converted += 1
+    db_connection.execute('VACUUM')
+    text_index = has_text_index(db_connection)
+    db_connection.close()
+    if text_index:
+        # VACUUM may renumber the rowids of the pages.
+        create_text_index(cache)
+    return converted
+
+
+def read_page_hashes(cache='cache.db', action='raw'):
+    """
+    Return a dictionary mapping the urls of the pages cached in the
+    representation action to the hashes of their contents.
+    """
+    db_connection = open_cache_db(cache)
+    hashes = dict(db_connection.execute(
+        'SELECT url, hash FROM pages WHERE action = ?', (action,)))
+    db_connection.close()
+    return hashes
+
+
+def read_cached_revisions(cache='cache.db', action='raw'):
+    """
+    Return a dictionary containing the revision id and timestamp of every
+    page cached in the representation action as pair indexed by the page
+    urls. Pages without known revision are left out.
+    """
+    db_connection = open_cache_db(cache)
+    revisions = {url: (revid, timestamp) for (url, revid, timestamp)
+                 in db_connection.execute(
+                     'SELECT url, revid, timestamp FROM pages ' +
+                     'WHERE revid IS NOT NULL AND action = ?', (action,))}
+    db_connection.close()
+    return revisions
+
+
+@metrics.timed('update_page_data')
+def update_page_data(books, page_urls, cache='cache.db', revisions=None,
+                     storage_format='text', action='raw'):
+    """
+    Update the cache database: Replace the cached books by books, insert or
+    replace the pages in page_urls in the representation action and delete
+    all pages which don't belong to any book anymore. New pages are stored in
+    storage_format.
+    Return the number of deleted pages.
+    """
+    db_connection = open_cache_db(cache)
+    insert_books(db_connection, books)
+    insert_pages(db_connection, page_urls, revisions, storage_format, action)
+    with db_connection:
+        if has_text_index(db_connection):
+            unindex_page_text(db_connection, 'url NOT IN ' +
+                              '(SELECT page_url FROM books)')
+        deleted = db_connection.execute(
+            'DELETE FROM pages WHERE url NOT IN ' +
+            '(SELECT page_url FROM books)').rowcount
+    db_connection.close()
+    return deleted
+
+
+def read_books(cache='cache.db'):
+    """
+    Load the cached books. Return a dictionary containing the list of page
+    urls of every book indexed by the book names.
+    """
+    db_connection = open_cache_db(cache)
     cursor = db_connection.execute('SELECT name, page_url FROM books')
-    # Read books
     books = {}
     for row in cursor:
         if row[0] in books:
             books[row[0]].append(row[1])
         else:
             books[row[0]] = [row[1]]
-    # Read pages
-    cursor = db_connection.execute('SELECT url, content FROM pages')
-    pages = {}
-    for row in cursor:
-        pages[row[0]] = page_postprocessor(row[1])
     db_connection.close()
+    return books
+
+
+def query_pages(db_connection, columns, action='raw', book=None):
+    """
+    Return a cursor over the given columns of the pages cached in the
+    representation action (of the pages of book if given) in the order of
+    their urls.
+    """
+    query = 'SELECT {} FROM pages WHERE action = ? '.format(columns)
+    parameters = (action,)
+    if book is not None:
+        query += 'AND url IN (SELECT page_url FROM books WHERE name = ?) '
+        parameters = (action, book)
+    return db_connection.execute(query + 'ORDER BY url', parameters)
+
+
+def iter_pages(cache='cache.db', book=None,
+               page_postprocessor=lambda string: string, action='raw',
+               urls=None):
+    """
+    Generator yielding the pages cached in the representation action as
+    (url, content) pairs straight from the database in the order of their
+    urls, so runs over the same cache see the pages in the same order. Only
+    one page is held in memory at a time. Compressed pages are decompressed
+    on the fly.
+    If book is given, only the pages of this book are yielded. If urls is
+    given, only the pages in this set are read and yielded.
+    You can apply page_postprocessor to each string associated to a page.
+    """
+    db_connection = open_cache_db(cache)
+    try:
+        if urls is None:
+            cursor = query_pages(db_connection, 'url, content, format',
+                                 action, book)
+        else:
+            # Only the contents of the wanted pages are read.
+            wanted = [url for (url,) in query_pages(db_connection, 'url',
+                                                    action, book)
+                      if url in urls]
+            cursor = ((url,) + row for url in wanted
+                      for row in db_connection.execute(
+                          'SELECT content, format FROM pages ' +
+                          'WHERE url = ? AND action = ?', (url, action)))
+        for (url, content, storage_format) in cursor:
+            metrics.count('pages_read')
+            yield (url, page_postprocessor(
+                decode_content(content, storage_format)))
+    finally:
+        db_connection.close()
+
+
+class CachedPages:
+    """
+    Iterable of the (url, content) pairs of the pages cached in the
+    representation action, which are read by iter_pages with the given
+    arguments. Since it knows where the pages come from, the pages can also
+    be read from the cache in other ways, e.g. from a corpus file exported
+    from the cache (see corpus_file.cached_corpus) if page_postprocessor is
+    None.
+    """
+
+    def __init__(self, cache='cache.db', book=None, page_postprocessor=None,
+                 action='raw', urls=None):
+        self.cache = cache
+        self.book = book
+        self.page_postprocessor = page_postprocessor
+        self.action = action
+        self.urls = urls
+
+    def __iter__(self):
+        return metrics.timed_iter('read_cached_pages', iter_pages(
+            self.cache, self.book,
+            self.page_postprocessor or (lambda string: string), self.action,
+            self.urls))
+
+    def page_urls(self):
+        """
+        Return the urls of the pages in the order of the iteration without
+        reading the pages.
+        """
+        db_connection = open_cache_db(self.cache)
+        urls = [url for (url,) in query_pages(db_connection, 'url',
+                                              self.action, self.book)
+                if self.urls is None or url in self.urls]
+        db_connection.close()
+        return urls
+
+
+@metrics.timed('read_cached_data')
+def read_cached_data(page_postprocessor=lambda string: string,
+                     cache='cache.db', action='raw'):
+    """
+    Load cached books and pages in the representation action.
+    You can apply page_postprocessor to each string associated to a page.
+    You can specify a different cache by changing the cache file.
+    Returns these dictionaries as a pair (books, pages).
+    """
+    books = read_books(cache)
+    pages = dict(iter_pages(cache, page_postprocessor=page_postprocessor,
+                            action=action))
     return (books, pages)
+
+
+def store_link_index(index, page_hashes, cache='cache.db'):
+    """
+    Store the link index entries in the cache. index maps page urls to
+    (title, ids, links, redlinks) tuples, page_hashes maps them to the hashes
+    of the indexed page contents.
+    """
+    db_connection = open_cache_db(cache)
+    with db_connection:
+        for url in index:
+            (title, ids, links, redlinks) = index[url]
+            for table in ('link_index', 'anchors', 'links'):
+                db_connection.execute(
+                    'DELETE FROM {} WHERE url = ?'.format(table), (url,))
+            db_connection.execute(
+                'INSERT INTO link_index(url, hash, title) VALUES (?, ?, ?)',
+                (url, page_hashes[url], title))
+            db_connection.executemany(
+                'INSERT INTO anchors(url, anchor) VALUES (?, ?)',
+                [(url, anchor) for anchor in ids])
+            db_connection.executemany(
+                'INSERT INTO links(url, position, href, redlink) ' +
+                'VALUES (?, ?, ?, ?)',
+                [(url, position, href, 0)
+                 for (position, href) in enumerate(links)] +
+                [(url, position, href, 1)
+                 for (position, href) in enumerate(redlinks)])
+    db_connection.close()
+
+
+def remove_link_index(urls, cache='cache.db'):
+    """Delete the link index entries of the pages with the given urls."""
+    db_connection = open_cache_db(cache)
+    with db_connection:
+        for table in ('link_index', 'anchors', 'links'):
+            db_connection.executemany(
+                'DELETE FROM {} WHERE url = ?'.format(table),
+                [(url,) for url in urls])
+    db_connection.close()
+
+
+def read_link_index(cache='cache.db', hashes=None):
+    """
+    Load the valid entries of the link index, i.e. the entries whose hash
+    matches the hash of the cached rendered page. Return a dictionary mapping
+    the page urls to (title, ids, links, redlinks) tuples. If hashes is
+    given, it is filled with the hashes of the indexed pages.
+    """
+    if hashes is None:
+        hashes = {}
+    db_connection = open_cache_db(cache)
+    valid = 'SELECT i.url FROM link_index i JOIN pages p ' + \
+        'ON p.url = i.url AND p.action = \'view\' AND p.hash = i.hash'
+    index = {}
+    for (url, title, page_hash) in db_connection.execute(
+            'SELECT url, title, hash FROM link_index WHERE url IN ({})'.format(
+                valid)):
+        index[url] = (title, set(), [], [])
+        hashes[url] = page_hash
+    for (url, anchor) in db_connection.execute(
+            'SELECT url, anchor FROM anchors WHERE url IN ({})'.format(valid)):
+        index[url][1].add(anchor)
+    for (url, href, redlink) in db_connection.execute(
+            ('SELECT url, href, redlink FROM links WHERE url IN ({}) ' +
+             'ORDER BY url, redlink, position').format(valid)):
+        index[url][3 if redlink else 2].append(href)
+    db_connection.close()
+    return index
+
+
+def create_text_index(cache='cache.db'):
+    """
+    Create or rebuild the text index over the WikiText of the cached pages.
+    Raise sqlite3.OperationalError if SQLite lacks FTS5 or its trigram
+    tokenizer. Return the number of indexed pages.
+    """
+    db_connection = open_cache_db(cache)
+    with db_connection:
+        db_connection.execute('DROP TABLE IF EXISTS {}'.format(TEXT_INDEX))
+        db_connection.execute(
+            ('CREATE VIRTUAL TABLE {} USING fts5(content, ' +
+             'tokenize = \'trigram\', content = \'\', detail = none)').format(
+                 TEXT_INDEX))
+        index_page_text(db_connection, '1')
+    indexed = db_connection.execute(
+        'SELECT count(*) FROM pages WHERE action = \'raw\'').fetchone()[0]
+    db_connection.close()
+    return indexed
+
+
+def text_index_query(literal):
+    """
+    Return the FTS5 query matching the pages which contain all trigrams of
+    literal. The index doesn't store positions and ignores case, so the
+    matching pages are candidates which may not contain literal itself.
+    """
+    trigrams = sorted({literal[i:i + TRIGRAM_LENGTH] for i in
+                       range(len(literal) - TRIGRAM_LENGTH + 1)})
+    return ' AND '.join('"{}"'.format(trigram.replace('"', '""'))
+                        for trigram in trigrams)
+
+
+def find_candidate_pages(literals, cache='cache.db'):
+    """
+    Use the text index to find the WikiText pages which may contain one of
+    the literals. Return the set of their urls. Every page containing one of
+    the literals is in this set, but not every page in it contains one.
+    Return None if the candidates can't be determined, i.e. if the cache has
+    no text index or a literal is shorter than TRIGRAM_LENGTH.
+    """
+    if not literals or min(map(len, literals)) < TRIGRAM_LENGTH:
+        return None
+    db_connection = open_cache_db(cache)
+    try:
+        if not has_text_index(db_connection):
+            return None
+        query = ' OR '.join('({})'.format(text_index_query(literal))
+                            for literal in literals)
+        return {row[0] for row in db_connection.execute(
+            ('SELECT url FROM pages WHERE action = \'raw\' AND rowid IN ' +
+             '(SELECT rowid FROM {0} WHERE {0} MATCH ?)').format(TEXT_INDEX),
+            (query,))}
+    finally:
+        db_connection.close()
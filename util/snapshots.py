@@ -0,0 +1,199 @@
+"""
+Module for keeping named snapshots of the cached books and pages and
+comparing them.
+
+The contents of the pages are stored once in the table blobs of the cache
+database, identified by their hashes. A snapshot only maps the urls of its
+pages to the hashes of their contents and stores the books it was taken of.
+Thus a snapshot only adds the contents which changed since the earlier
+snapshots to the cache. Snapshots are kept when the cache is rebuilt or
+updated, so the project can be compared with its state at an earlier run.
+
+Wherever a snapshot name is expected, None stands for the current pages of
+the cache.
+"""
+
+import collections
+import time
+
+from . import site_caching
+from .analysis import allowed_pages
+from .result_cache import ResultCache
+
+
+def take_snapshot(name, cache='cache.db'):
+    """
+    Store the cached books and pages as snapshot name. An existing snapshot
+    with this name is replaced. Return the number of pages in the snapshot
+    and the number of contents which weren't stored before.
+    """
+    db_connection = site_caching.open_cache_db(cache)
+    with db_connection:
+        remove_snapshot(db_connection, name)
+        new_blobs = db_connection.execute(
+            'INSERT OR IGNORE INTO blobs(hash, content, format) ' +
+            'SELECT hash, content, format FROM pages').rowcount
+        db_connection.execute(
+            'INSERT INTO snapshots(name, created) VALUES (?, ?)',
+            (name, time.time()))
+        pages = db_connection.execute(
+            'INSERT INTO snapshot_pages(snapshot, url, action, hash, revid) ' +
+            'SELECT ?, url, action, hash, revid FROM pages', (name,)).rowcount
+        db_connection.execute(
+            'INSERT INTO snapshot_books(snapshot, name, page_url) ' +
+            'SELECT ?, name, page_url FROM books', (name,))
+    db_connection.close()
+    return (pages, new_blobs)
+
+
+def remove_snapshot(db_connection, name):
+    """Delete the rows of the snapshot name, but keep its contents."""
+    for table in ('snapshot_pages', 'snapshot_books'):
+        db_connection.execute(
+            'DELETE FROM {} WHERE snapshot = ?'.format(table), (name,))
+    db_connection.execute('DELETE FROM snapshots WHERE name = ?', (name,))
+
+
+def drop_snapshot(name, cache='cache.db'):
+    """
+    Delete the snapshot name together with the contents which no other
+    snapshot refers to. Return the number of deleted contents.
+    """
+    db_connection = site_caching.open_cache_db(cache)
+    with db_connection:
+        remove_snapshot(db_connection, name)
+        deleted = db_connection.execute(
+            'DELETE FROM blobs WHERE hash NOT IN ' +
+            '(SELECT hash FROM snapshot_pages)').rowcount
+    db_connection.close()
+    return deleted
+
+
+def list_snapshots(cache='cache.db'):
+    """
+    Return the snapshots as list of (name, creation time, number of pages)
+    tuples, oldest first.
+    """
+    db_connection = site_caching.open_cache_db(cache)
+    rows = db_connection.execute(
+        'SELECT s.name, s.created, ' +
+        '(SELECT count(*) FROM snapshot_pages p WHERE p.snapshot = s.name) ' +
+        'FROM snapshots s ORDER BY s.created').fetchall()
+    db_connection.close()
+    return rows
+
+
+def has_snapshot(name, cache='cache.db'):
+    """Check whether the snapshot name exists."""
+    if name is None:
+        return True
+    db_connection = site_caching.open_cache_db(cache)
+    row = db_connection.execute('SELECT 1 FROM snapshots WHERE name = ?',
+                                (name,)).fetchone()
+    db_connection.close()
+    return row is not None
+
+
+def page_hashes(name, cache='cache.db', action='raw'):
+    """
+    Return a dictionary mapping the urls of the pages in the representation
+    action of the snapshot name to the hashes of their contents.
+    """
+    if name is None:
+        return site_caching.read_page_hashes(cache, action)
+    db_connection = site_caching.open_cache_db(cache)
+    hashes = dict(db_connection.execute(
+        'SELECT url, hash FROM snapshot_pages WHERE snapshot = ? AND ' +
+        'action = ?', (name, action)))
+    db_connection.close()
+    return hashes
+
+
+def read_books(name, cache='cache.db'):
+    """
+    Return the books of the snapshot name as dictionary containing the list
+    of page urls of every book indexed by the book names.
+    """
+    if name is None:
+        return site_caching.read_books(cache)
+    db_connection = site_caching.open_cache_db(cache)
+    books = {}
+    for (book, url) in db_connection.execute(
+            'SELECT name, page_url FROM snapshot_books WHERE snapshot = ?',
+            (name,)):
+        books.setdefault(book, []).append(url)
+    db_connection.close()
+    return books
+
+
+def read_content(page_hash, cache='cache.db'):
+    """
+    Return the content with the hash page_hash from the blobs of the
+    snapshots or the cached pages. Return None if it is unknown.
+    """
+    db_connection = site_caching.open_cache_db(cache)
+    row = db_connection.execute(
+        'SELECT content, format FROM blobs WHERE hash = ?',
+        (page_hash,)).fetchone()
+    if row is None:
+        row = db_connection.execute(
+            'SELECT content, format FROM pages WHERE hash = ?',
+            (page_hash,)).fetchone()
+    db_connection.close()
+    if row is None:
+        return None
+    return site_caching.decode_content(*row)
+
+
+def diff_pages(old, new, cache='cache.db', action='raw'):
+    """
+    Compare the pages in the representation action of the snapshots old and
+    new. Return the sorted lists of the urls of the added, removed and
+    changed pages together with the hashes of the pages in both snapshots.
+    """
+    old_hashes = page_hashes(old, cache, action)
+    new_hashes = page_hashes(new, cache, action)
+    added = sorted(url for url in new_hashes if url not in old_hashes)
+    removed = sorted(url for url in old_hashes if url not in new_hashes)
+    changed = sorted(url for url in new_hashes if url in old_hashes and
+                     new_hashes[url] != old_hashes[url])
+    return (added, removed, changed, old_hashes, new_hashes)
+
+
+def diff_findings(analyzer, old, new, cache='cache.db'):
+    """
+    Run the analyzer over the added, removed and changed pages between the
+    snapshots old and new. Findings of contents which were analysed before
+    are taken from the result cache. Return the new and the resolved
+    findings as sorted lists of (url, description) pairs, where the findings
+    are described by analyzer.describe_findings.
+    """
+    (added, removed, changed, old_hashes, new_hashes) = diff_pages(
+        old, new, cache)
+    allowed = [allowed_pages(analyzer, read_books(name, cache))
+               for name in (old, new)]
+    result_cache = ResultCache(cache)
+
+    def descriptions(url, hashes, page_filter):
+        if url not in hashes or \
+           (page_filter is not None and url not in page_filter):
+            return collections.Counter()
+        findings = result_cache.get(hashes[url], analyzer)
+        if findings is None:
+            findings = analyzer.extract(read_content(hashes[url], cache))
+            result_cache.put(hashes[url], analyzer, findings)
+        return collections.Counter(analyzer.describe_findings(findings))
+
+    new_findings = []
+    resolved_findings = []
+    for url in sorted(added + removed + changed):
+        old_descriptions = descriptions(url, old_hashes, allowed[0])
+        new_descriptions = descriptions(url, new_hashes, allowed[1])
+        new_findings.extend(
+            (url, description) for description
+            in sorted((new_descriptions - old_descriptions).elements()))
+        resolved_findings.extend(
+            (url, description) for description
+            in sorted((old_descriptions - new_descriptions).elements()))
+    result_cache.close()
+    return (new_findings, resolved_findings)
@@ -0,0 +1,137 @@
+"""
+Module for aggregating the items counted by the analyzers (e.g. templates or
+TeX macros) per page and book.
+
+The counts are stored in the table statistics of the cache database as rows
+(analyzer, item, book, page, count). A page belonging to several books has a
+row for every book, so the queries over all books count every page only
+once. The counts are updated by run_analyzers and can be queried without
+analysing the pages again, e.g. by cache_tool.py.
+"""
+
+from . import result_cache, site_caching
+
+
+class StatisticsStore:
+    """
+    Store of the item counts of the analyzers with the given names in the
+    cache database cache. The counts are written in batches of the pages
+    whose counts reach result_cache.FLUSH_SIZE rows (or of as many pages),
+    so only a bounded number of them is held in memory.
+    """
+
+    def __init__(self, analyzer_names, cache='cache.db'):
+        self.db_connection = site_caching.open_cache_db(cache)
+        self.analyzers = list(analyzer_names)
+        self.pages = set()
+        self.rows = []
+
+    def add_page(self, url):
+        """
+        Mark the page url as analysed. Its stored counts are replaced by the
+        counts added for it (if any). The counts of the previous pages are
+        written first if the batch is full, so the counts of a page are
+        always written together.
+        """
+        if len(self.rows) >= result_cache.FLUSH_SIZE or \
+           len(self.pages) >= result_cache.FLUSH_SIZE:
+            self.flush()
+        self.pages.add(url)
+
+    def add(self, analyzer_name, url, books, counts):
+        """
+        Add the counts of the analyzer on the page url, which belongs to the
+        list of books. counts is a dictionary mapping the items to their
+        counts.
+        """
+        self.pages.add(url)
+        self.rows.extend((analyzer_name, item, book, url, count)
+                         for book in books
+                         for (item, count) in counts.items())
+
+    def flush(self):
+        """
+        Write the counts to the database. The previous counts of the
+        analyzers on the analysed pages are removed.
+        """
+        with self.db_connection:
+            self.db_connection.executemany(
+                'DELETE FROM statistics WHERE analyzer = ? AND page = ?',
+                [(name, url) for name in self.analyzers
+                 for url in self.pages])
+            self.db_connection.executemany(
+                'INSERT OR REPLACE INTO statistics(analyzer, item, book, ' +
+                'page, count) VALUES (?, ?, ?, ?, ?)', self.rows)
+        self.pages = set()
+        self.rows = []
+
+    def close(self):
+        """
+        Flush the store, remove the counts on pages which don't belong to any
+        book anymore and close the database.
+        """
+        self.flush()
+        with self.db_connection:
+            self.db_connection.execute(
+                'DELETE FROM statistics WHERE page NOT IN ' +
+                '(SELECT page_url FROM books)')
+        self.db_connection.close()
+
+
+def query(cache, statement, params):
+    """Execute the SQL statement on the cache and return all rows."""
+    db_connection = site_caching.open_cache_db(cache)
+    rows = db_connection.execute(statement, params).fetchall()
+    db_connection.close()
+    return rows
+
+
+def top_items(analyzer_name, limit=20, book=None, cache='cache.db'):
+    """
+    Return the limit most frequent items of the analyzer as list of
+    (item, count, number of pages) tuples. If book is given, only the pages
+    of this book are taken into account. Pages belonging to several books
+    are counted once.
+    """
+    if book is None:
+        condition = 'analyzer = ?'
+        params = (analyzer_name,)
+    else:
+        condition = 'analyzer = ? AND book = ?'
+        params = (analyzer_name, book)
+    return query(
+        cache, ('SELECT item, SUM(count) AS total, COUNT(*) FROM ' +
+                '(SELECT DISTINCT item, page, count FROM statistics ' +
+                'WHERE {}) GROUP BY item ' +
+                'ORDER BY total DESC, item LIMIT ?').format(condition),
+        (*params, limit))
+
+
+def item_pages(analyzer_name, item, cache='cache.db'):
+    """
+    Return the pages on which the analyzer counted item as list of
+    (page, books, count) tuples, most frequent first. books contains the
+    books of the page separated by commas.
+    """
+    return query(
+        cache, 'SELECT page, GROUP_CONCAT(book, \', \'), MAX(count) AS total ' +
+        'FROM statistics WHERE analyzer = ? AND item = ? GROUP BY page ' +
+        'ORDER BY total DESC, page', (analyzer_name, item))
+
+
+def book_counts(analyzer_name, item=None, cache='cache.db'):
+    """
+    Return the counts of the analyzer per book as list of (book, count,
+    number of pages) tuples. Pages belonging to several books are counted
+    in every one of them. If item is given, only this item is counted.
+    """
+    if item is None:
+        condition = 'analyzer = ?'
+        params = (analyzer_name,)
+    else:
+        condition = 'analyzer = ? AND item = ?'
+        params = (analyzer_name, item)
+    return query(
+        cache, ('SELECT book, SUM(count) AS total, COUNT(DISTINCT page) ' +
+                'FROM statistics WHERE {} GROUP BY book ' +
+                'ORDER BY total DESC, book').format(condition), params)
@@ -0,0 +1,226 @@
+"""
+Module for tokenizing the WikiText of the pages of the Mathe für Nicht-Freaks
+project.
+
+The tokenizer makes a single linear pass over a page and emits typed spans
+for the constructs the diagnostic scripts are interested in: math, ref and
+gallery environments, tables, section markers, marked sections, #lst
+transclusions and template calls. Nested tables and templates are tracked
+with a stack. Comments and the contents of math, gallery, nowiki and pre
+environments are skipped, so nothing inside of them is mistaken for markup.
+"""
+
+import functools
+import re
+
+# Kinds of the emitted spans
+MATH = 'math'
+REF = 'ref'
+GALLERY = 'gallery'
+TABLE = 'table'
+SECTION_BEGIN = 'section_begin'
+SECTION_END = 'section_end'
+SECTION = 'section'
+TRANSCLUSION = 'transclusion'
+TEMPLATE = 'template'
+# Template parameters are tracked, but not emitted.
+PARAMETER = 'parameter'
+
+# Environments whose contents are not tokenized. They are emitted as spans
+# unless their kind is None.
+OPAQUE_TAGS = {'math': MATH, 'gallery': GALLERY, 'nowiki': None, 'pre': None}
+CLOSE_REGEXES = {tag: re.compile('</{}\\s*>'.format(tag), re.IGNORECASE)
+                 for tag in OPAQUE_TAGS}
+
+# The lookahead lets the regex engine skip quickly to the next character which
+# may start a token.
+TOKEN_REGEX = re.compile(
+    '(?=[<{}|])(?:(?P<comment><!--)'
+    '|<(?P<open_tag>math|ref|gallery|nowiki|pre)(?=[\\s/>])[^>]*?'
+    '(?P<self_closing>/?)>'
+    '|</(?P<close_tag>ref)\\s*>'
+    '|<section\\s+(?P<marker>begin|end)\\s*=\\s*'
+    '(?P<section_name>"[^"]*"|\'[^\']*\'|[^\\s/>]+)[^>]*>'
+    '|(?P<parameter_open>\\{\\{\\{)'
+    '|(?P<parameter_close>\\}\\}\\})'
+    '|(?P<template_open>\\{\\{)'
+    '|(?P<template_close>\\}\\})'
+    '|(?P<table_open>\\{\\|)'
+    '|(?P<table_close>\\|\\})(?!\\}))',
+    re.IGNORECASE)
+
+TRANSCLUSION_REGEX = re.compile('\\s*#lst\\s*:', re.IGNORECASE)
+
+
+class Span:
+    """
+    Typed span of a page's WikiText:
+    kind: the kind of the span (e.g. MATH or TABLE)
+    start, end: offsets of the whole span including its delimiters
+    inner_start, inner_end: offsets of the span's content
+    name: the name of the template, the transcluded page or the section
+    depth: number of enclosing spans of the same kind
+    """
+    __slots__ = ('kind', 'start', 'end', 'inner_start', 'inner_end', 'name',
+                 'depth')
+
+    def __init__(self, kind, start, end, inner_start, inner_end, name=None,
+                 depth=0):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.inner_start = inner_start
+        self.inner_end = inner_end
+        self.name = name
+        self.depth = depth
+
+    def text(self, string):
+        """Return the whole span in string including its delimiters."""
+        return string[self.start:self.end]
+
+    def inner(self, string):
+        """Return the content of the span in string."""
+        return string[self.inner_start:self.inner_end]
+
+
+def at_line_start(string, position):
+    """Check whether only blanks precede position in its line."""
+    line_start = string.rfind('\n', 0, position) + 1
+    return not string[line_start:position].strip(' \t')
+
+
+def close_opaque(string, tag, start, inner_start):
+    """
+    Return the span of the comment (if tag is None) or the opaque environment
+    tag whose content starts at inner_start or None if it isn't closed.
+    """
+    if tag is None:
+        inner_end = string.find('-->', inner_start)
+        end = inner_end + 3
+    else:
+        match = CLOSE_REGEXES[tag].search(string, inner_start)
+        (inner_end, end) = match.span() if match else (-1, -1)
+    if inner_end < 0:
+        return None
+    return Span(OPAQUE_TAGS.get(tag), start, end, inner_start, inner_end)
+
+
+def template_span(string, construct, inner_end, end, depth):
+    """
+    Return the span of the template call or transclusion opened by
+    construct.
+    """
+    (_, start, inner_start) = construct
+    pipe = string.find('|', inner_start, inner_end)
+    name = string[inner_start:pipe if pipe >= 0 else inner_end].strip()
+    transclusion = TRANSCLUSION_REGEX.match(string, inner_start, inner_end)
+    if transclusion:
+        return Span(TRANSCLUSION, start, end, transclusion.end(), inner_end,
+                    name[transclusion.end() - inner_start:].strip(), depth)
+    return Span(TEMPLATE, start, end, inner_start, inner_end, name, depth)
+
+
+def unwind(stack, kind):
+    """
+    Remove the innermost open construct of the given kind and all unclosed
+    constructs within it from the stack. Return the removed construct and the
+    number of constructs of this kind still open or (None, 0) if no construct
+    of this kind is open. Like MediaWiki, constructs opened outside of a
+    reference can't be closed inside of it.
+    """
+    for index in range(len(stack) - 1, -1, -1):
+        if stack[index][0] == kind:
+            construct = stack[index]
+            del stack[index:]
+            return (construct, sum(1 for c in stack if c[0] == kind))
+        if stack[index][0] == REF:
+            break
+    return (None, 0)
+
+
+def tokenize(string):
+    """
+    Generator yielding the spans of the WikiText string in the order in which
+    they end. Constructs which are never closed are not emitted.
+    """
+    # Open constructs as (kind, start, inner_start) triples
+    stack = []
+    # Open sections as (start, inner_start) pairs indexed by their names
+    sections = {}
+    position = 0
+    while True:
+        match = TOKEN_REGEX.search(string, position)
+        if match is None:
+            return
+        (start, position) = match.span()
+        if match.group('comment') or match.group('open_tag'):
+            tag = match.group('open_tag')
+            tag = tag.lower() if tag else None
+            if match.group('self_closing'):
+                continue
+            if tag == 'ref':
+                stack.append((REF, start, position))
+                continue
+            span = close_opaque(string, tag, start, position)
+            if span is None:
+                if tag is None:
+                    # An unclosed comment hides the rest of the page.
+                    return
+                continue
+            position = span.end
+            if span.kind is not None:
+                yield span
+        elif match.group('close_tag'):
+            (construct, _) = unwind(stack, REF)
+            if construct:
+                yield Span(REF, construct[1], position, construct[2], start)
+        elif match.group('marker'):
+            name = match.group('section_name').strip('"\'')
+            if match.group('marker').lower() == 'begin':
+                sections[name] = (start, position)
+                yield Span(SECTION_BEGIN, start, position, position, position,
+                           name)
+            else:
+                yield Span(SECTION_END, start, position, start, start, name)
+                if name in sections:
+                    (begin, inner_start) = sections.pop(name)
+                    yield Span(SECTION, begin, position, inner_start, start,
+                               name)
+        elif match.group('parameter_open'):
+            stack.append((PARAMETER, start, position))
+        elif match.group('template_open'):
+            stack.append((TEMPLATE, start, position))
+        elif match.group('table_open'):
+            if at_line_start(string, start):
+                stack.append((TABLE, start, position))
+        elif match.group('table_close'):
+            (construct, depth) = (unwind(stack, TABLE)
+                                  if at_line_start(string, start)
+                                  else (None, 0))
+            if construct:
+                yield Span(TABLE, construct[1], position, construct[2],
+                           start, None, depth)
+        elif match.group('parameter_close') and stack and \
+                stack[-1][0] == PARAMETER:
+            stack.pop()
+        else:
+            # The end of a template, possibly followed by a brace
+            position = start + 2
+            (construct, depth) = unwind(stack, TEMPLATE)
+            if construct:
+                yield template_span(string, construct, start, position, depth)
+
+
+@functools.lru_cache(maxsize=1)
+def page_spans(string):
+    """
+    Return the spans of the WikiText string as tuple ordered by their start.
+    The spans of the last page are kept, so all analyzers of a page share a
+    single pass of the tokenizer.
+    """
+    return tuple(sorted(tokenize(string), key=lambda span: span.start))
+
+
+def spans_of_kind(string, kind):
+    """Return the spans of the given kind in string ordered by their start."""
+    return [span for span in page_spans(string) if span.kind == kind]
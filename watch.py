@@ -0,0 +1,298 @@
+"""
+Module for keeping the results of the diagnostic analyses up to date while the
+Mathe für Nicht-Freaks project is edited.
+
+When run as a standalone script this loads the pages like diagnostics.py and
+runs the selected analyzers once. Afterwards it polls the recent changes of
+the wiki. Pages which were edited since the last poll are downloaded again,
+the cache is updated and the analyses are run again. The findings of the
+unchanged pages are taken from the result cache, so only the changed pages
+are analysed. Edits of the sitemap update the books and their pages. Pages
+which were deleted or moved away are removed from the cache. When the links
+are checked, the rendered pages linking to a changed page are downloaded
+again as well, since e.g. their links to a deleted page become red links.
+"""
+
+import sys
+import getopt
+import time
+
+from util import analysis, bookinfo, link_graph, parallel, record_writer
+from util import site_caching
+
+import bad_finder
+# The finders register their analyzers when they are imported.
+# pylint: disable=unused-import
+import boxen_finder
+import double_usage_finder
+import gallery_finder
+import ref_finder
+import table_finder
+import tex_macro_finder
+# pylint: enable=unused-import
+
+OPTIONS = 'A:f:i:n:L:'
+
+# Default number of seconds between two polls of the recent changes
+DEFAULT_INTERVAL = 30
+
+# Format of the timestamps of the MediaWiki API
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# Log entries (type, action) of the recent changes after which no page exists
+# under the title of the entry anymore
+REMOVING_LOG_ENTRIES = {('delete', 'delete'), ('move', 'move'),
+                        ('move', 'move_redir')}
+
+
+class Watcher:
+    """
+    Keep the pages cached in the cache database cache and the results of the
+    analyzers with the given names up to date. If logfile is given, the
+    links of the pages are checked as well and the bad links are written to
+    logfile (see bad_finder.py). Up to jobs pages are downloaded
+    concurrently, at most rate_limit requests per second are sent to the
+    wiki. The pages are analysed by a pool of processes worker processes.
+    """
+
+    def __init__(self, names, cache, output_format='text', logfile=None,
+                 jobs=1, storage_format='text',
+                 rate_limit=bookinfo.DEFAULT_RATE_LIMIT, processes=1):
+        self.names = names
+        self.cache = cache
+        self.output_format = output_format
+        self.logfile = logfile
+        self.jobs = jobs
+        self.processes = processes
+        self.storage_format = storage_format
+        self.rate_limiter = bookinfo.RateLimiter(rate_limit)
+        self.rate_limit = rate_limit
+        self.books = {}
+        # Timestamp of the latest change processed and the ids of the changes
+        # with this timestamp, which are returned by the next poll again.
+        self.since = time.strftime(TIMESTAMP_FORMAT, time.gmtime())
+        self.seen_changes = set()
+
+    def analyze(self, pages, lookup_first=False):
+        """
+        Run the analyzers over pages, an iterable of (url, content) pairs,
+        and write their results. If lookup_first is True, pages are the
+        cached pages and only the pages whose findings aren't in the result
+        cache are read and analysed (see analysis.run_analyzers).
+        """
+        analyzers = [analysis.ANALYZERS[name]() for name in self.names]
+        for analyzer in analyzers:
+            analyzer.output_format = self.output_format
+        analysis.run_analyzers(analyzers, pages, self.books, cache=self.cache,
+                               processes=self.processes,
+                               lookup_first=lookup_first)
+
+    def check_links(self, html_pages):
+        """
+        Update the link index with html_pages, an iterable of (url, html)
+        pairs, store the graph of the links and check the links of all
+        books.
+        """
+        index = bad_finder.build_link_index(html_pages, self.cache,
+                                            self.processes, self.books)
+        bad_finder.store_link_graph(self.books, index, self.cache)
+        bad_finder.write_bad_log(self.logfile, self.books, self.books, index,
+                                 self.processes)
+
+    def start(self, books, pages):
+        """
+        Run the analyses over the loaded books and their pages, an iterable
+        of (url, content) pairs.
+        """
+        self.books = books
+        self.analyze(pages)
+        if self.logfile is None:
+            return
+        if site_caching.has_pages(self.cache, action='view'):
+            html_pages = site_caching.iter_pages(self.cache, action='view')
+        else:
+            html_pages = bookinfo.stream_book_pages(
+                books, action='view', jobs=self.jobs, cache=self.cache,
+                storage_format=self.storage_format,
+                rate_limit=self.rate_limit)
+        self.check_links(html_pages)
+
+    def linking_pages(self, urls):
+        """
+        Return the urls of the pages of the books which link to one of the
+        pages with the given urls according to the link graph stored in the
+        cache.
+        """
+        graph = link_graph.load_link_graph(self.cache)
+        if graph is None:
+            return []
+        ids = {url: page for (page, url) in enumerate(graph.urls)}
+        book_urls = {url for book in self.books for url in self.books[book]}
+        return [graph.urls[page] for page
+                in graph.linking_pages(ids[url] for url in urls if url in ids)
+                if graph.urls[page] in book_urls]
+
+    def poll(self):
+        """
+        Ask for the changes since the last poll. Return None if there are no
+        new changes. Otherwise return a pair of the changes and the state
+        after them, which are passed to process. The changes are the urls of
+        the pages which have to be fetched again and the urls of the pages
+        which were deleted or moved away as pair of lists or None if nothing
+        relevant changed. The state consists of the books, which are fetched
+        again if the sitemap was changed, the timestamp of the latest change
+        and the ids of the changes with this timestamp.
+        """
+        changes = [change for change
+                   in bookinfo.fetch_recent_changes(self.since,
+                                                    self.rate_limiter)
+                   if change['rcid'] not in self.seen_changes]
+        if not changes:
+            return None
+        # The changes are replayed from the oldest one on, so a page which
+        # was deleted and created again is fetched.
+        titles = set()
+        removed_titles = set()
+        for change in reversed(changes):
+            if (change.get('logtype'), change.get('logaction')) in \
+               REMOVING_LOG_ENTRIES:
+                removed_titles.add(change['title'])
+                titles.discard(change['title'])
+            else:
+                titles.add(change['title'])
+                removed_titles.discard(change['title'])
+            if change.get('logtype') == 'move':
+                target = change['logparams']['target_title']
+                titles.add(target)
+                removed_titles.discard(target)
+        books = self.books
+        sitemap = bookinfo.url_to_title('/wiki/' + bookinfo.SITEMAP_TITLE)
+        if sitemap in titles:
+            books = bookinfo.fetch_article_list()
+        latest = max(change['timestamp'] for change in changes)
+        seen_changes = set(self.seen_changes) if latest == self.since \
+            else set()
+        seen_changes.update(change['rcid'] for change in changes
+                            if change['timestamp'] == latest)
+        state = (books, latest, seen_changes)
+        old_urls = {url for book in self.books for url in self.books[book]}
+        urls = {url for book in books for url in books[book]}
+        changed = [url for url in urls
+                   if (url not in old_urls or
+                       bookinfo.url_to_title(url) in titles) and
+                   bookinfo.url_to_title(url) not in removed_titles]
+        removed = [url for url in urls.union(old_urls)
+                   if bookinfo.url_to_title(url) in removed_titles]
+        if not changed and not removed and urls == old_urls:
+            return (None, state)
+        return ((sorted(changed), sorted(removed)), state)
+
+    def process(self, changes, state):
+        """
+        Process the changes returned by poll with update and move on to the
+        state returned with them. If the update fails, the watcher stays at
+        the previous state, so the next poll returns the changes again.
+        """
+        previous_books = self.books
+        (self.books, since, seen_changes) = state
+        try:
+            if changes is not None:
+                self.update(*changes)
+        except Exception:
+            self.books = previous_books
+            raise
+        self.since = since
+        self.seen_changes = seen_changes
+
+    def update(self, changed, removed=()):
+        """
+        Remove the pages with the urls in removed from the cache, fetch the
+        pages with the urls in changed, store them in the cache and run the
+        analyses again. If the links are checked, the rendered pages linking
+        to the changed or removed pages are fetched again as well. Raise a
+        RuntimeError if pages couldn't be fetched for another reason than
+        that they don't exist.
+        """
+        print('{} pages changed.'.format(len(changed)))
+        if removed:
+            print('{} pages were deleted or moved.'.format(len(removed)))
+            site_caching.remove_pages(removed, cache=self.cache)
+        errors = {}
+        revisions = {}
+        pages = bookinfo.fetch_pages_via_api(changed, revisions=revisions,
+                                             errors=errors,
+                                             rate_limit=self.rate_limit)
+        site_caching.update_page_data(self.books, pages, cache=self.cache,
+                                      revisions=revisions,
+                                      storage_format=self.storage_format)
+        html_pages = {}
+        if self.logfile is not None:
+            view_urls = set(changed).union(self.linking_pages(
+                list(changed) + list(removed))).difference(removed)
+            html_pages = bookinfo.fetch_pages_from_list(
+                sorted(view_urls), action='view', jobs=self.jobs,
+                errors=errors, rate_limit=self.rate_limit,
+                page_postprocessor=lambda byte_string:
+                byte_string.decode('utf-8'))
+            site_caching.update_page_data(self.books, html_pages,
+                                          cache=self.cache,
+                                          storage_format=self.storage_format,
+                                          action='view')
+        bookinfo.print_errors(errors)
+        failed = bookinfo.failed_fetches(errors)
+        if failed:
+            raise RuntimeError('{} changed pages couldn\'t be fetched'.format(
+                len(failed)))
+        self.analyze(site_caching.CachedPages(self.cache), lookup_first=True)
+        if self.logfile is not None:
+            self.check_links(html_pages.items())
+
+    def watch(self, interval=DEFAULT_INTERVAL, polls=None):
+        """
+        Poll the recent changes every interval seconds and process them. Stop
+        after polls polls if it is not None.
+        """
+        while polls is None or polls > 0:
+            time.sleep(interval)
+            try:
+                polled = self.poll()
+                if polled is not None:
+                    self.process(*polled)
+            except Exception as error:  # pylint: disable=broad-except
+                print('Couldn\'t process the recent changes: {}'.format(
+                    error))
+            if polls is not None:
+                polls -= 1
+
+
+def main():
+    """Main program body."""
+    (opts_list, _) = getopt.getopt(sys.argv[1:],
+                                   OPTIONS + bookinfo.BOOK_OPTIONS,
+                                   bookinfo.BOOK_LONG_OPTIONS)
+    opts = dict(opts_list)
+    if '-c' not in opts:
+        print('Watching the changes requires a cache file (option -c).')
+        sys.exit(1)
+    if '--shard' in opts or '--partial' in opts:
+        print('Watching the changes cannot be split into shards.')
+        sys.exit(1)
+    names = analysis.parse_analyzer_names(opts)
+    output_format = record_writer.parse_output_format(opts)
+    polls = int(opts['-n']) if '-n' in opts else None
+
+    watcher = Watcher(names, opts['-c'], output_format=output_format,
+                      logfile=opts.get('-L'), jobs=int(opts.get('-j', 1)),
+                      storage_format=opts.get('-z', 'text'),
+                      rate_limit=bookinfo.parse_rate_limit(opts),
+                      processes=parallel.parse_processes(opts))
+    (books, pages, _) = bookinfo.book_argument_parser(OPTIONS, stream=True)
+    watcher.start(books, pages)
+    try:
+        watcher.watch(float(opts.get('-i', DEFAULT_INTERVAL)), polls)
+    except KeyboardInterrupt:
+        print('Stopped watching the changes.')
+
+
+if __name__ == '__main__':
+    main()